@@ -0,0 +1,199 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.metrics import time_difference
+
+# Columns identifying a GT trip and an OBA activity in the merged data
+GT_TRIP_COLS = ['GT_Collector', 'GT_TourID', 'GT_TripID']
+OBA_ACTIVITY_COLS = ['User ID', 'Trip ID']
+
+# Columns of the tolerance summary, one row for every tolerance
+SUMMARY_COLUMNS = ['tolerance', 'merged_rows', 'matched_rows', 'gt_trips', 'matched_trips', 'trip_match_rate',
+                   'matched_activities', 'median_time_difference', 'median_distance_difference', 'mode_accuracy']
+# Columns of the confusion between the GT modes and the Google activities of the matched rows of every tolerance
+CONFUSION_COLUMNS = ['tolerance', 'GT_Mode', 'Google Activity', 'count']
+
+
+def group_codes(data, columns):
+    """
+    :param data: dataframe
+    :param columns: columns identifying the groups
+    :return: int64 array with the group of every row, the rows with the same values of the columns have the same group
+    """
+    return data.groupby(columns, sort=False, dropna=False, observed=True).ngroup().to_numpy(dtype=np.int64)
+
+
+def median(values):
+    """
+    :param values: float array
+    :return: median of the values that are not NaN, NaN if there is none
+    """
+    values = values[~np.isnan(values)]
+    return float(np.median(values)) if len(values) else np.nan
+
+
+def tolerance_statistics(merged_data, tolerance):
+    """
+    Compute the statistics of the data merged with one tolerance from its columns, without the files saved.
+    :param merged_data: dataframe with the merged data, the rows with an 'Activity Start Date and Time* (UTC)' are
+    matched with an activity. When merging to many without repeating the GT rows, only GT_ALWAYS_REPEATED_COLS are set
+    on the rows after the first one of a bunch of matches, so the collector and the mode of the GT trip are taken from
+    the first row and the time differences from 'GT_DateTimeOrigUTC'
+    :param tolerance: tolerance (milliseconds) of the merged data
+    :return: tuple with the dict with the values of the summary of the tolerance (see SUMMARY_COLUMNS) and the
+    dataframe with the number of matched rows of every GT mode and Google activity (see CONFUSION_COLUMNS)
+    """
+    matched = merged_data['Activity Start Date and Time* (UTC)'].notna().to_numpy()
+    gt_data = merged_data[GT_TRIP_COLS + ['GT_Mode']].assign(
+        GT_Collector=merged_data['GT_Collector'].ffill(), GT_Mode=merged_data['GT_Mode'].ffill())
+    trips = group_codes(gt_data, GT_TRIP_COLS)
+    gt_modes = gt_data['GT_Mode'].astype(object).to_numpy()[matched]
+    oba_modes = merged_data['Google Activity'].astype(object).to_numpy()[matched]
+    matched_data = merged_data.loc[matched]
+    time_differences = time_difference(matched_data['Activity Start Date and Time* (UTC)'],
+                                       matched_data['GT_DateTimeOrigUTC'])
+
+    gt_trips = len(np.unique(trips))
+    matched_trips = len(np.unique(trips[matched]))
+    summary = {'tolerance': tolerance, 'merged_rows': len(merged_data), 'matched_rows': int(matched.sum()),
+               'gt_trips': gt_trips, 'matched_trips': matched_trips,
+               'trip_match_rate': matched_trips / gt_trips if gt_trips else 0.0,
+               'matched_activities': len(np.unique(group_codes(matched_data, OBA_ACTIVITY_COLS))),
+               'median_time_difference': median(time_differences),
+               'median_distance_difference': median(matched_data['Distance_Difference'].to_numpy(dtype=np.float64)),
+               'mode_accuracy': float((gt_modes == oba_modes).mean()) if len(gt_modes) else np.nan}
+
+    confusion = pd.DataFrame({'GT_Mode': gt_modes, 'Google Activity': oba_modes}) \
+        .groupby(['GT_Mode', 'Google Activity'], dropna=False).size().reset_index(name='count')
+    confusion.insert(0, 'tolerance', tolerance)
+    return summary, confusion
+
+
+class ToleranceAnalytics:
+    """
+    Accumulate the statistics of the data merged with every tolerance while it is merged and saved, so the match rate,
+    the median time and distance differences and the confusion between the GT modes and the Google activities can be
+    compared across tolerances without reading the merged data files.
+    """
+
+    def __init__(self):
+        self._summaries = []
+        self._confusions = []
+
+    def add(self, statistics):
+        """
+        Add the statistics of one tolerance.
+        :param statistics: tuple returned by tolerance_statistics, e.g. by a task run by a worker process
+        """
+        summary, confusion = statistics
+        self._summaries.append(summary)
+        self._confusions.append(confusion)
+
+    def summary(self):
+        """
+        :return: dataframe with the summary of every tolerance (see SUMMARY_COLUMNS), sorted by tolerance
+        """
+        return pd.DataFrame(self._summaries, columns=SUMMARY_COLUMNS).sort_values('tolerance', ignore_index=True)
+
+    def confusion(self):
+        """
+        :return: dataframe with the number of matched rows of every tolerance, GT mode and Google activity (see
+        CONFUSION_COLUMNS), sorted by tolerance
+        """
+        if not self._confusions:
+            return pd.DataFrame(columns=CONFUSION_COLUMNS)
+        confusion = pd.concat(self._confusions, ignore_index=True)
+        return confusion.sort_values('tolerance', kind='stable', ignore_index=True)
+
+    def save(self, output_path, writer, plots=False):
+        """
+        Save the summary and the confusion of every tolerance, and optionally plot them.
+        :param output_path: path to the output folder, created if it does not exist
+        :param writer: OutputWriter saving the tables
+        :param plots: True to save the plots (requires matplotlib)
+        """
+        os.makedirs(output_path, exist_ok=True)
+        summary = self.summary()
+        confusion = self.confusion()
+        writer.write(summary, output_path, constants.TOLERANCE_SUMMARY_FILE_NAME)
+        writer.write(confusion, output_path, constants.MODE_CONFUSION_FILE_NAME)
+        if plots:
+            plot_tolerance_summary(summary, os.path.join(output_path, constants.TOLERANCE_SUMMARY_FILE_NAME + '.png'))
+            plot_mode_confusion(confusion, os.path.join(output_path, constants.MODE_CONFUSION_FILE_NAME + '.png'))
+
+
+def plot_tolerance_summary(summary, file_path):
+    """
+    Plot the trip match rate, the mode accuracy and the median time and distance differences against the tolerance.
+    :param summary: dataframe returned by ToleranceAnalytics.summary
+    :param file_path: path to the image file
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    tolerance = summary['tolerance'] / 1000
+    fig, axes = plt.subplots(3, 1, sharex=True, figsize=(8, 10))
+    axes[0].plot(tolerance, summary['trip_match_rate'], marker='.', label='Trip match rate')
+    axes[0].plot(tolerance, summary['mode_accuracy'], marker='.', label='Mode accuracy')
+    axes[0].set_ylabel('Rate')
+    axes[0].legend()
+    axes[1].plot(tolerance, summary['median_time_difference'], marker='.')
+    axes[1].set_ylabel('Median time difference (s)')
+    axes[2].plot(tolerance, summary['median_distance_difference'], marker='.')
+    axes[2].set_ylabel('Median distance difference (m)')
+    axes[2].set_xlabel('Tolerance (s)')
+    fig.tight_layout()
+    fig.savefig(file_path)
+    plt.close(fig)
+
+
+def plot_mode_confusion(confusion, file_path):
+    """
+    Plot the confusion between the GT modes and the Google activities of the largest tolerance as a heatmap.
+    :param confusion: dataframe returned by ToleranceAnalytics.confusion
+    :param file_path: path to the image file
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    if len(confusion):
+        tolerance = confusion['tolerance'].max()
+        counts = confusion[confusion['tolerance'] == tolerance].astype({'GT_Mode': str, 'Google Activity': str}) \
+            .pivot_table(index='GT_Mode', columns='Google Activity', values='count', aggfunc='sum', fill_value=0)
+        image = ax.imshow(counts.to_numpy(), cmap='Blues')
+        ax.set_xticks(range(len(counts.columns)))
+        ax.set_xticklabels(counts.columns, rotation=45, ha='right')
+        ax.set_yticks(range(len(counts.index)))
+        ax.set_yticklabels(counts.index)
+        for (i, j), count in np.ndenumerate(counts.to_numpy()):
+            ax.text(j, i, str(count), ha='center', va='center')
+        fig.colorbar(image, ax=ax)
+        ax.set_title('Tolerance ' + str(tolerance / 1000) + ' s')
+    ax.set_xlabel('Google Activity')
+    ax.set_ylabel('GT_Mode')
+    fig.tight_layout()
+    fig.savefig(file_path)
+    plt.close(fig)
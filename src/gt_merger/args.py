@@ -21,13 +21,19 @@ import argparse
 from src.gt_merger import constants
 
 
-def get_parser():
+def get_parser(args=None):
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--obaFile', type=str, required=True, help='Path to CSV file exported from OBA Firebase '
                                                                    'Export App')
 
-    parser.add_argument('--gtFile', type=str, required=True, help='Path to XLSX file including the Ground Truth data')
+    parser.add_argument('--gtFile', type=str, required=True,
+                        help='Path to XLSX file including the Ground Truth data, or to a CSV or Parquet export of it')
+
+    parser.add_argument('--gtSheets', type=str, default="",
+                        help='Comma separated names of the sheets of the XLSX file to be read, e.g. one sheet for '
+                             'every collector, or ' + constants.GT_ALL_SHEETS + ' to read every sheet (default value: '
+                             'the first sheet)')
 
     parser.add_argument('--outputDir', type=str, default=constants.OUTPUT_DIR,
                         help='Path to directory where the merged data and log data will be output')
@@ -61,9 +67,158 @@ def get_parser():
     parser.add_argument('--no-repeatGtRows', dest='repeatGtRows', action='store_false')
     parser.set_defaults(mergeOneToOne=False)
 
+    parser.add_argument('--maxOriginDistance', type=float,
+                        help='Maximum distance (meters) between the origins of a ground truth trip and of its OBA '
+                             'activity. If it is set, the one to one merge pairs every trip with the activity of the '
+                             'same mode within the tolerance and this distance with the lowest time and distance cost')
+
+    parser.add_argument('--optimalAssignment', dest='optimalAssignment', action='store_true',
+                        help='When merging one to one, assign every OBA activity to at most one ground truth trip, '
+                             'matching as many trips as possible with the lowest total time difference')
+    parser.add_argument('--no-optimalAssignment', dest='optimalAssignment', action='store_false')
+    parser.set_defaults(optimalAssignment=False)
+
+    parser.add_argument('--globalTimeline', dest='globalTimeline', action='store_true',
+                        help='When merging one to one, search the activities of all the OBA devices at once on a '
+                             'single timeline and save the merged data in long format, a row for every matched ground '
+                             'truth trip and device and for every trip without a match')
+    parser.add_argument('--no-globalTimeline', dest='globalTimeline', action='store_false')
+    parser.set_defaults(globalTimeline=False)
+
+    parser.add_argument('--backend', type=str, default=constants.MERGE_BACKEND, choices=['pandas', 'sqlite'],
+                        help='Backend merging to many (default value ' + constants.MERGE_BACKEND + '). The sqlite '
+                             'backend merges the data on a file backed database in a temporary sub-folder of '
+                             'outputDir and streams the merged data to the output files, for data larger than memory')
+
     parser.add_argument('--deviceList', type=str, default="",
                         help='Path to txt file including white list of OBA devices to be used for match and merge')
 
-    args = parser.parse_args()
-
-    return args
+    parser.add_argument('--workers', type=int, default=constants.WORKERS,
+                        help='Number of worker processes (default value ' + str(constants.WORKERS) +
+                             ') merging the data of the collectors, or of the tolerances if iterateOverTol is used')
+
+    parser.add_argument('--writerThreads', type=int, default=constants.WRITER_THREADS,
+                        help='Number of threads (default value ' + str(constants.WRITER_THREADS) +
+                             ') writing the output files while the data of the next tolerance is merged, 0 to write '
+                             'every file before going on')
+
+    parser.add_argument('--maxPendingWrites', type=int, default=constants.MAX_PENDING_WRITES,
+                        help='Maximum number of output files (default value ' + str(constants.MAX_PENDING_WRITES) +
+                             ') queued or being written by the writer threads, the merge waits for one of them to '
+                             'finish before queuing another one, bounding the memory held by the pending files')
+
+    parser.add_argument('--chunkSize', type=int, default=constants.OBA_CHUNK_SIZE,
+                        help='Number of rows (default value ' + str(constants.OBA_CHUNK_SIZE) +
+                             ') read at once from the OBA data file')
+
+    parser.add_argument('--logLevel', type=str.upper, default=constants.LOG_LEVEL,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Level of the log messages (default value ' + constants.LOG_LEVEL +
+                             '), DEBUG prints the number of matches of every collector and device')
+
+    parser.add_argument('--profile', type=str, nargs='?', const='cprofile', default=None,
+                        choices=['cprofile', 'pyinstrument'],
+                        help='Profile the run and save the profile to the logs folder (cprofile by default)')
+
+    parser.add_argument('--outputFormat', type=str, default=constants.OUTPUT_FORMAT,
+                        choices=['csv', 'parquet', 'feather'],
+                        help='Format of the output data files (default value ' + constants.OUTPUT_FORMAT +
+                             '), parquet and feather require pyarrow')
+
+    parser.add_argument('--compression', type=str,
+                        help='Compression of the output data files, e.g. gzip for csv, snappy or zstd for parquet and '
+                             'lz4 or zstd for feather (default value: no compression for csv, snappy for parquet and '
+                             'lz4 for feather)')
+
+    parser.add_argument('--analytics', dest='analytics', action='store_true',
+                        help='Compute the match rate, the median time and distance differences and the confusion '
+                             'between the GT modes and the Google activities of every tolerance while the data is '
+                             'merged, and save them to the ' + constants.FOLDER_ANALYTICS + ' sub-folder of outputDir')
+    parser.add_argument('--no-analytics', dest='analytics', action='store_false')
+    parser.set_defaults(analytics=False)
+
+    parser.add_argument('--plots', dest='plots', action='store_true',
+                        help='Plot the analytics against the tolerance (requires matplotlib)')
+    parser.add_argument('--no-plots', dest='plots', action='store_false')
+    parser.set_defaults(plots=False)
+
+    parser.add_argument('--noCache', dest='noCache', action='store_true',
+                        help='Do not load or save preprocessed input data from the cache')
+    parser.set_defaults(noCache=False)
+
+    parser.add_argument('--cacheDir', type=str,
+                        help='Path to directory where preprocessed input data is cached (default value: the ' +
+                             constants.FOLDER_CACHE + ' sub-folder of outputDir)')
+
+    parser.add_argument('--cacheMaxSize', type=int, default=constants.CACHE_MAX_SIZE_MB,
+                        help='Maximum size (megabytes, default value ' + str(constants.CACHE_MAX_SIZE_MB) +
+                             ') of the cache directory, least recently used data is removed when it is exceeded')
+
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help='Preprocess and merge only the input rows that are new or changed since the last '
+                             'incremental run, and update the output files with them')
+    parser.set_defaults(incremental=False)
+
+    parser.add_argument('--stateDir', type=str,
+                        help='Path to directory where the state of the incremental merge is saved (default value: '
+                             'the ' + constants.FOLDER_STATE + ' sub-folder of outputDir)')
+
+    return parser.parse_args(args)
+
+
+def get_benchmark_parser(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the preprocess and merge stages on synthetic data')
+
+    parser.add_argument('--collectors', type=int, default=3, help='Number of collectors of the synthetic data')
+    parser.add_argument('--devices', type=int, default=6, help='Number of OBA devices of the synthetic data')
+    parser.add_argument('--days', type=int, default=3, help='Length (days) of the synthetic data collection campaign')
+    parser.add_argument('--tripsPerDay', type=int, default=8, help='Number of trips made by every collector every day')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data generator')
+
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs of every stage, the fastest one is reported')
+    parser.add_argument('--workers', type=int, default=constants.WORKERS,
+                        help='Number of worker processes used to merge the data')
+    parser.add_argument('--noMemory', dest='noMemory', action='store_true',
+                        help='Do not measure the peak memory of every stage')
+    parser.set_defaults(noMemory=False)
+    parser.add_argument('--quick', dest='quick', action='store_true',
+                        help='Skip the slow stages: the new processes, the xlsx readers and the merge variants')
+    parser.set_defaults(quick=False)
+
+    parser.add_argument('--output', type=str, default="",
+                        help='Path to the JSON file where the results are saved, by default a new file in ' +
+                             constants.BENCHMARK_DIR)
+    parser.add_argument('--compare', type=str, default="",
+                        help='Path to the JSON file with the results of a previous benchmark to compare with')
+
+    return parser.parse_args(args)
+
+
+def get_batch_parser(args=None):
+    parser = argparse.ArgumentParser(description='Run the merger for every job of a manifest')
+
+    parser.add_argument('--manifest', type=str, required=True,
+                        help='Path to the JSON (or YAML, if PyYAML is installed) manifest with the jobs: the input '
+                             'files and the options of every job, with the names of the matchAndMerge command line '
+                             'arguments')
+
+    parser.add_argument('--outputDir', type=str, default=constants.BATCH_OUTPUT_DIR,
+                        help='Path to directory where the output of every job (in a sub-folder named as the job), the '
+                             'logs of the jobs, the status file and the summary are saved (default value ' +
+                             constants.BATCH_OUTPUT_DIR + ')')
+
+    parser.add_argument('--workers', type=int, default=constants.WORKERS,
+                        help='Number of worker processes (default value ' + str(constants.WORKERS) +
+                             ') running the jobs in parallel, every job is then merged by a single process')
+
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Skip the jobs finished by a previous run with the same options and input files')
+    parser.add_argument('--no-resume', dest='resume', action='store_false')
+    parser.set_defaults(resume=True)
+
+    parser.add_argument('--logLevel', type=str.upper, default=constants.LOG_LEVEL,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Level of the log messages (default value ' + constants.LOG_LEVEL + ')')
+
+    return parser.parse_args(args)
@@ -0,0 +1,168 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import bisect
+
+import numpy as np
+
+from src.gt_merger.instrumentation import stage
+from src.gt_merger.interval_join import to_epoch_ns
+from src.gt_merger.metrics import haversine_distance, to_float_array
+from src.gt_merger.partition import sort_key
+from src.gt_merger.sweep import ToleranceSweep, match_keys, user_mode_keys
+
+
+def find_available(parent, i):
+    """
+    Find the first available position from i in a disjoint set forest, compressing the path followed.
+    :param parent: list with the next position to check for every position, the position itself if it is available
+    :param i: first position to check
+    :return: available position, or the position out of the forest (e.g. -1 or len(parent) - 1) where the path ends
+    """
+    root = i
+    while 0 <= root < len(parent) and parent[root] != root:
+        root = parent[root]
+    while 0 <= i < len(parent) and parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def assign_windows(starts, points, window):
+    """
+    Assign to every window [starts[i], starts[i] + window] at most one point inside it, each point to at most one
+    window, matching as many windows as possible with the lowest sum of (point - window start).
+    As all the windows have the same length, the cost only depends on which windows and points are matched: the
+    latest windows that can be matched together and the earliest points that can be matched together are found with
+    two sorted sweeps, and there is always a matching between both sets (Mendelsohn-Dulmage), the one pairing them
+    in order.
+    :param starts: int64 array with the start of every window
+    :param points: int64 array with the points, sorted in ascending order
+    :param window: length of the windows
+    :return: int64 array with the position of the point assigned to every window, -1 if none
+    """
+    starts_list = starts.tolist()
+    points_list = points.tolist()
+    # Windows from the latest one, each one takes the latest available point not after its end
+    previous_point = list(range(len(points_list)))
+    matched_windows = []
+    for i in sorted(range(len(starts_list)), key=lambda i: -starts_list[i]):
+        j = find_available(previous_point, bisect.bisect_right(points_list, starts_list[i] + window) - 1)
+        if j >= 0 and points_list[j] >= starts_list[i]:
+            matched_windows.append(i)
+            previous_point[j] = j - 1
+
+    # Points from the earliest one, each one takes the available window ending first among the ones containing it
+    order = sorted(range(len(starts_list)), key=lambda i: starts_list[i])
+    sorted_starts = [starts_list[i] for i in order]
+    next_window = list(range(len(order) + 1))
+    matched_points = []
+    for j, point in enumerate(points_list):
+        k = find_available(next_window, bisect.bisect_left(sorted_starts, point - window))
+        if k < len(order) and sorted_starts[k] <= point:
+            matched_points.append(j)
+            next_window[k] = k + 1
+
+    assigned = np.full(len(starts_list), -1, dtype=np.int64)
+    assigned[sorted(matched_windows, key=lambda i: starts_list[i])] = matched_points
+    return assigned
+
+
+class AssignmentSweep(ToleranceSweep):
+    """
+    Merge every GT trip and oba user with at most one activity of the same mode starting within the tolerance after
+    the GT trip start, like ToleranceSweep, but assigning every activity to at most one GT trip of any collector. The
+    assignment matches as many trips as possible with the lowest total time gap.
+    The forward candidates of ToleranceSweep are kept where no activity is claimed by more than one trip. The trips
+    of an oba user and mode are split into runs of overlapping windows, and only the runs with a conflict are assigned
+    again, so the memory used is proportional to the trips and activities, not to the candidate pairs.
+    """
+
+    def __init__(self, gt_data, oba_data):
+        """
+        :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+        :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+        """
+        super().__init__(gt_data, oba_data)
+        gt_orig, gt_modes, _, oba_modes = match_keys(gt_data, oba_data)
+        # Activity starts with the NaT values last, like the activities of every oba user in _user_rows
+        self._oba_start = sort_key(*to_epoch_ns(oba_data['Activity Start Date and Time* (UTC)']))
+        self._merged_starts = gt_orig[self._gt_positions]
+        self._merged_user_positions = self._merged_users()
+        self._merged_keys, self._oba_keys = user_mode_keys(self._merged_user_positions,
+                                                           gt_modes[self._gt_positions], self._user_rows, oba_modes)
+
+    def select(self, tolerance):
+        """
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: tuple with the boolean array flagging the merged rows with an assigned activity, and the position on
+        oba_data, time difference (seconds) and distance (meters) of the activity of every merged row
+        """
+        matched, candidates, time_differences, distances = super().select(tolerance)
+        claimed, counts = np.unique(candidates[matched], return_counts=True)
+        if not (counts > 1).any():
+            return matched, candidates, time_differences, distances
+        conflicts = matched & np.isin(candidates, claimed[counts > 1])
+
+        # Runs of merged rows of the same oba user and mode whose windows overlap, sorted by start
+        window = int(tolerance) * 1000000
+        valid_rows = np.flatnonzero(self._merged_keys >= 0)
+        order = valid_rows[np.lexsort((self._merged_starts[valid_rows], self._merged_keys[valid_rows]))]
+        sorted_keys = self._merged_keys[order]
+        sorted_starts = self._merged_starts[order]
+        run_starts = np.flatnonzero(np.r_[True, (sorted_keys[1:] != sorted_keys[:-1]) |
+                                          (sorted_starts[1:] - sorted_starts[:-1] > window)])
+        run_ends = np.r_[run_starts[1:], len(order)]
+        runs = np.empty(len(self._merged_keys), dtype=np.int64)
+        runs[order] = np.repeat(np.arange(len(run_starts)), run_ends - run_starts)
+
+        matched = matched.copy()
+        candidates = candidates.copy()
+        time_differences = time_differences.copy()
+        distances = distances.copy()
+        assigned_rows = []
+        with stage('assignment', conflicts=int(conflicts.sum())) as record:
+            conflict_runs = np.unique(runs[conflicts])
+            for run in conflict_runs:
+                rows = order[run_starts[run]:run_ends[run]]
+                key = sorted_keys[run_starts[run]]
+                # Activities of the oba user and mode starting in the windows of the run
+                user = self._user_rows[self._merged_user_positions[rows[0]]]
+                user_starts = self._oba_start[user]
+                lo = np.searchsorted(user_starts, sorted_starts[run_starts[run]], side='left')
+                hi = np.searchsorted(user_starts, sorted_starts[run_ends[run] - 1] + window, side='right')
+                activities = user[lo:hi][self._oba_keys[user[lo:hi]] == key]
+                assigned = assign_windows(self._merged_starts[rows], self._oba_start[activities], window)
+                matched[rows] = assigned >= 0
+                candidates[rows] = np.where(assigned >= 0, activities[assigned], -1)
+                assigned_rows.append(rows)
+            record['runs'] = len(conflict_runs)
+
+        # Time and distance differences of the merged rows assigned again
+        assigned_rows = np.concatenate(assigned_rows)
+        assigned_candidates = candidates[assigned_rows]
+        has_candidate = assigned_candidates >= 0
+        oba_positions = np.where(has_candidate, assigned_candidates, 0)
+        gt_positions = self._gt_positions[assigned_rows]
+        time_differences[assigned_rows] = np.where(
+            has_candidate, (self._oba_start[oba_positions] - self._merged_starts[assigned_rows]) / 1e9, np.nan)
+        distances[assigned_rows] = haversine_distance(
+            to_float_array(self._gt_data['GT_LatOrig'])[gt_positions],
+            to_float_array(self._gt_data['GT_LonOrig'])[gt_positions],
+            np.where(has_candidate, to_float_array(self._oba_data['Origin latitude (*best)'])[oba_positions], np.nan),
+            np.where(has_candidate, to_float_array(self._oba_data['Origin longitude (*best)'])[oba_positions], np.nan))
+        return matched, candidates, time_differences, distances
@@ -0,0 +1,260 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import csv
+import importlib.util
+import json
+import logging
+import os
+import time
+
+from src.gt_merger import constants
+from src.gt_merger.args import get_batch_parser, get_parser
+from src.gt_merger.matchAndMerge import run
+from src.gt_merger.parallel import map_in_pool
+
+logger = logging.getLogger(__name__)
+
+# Options of the jobs with paths, the relative paths are relative to the folder of the manifest
+PATH_OPTIONS = ['obaFile', 'gtFile', 'deviceList', 'outputDir', 'cacheDir', 'stateDir']
+# Options of the jobs with the input files, a finished job is run again if one of them changes
+INPUT_FILE_OPTIONS = ['obaFile', 'gtFile', 'deviceList']
+
+# Status of the jobs
+STATUS_FINISHED = 'finished'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+# Columns of the batch summary, the match counts and rates are returned by MergeSession.match_summary
+SUMMARY_COLUMNS = ['name', 'status', 'wall_time', 'gt_trips', 'matched_trips', 'trip_match_rate', 'oba_activities',
+                   'matched_activities', 'activity_match_rate', 'output_dir', 'log_file']
+
+
+def read_manifest(manifest_path):
+    """
+    :param manifest_path: path to the JSON or YAML (requires PyYAML) manifest
+    :return: dict with the 'jobs' of the manifest (list of dicts with the options of every job) and optionally the
+    'defaults' options of every job
+    """
+    with open(manifest_path) as f:
+        if manifest_path.lower().endswith(('.yaml', '.yml')):
+            if importlib.util.find_spec('yaml') is None:
+                raise ValueError("PyYAML is required to read YAML manifests, use a JSON manifest instead.")
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def job_arguments(options):
+    """
+    Convert the options of a job to matchAndMerge command line arguments.
+    :param options: dict with the values of the command line arguments by name, e.g. {'tolerance': 60000,
+    'mergeOneToOne': True}, the boolean options are set with True or False and the options set to None are ignored
+    :return: list of command line arguments
+    """
+    defaults = vars(get_parser(['--obaFile', '', '--gtFile', '']))
+    arguments = []
+    for name, value in options.items():
+        if name not in defaults:
+            raise ValueError("Unknown option: " + name)
+        if value is None or (isinstance(value, bool) and value == defaults[name]):
+            continue
+        if isinstance(value, bool):
+            arguments.append(('--' if value else '--no-') + name)
+        else:
+            arguments += ['--' + name, str(value)]
+    return arguments
+
+
+def load_jobs(manifest_path, output_dir):
+    """
+    Read the jobs of a manifest.
+    :param manifest_path: path to the manifest
+    :param output_dir: path to the output folder of the batch, the output of every job is saved to a sub-folder named
+    as the job unless the job has an 'outputDir'
+    :return: list of dicts with the 'name' and the command line 'arguments' of every job
+    """
+    manifest = read_manifest(manifest_path)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    for i, job in enumerate(manifest.get('jobs') or []):
+        options = dict(manifest.get('defaults') or {}, **job)
+        name = str(options.pop('name', 'job' + str(i + 1)))
+        for option in PATH_OPTIONS:
+            if options.get(option) is not None:
+                options[option] = os.path.join(manifest_dir, str(options[option]))
+        options.setdefault('outputDir', os.path.join(output_dir, name))
+        try:
+            arguments = job_arguments(options)
+            get_parser(arguments)
+        except (ValueError, SystemExit) as e:
+            raise ValueError("The options of the job " + name + " are not valid: " + str(e))
+        jobs.append({'name': name, 'arguments': arguments})
+
+    if not jobs:
+        raise ValueError("The manifest has no jobs.")
+    names = [job['name'] for job in jobs]
+    if len(set(names)) < len(names):
+        raise ValueError("The names of the jobs must be unique.")
+    return jobs
+
+
+def input_fingerprint(arguments):
+    """
+    :param arguments: command line arguments of a job
+    :return: dict with the size and the modification time of every input file of the job, None if it does not exist
+    """
+    command_line_args = vars(get_parser(arguments))
+    fingerprint = {}
+    for option in INPUT_FILE_OPTIONS:
+        path = command_line_args[option]
+        if path:
+            fingerprint[option] = [os.path.getsize(path), os.stat(path).st_mtime_ns] if os.path.isfile(path) else None
+    return fingerprint
+
+
+def load_status(status_path):
+    """
+    :param status_path: path to the status file of the batch
+    :return: dict with the status of every job run by the previous batch runs, by name
+    """
+    if not os.path.isfile(status_path):
+        return {}
+    with open(status_path) as f:
+        return json.load(f)
+
+
+def save_status(status_path, status):
+    """
+    Save the status of the jobs, replacing the status file at once so it is never left half written.
+    :param status_path: path to the status file of the batch
+    :param status: dict with the status of every job, by name
+    """
+    with open(status_path + '.tmp', 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(status_path + '.tmp', status_path)
+
+
+def run_job_task(job):
+    """
+    Run a job with the flow of the matchAndMerge command line, saving its log messages to the log file of the job.
+    :param job: dict with the 'name', the command line 'arguments', the 'inputs' fingerprint and the 'log_file' of
+    the job, and 'single_process' True to merge it with a single process
+    :return: tuple with the name and the status of the job: its 'status', 'arguments', 'inputs', 'wall_time' and the
+    'summary' of the matches if it finished
+    """
+    handler = logging.FileHandler(job['log_file'], mode='w')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.getLogger().addHandler(handler)
+    record = {'status': STATUS_FAILED, 'arguments': job['arguments'], 'inputs': job['inputs']}
+    start = time.perf_counter()
+    try:
+        logger.info("Running job %s", job['name'])
+        arguments = job['arguments'] + (['--workers', '1'] if job['single_process'] else [])
+        session = run(get_parser(arguments))
+        record.update(status=STATUS_FINISHED, summary=session.match_summary())
+    except SystemExit:
+        logger.error("Job %s failed, see the errors above.", job['name'])
+    except Exception:
+        logger.exception("Job %s failed.", job['name'])
+    finally:
+        record['wall_time'] = time.perf_counter() - start
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+    return job['name'], record
+
+
+def run_batch(manifest_path, output_dir=constants.BATCH_OUTPUT_DIR, workers=constants.WORKERS, resume=True):
+    """
+    Run the jobs of a manifest in a pool of worker processes, skipping the jobs finished by a previous run with the
+    same options and input files if resume is True. The status of every job is saved to the status file as soon as it
+    is done, so a batch stopped halfway resumes from the jobs not finished, and the summary of the batch is saved to a
+    csv file at the end.
+    :param manifest_path: path to the JSON or YAML manifest
+    :param output_dir: path to the output folder of the batch
+    :param workers: number of worker processes running the jobs
+    :param resume: False to run the finished jobs again
+    :return: list of dicts with the row of the summary of every job (see SUMMARY_COLUMNS)
+    """
+    jobs = load_jobs(manifest_path, output_dir)
+    logs_dir = os.path.join(output_dir, constants.FOLDER_LOGS)
+    os.makedirs(logs_dir, exist_ok=True)
+    status_path = os.path.join(output_dir, constants.BATCH_STATUS_FILE_NAME)
+    status = load_status(status_path) if resume else {}
+
+    pending_jobs = []
+    skipped_jobs = set()
+    for job in jobs:
+        # The worker processes of the pool can not start more processes
+        job['single_process'] = workers > 1 and get_parser(job['arguments']).workers > 1
+        if job['single_process']:
+            logger.warning("Job %s is merged by a single process, as the jobs are run in parallel.", job['name'])
+        job.update(inputs=input_fingerprint(job['arguments']), log_file=os.path.join(logs_dir, job['name'] + '.log'))
+        previous = status.get(job['name'])
+        if previous and previous['status'] == STATUS_FINISHED and previous['arguments'] == job['arguments'] \
+                and previous['inputs'] == job['inputs']:
+            logger.info("Job %s was already finished, it is skipped.", job['name'])
+            skipped_jobs.add(job['name'])
+        else:
+            pending_jobs.append(job)
+
+    for name, record in map_in_pool(run_job_task, pending_jobs, workers, {}, ordered=False):
+        status[name] = record
+        save_status(status_path, status)
+        logger.info("Job %s %s in %.1f seconds.", name, record['status'], record['wall_time'])
+
+    summary = []
+    for job in jobs:
+        record = status[job['name']]
+        row = dict(record.get('summary', {}), name=job['name'], wall_time=record['wall_time'],
+                   status=STATUS_SKIPPED if job['name'] in skipped_jobs else record['status'],
+                   output_dir=get_parser(job['arguments']).outputDir, log_file=job['log_file'])
+        summary.append({col: row.get(col) for col in SUMMARY_COLUMNS})
+    with open(os.path.join(output_dir, constants.BATCH_SUMMARY_FILE_NAME), 'w', newline='') as f:
+        summary_writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        summary_writer.writeheader()
+        summary_writer.writerows(summary)
+    return summary
+
+
+def main(args=None):
+    """
+    Run the batch from the command line.
+    :param args: list of command line arguments, the arguments of the process are used if it is None
+    """
+    command_line_args = get_batch_parser(args)
+    logging.basicConfig(level=command_line_args.logLevel, format='%(message)s')
+
+    if not os.path.isfile(command_line_args.manifest):
+        logger.error("Manifest file not found: %s", command_line_args.manifest)
+        exit()
+    try:
+        summary = run_batch(command_line_args.manifest, command_line_args.outputDir, command_line_args.workers,
+                            command_line_args.resume)
+    except ValueError as e:
+        logger.error(str(e))
+        exit()
+
+    counts = {status: sum(row['status'] == status for row in summary)
+              for status in [STATUS_FINISHED, STATUS_SKIPPED, STATUS_FAILED]}
+    logger.info("Jobs finished: %d, skipped: %d, failed: %d. Summary saved to %s", counts[STATUS_FINISHED],
+                counts[STATUS_SKIPPED], counts[STATUS_FAILED],
+                os.path.join(command_line_args.outputDir, constants.BATCH_SUMMARY_FILE_NAME))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.args import get_benchmark_parser
+from src.gt_merger.merging import merge, merge_to_many
+from src.gt_merger.preprocess import preprocess_gt_data, preprocess_oba_data
+from src.gt_merger.readers import read_gt_data, read_oba_data
+from src.gt_merger.synthetic import make_dataset
+from src.gt_merger.writers import is_output_format_available
+
+# Folder where the commands are run, the parent of the src package
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(function, repeat=1, trace_memory=True):
+    """
+    Time a function and measure the peak memory allocated while it runs.
+    :param function: function without arguments
+    :param repeat: number of timed runs, the fastest one is reported
+    :param trace_memory: if True, the function is run once more with tracemalloc to measure the peak memory
+    :return: tuple with the result of the function, the time (seconds) of the fastest run and the peak memory
+    (megabytes, None if it was not measured)
+    """
+    seconds = []
+    result = None
+    for _ in range(max(repeat, 1)):
+        # Hide the progress messages printed by the merge functions
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            seconds.append(time.perf_counter() - start)
+
+    peak_memory = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                function()
+            peak_memory = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+    return result, min(seconds), peak_memory
+
+
+def get_commit():
+    """
+    :return: hash of the current git commit, None if it is not available
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_command_line(args):
+    """
+    Run matchAndMerge in a new process, to time its startup, e.g. printing the help or failing on a missing file.
+    :param args: list of command line arguments
+    """
+    subprocess.run([sys.executable, '-m', 'src.gt_merger.matchAndMerge'] + args, cwd=ROOT_DIR,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_benchmark(collectors=3, devices=6, days=3, trips_per_day=8, seed=0, repeat=1, workers=1, trace_memory=True,
+                  quick=False):
+    """
+    Run every stage of the merger on a synthetic dataset.
+    :param collectors: number of collectors of the synthetic dataset
+    :param devices: number of devices of the synthetic dataset
+    :param days: length (days) of the synthetic data collection campaign
+    :param trips_per_day: number of trips made by every collector every day
+    :param seed: seed of the synthetic data generator
+    :param repeat: number of timed runs of every stage
+    :param workers: number of worker processes used by merge_to_many
+    :param trace_memory: if True, the peak memory of every stage is measured
+    :param quick: if True, the slow stages (the new processes, the xlsx readers and the merge variants) are skipped
+    :return: dictionary with the parameters, the size of the dataset and the time and peak memory of every stage
+    """
+    stages = {}
+
+    def run_stage(name, function, trace_stage_memory=True, rows=None):
+        result, seconds, peak_memory = measure(function, repeat, trace_memory and trace_stage_memory)
+        stages[name] = {'seconds': seconds, 'peak_memory_mb': peak_memory}
+        # The throughput of the readers is reported too
+        if rows is not None:
+            stages[name]['rows_per_second'] = rows / seconds if seconds else None
+        print("{:<16} {:>10.3f} s".format(name, seconds) +
+              ("" if peak_memory is None else " {:>10.1f} MB".format(peak_memory)) +
+              ("" if not stages[name].get('rows_per_second') else
+               " {:>12.0f} rows/s".format(stages[name]['rows_per_second'])))
+        return result
+
+    # The memory of the new processes is not traced
+    if not quick:
+        run_stage('startup_help', lambda: run_command_line(['--help']), False)
+        run_stage('startup_no_file', lambda: run_command_line(['--obaFile', 'missing.csv', '--gtFile', 'missing.xlsx']),
+                  False)
+    gt_data, oba_data = run_stage('generate', lambda: make_dataset(collectors, devices, days, trips_per_day, seed))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Ground truth data read from a xlsx workbook (by pd.read_excel, to compare with, and by read_gt_data) and from
+        # csv and parquet exports
+        gt_paths = {} if quick else {'xlsx': os.path.join(temp_dir, 'gt.xlsx')}
+        gt_paths['csv'] = os.path.join(temp_dir, 'gt.csv')
+        if not quick:
+            gt_data.to_excel(gt_paths['xlsx'], index=False)
+        gt_data.to_csv(gt_paths['csv'], index=False)
+        if is_output_format_available('parquet'):
+            gt_paths['parquet'] = os.path.join(temp_dir, 'gt.parquet')
+            gt_data.to_parquet(gt_paths['parquet'], index=False)
+        if not quick:
+            run_stage('read_gt_excel', lambda: pd.read_excel(gt_paths['xlsx']), rows=len(gt_data))
+        for gt_format, gt_path in gt_paths.items():
+            run_stage('read_gt_' + gt_format, lambda: read_gt_data(gt_path), rows=len(gt_data))
+
+        csv_path = os.path.join(temp_dir, 'oba.csv')
+        oba_data.to_csv(csv_path, index=False)
+        oba_data = run_stage('read_oba_csv', lambda: read_oba_data(csv_path, [], True), rows=len(oba_data))
+    clean_gt_data, _ = run_stage('preprocess_gt', lambda: preprocess_gt_data(gt_data.copy(), True))
+    clean_oba_data, _ = run_stage('preprocess_oba', lambda: preprocess_oba_data(
+        oba_data, constants.MIN_ACTIVITY_DURATION, constants.MIN_TRIP_LENGTH, True))
+    run_stage('merge', lambda: merge(clean_gt_data, clean_oba_data, constants.TOLERANCE))
+    # The merge variants are timed against the same preprocessed data as merge
+    if not quick:
+        run_stage('merge_spatial', lambda: merge(clean_gt_data, clean_oba_data, constants.TOLERANCE,
+                                                 constants.BENCHMARK_MAX_ORIGIN_DISTANCE))
+        run_stage('merge_assignment', lambda: merge(clean_gt_data, clean_oba_data, constants.TOLERANCE,
+                                                    optimal_assignment=True))
+        run_stage('merge_to_many', lambda: merge_to_many(clean_gt_data, clean_oba_data, constants.TOLERANCE, workers))
+
+    return {
+        'commit': get_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'parameters': {'collectors': collectors, 'devices': devices, 'days': days, 'trips_per_day': trips_per_day,
+                       'seed': seed, 'repeat': repeat, 'workers': workers, 'quick': quick},
+        'rows': {'gt': len(gt_data), 'oba': len(oba_data)},
+        'stages': stages,
+    }
+
+
+def compare_results(results, previous_results):
+    """
+    Print the time of every stage compared with the time of a previous benchmark.
+    :param results: dictionary returned by run_benchmark
+    :param previous_results: dictionary returned by run_benchmark for a previous commit
+    """
+    if results['parameters'] != previous_results['parameters']:
+        print("Warning: the benchmarks were run with different parameters.")
+    print("Comparison with commit", previous_results.get('commit'))
+    for name, stage in results['stages'].items():
+        previous_stage = previous_results['stages'].get(name)
+        if not previous_stage:
+            continue
+        ratio = stage['seconds'] / previous_stage['seconds'] if previous_stage['seconds'] else float('nan')
+        print("{:<16} {:>10.3f} s {:>10.3f} s {:>8.2f}x".format(name, previous_stage['seconds'], stage['seconds'],
+                                                                ratio))
+
+
+def main(args=None):
+    """
+    Run the benchmark from the command line.
+    :param args: list of command line arguments, the arguments of the process are used if it is None
+    """
+    command_line_args = get_benchmark_parser(args)
+    results = run_benchmark(command_line_args.collectors, command_line_args.devices, command_line_args.days,
+                            command_line_args.tripsPerDay, command_line_args.seed, command_line_args.repeat,
+                            command_line_args.workers, not command_line_args.noMemory, command_line_args.quick)
+
+    output_path = command_line_args.output
+    if not output_path:
+        output_path = os.path.join(constants.BENCHMARK_DIR, 'benchmark_' + (results['commit'] or 'unknown')[:10] +
+                                   '_' + results['date'].replace(':', '') + '.json')
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Benchmark results saved to", output_path)
+
+    if command_line_args.compare:
+        with open(command_line_args.compare) as f:
+            compare_results(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+
+# Names of the parquet files saved for each cache entry
+CLEAN_DATA_FILE_NAME = "clean.parquet"
+DROPPED_DATA_FILE_NAME = "dropped.parquet"
+# Key of the metadata of the parquet files with the dtypes of the saved dataframe, see save_frame
+FRAME_DTYPES_METADATA_KEY = b'gt_merger.dtypes'
+
+logger = logging.getLogger(__name__)
+
+
+def is_cache_available():
+    """
+    :return: True if pyarrow, required to read and write parquet files, is installed
+    """
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def file_hash(file_path, block_size=1 << 20):
+    """
+    :param file_path: path to the file
+    :param block_size: number of bytes read at once
+    :return: hex digest of the SHA-256 hash of the file content
+    """
+    file_digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_digest.update(block)
+    return file_digest.hexdigest()
+
+
+def frame_dtypes(data):
+    """
+    :param data: dataframe
+    :return: dictionary with the dtypes that parquet files do not keep, serializable to JSON: the categories, the type
+    of the categories and the order flag of every categorical column, and the object columns
+    """
+    dtypes = {}
+    for col, dtype in data.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtypes[col] = {'type': 'category', 'categories': dtype.categories.tolist(),
+                           'categories_type': str(dtype.categories.dtype), 'ordered': dtype.ordered}
+        elif dtype == object:
+            dtypes[col] = {'type': 'object'}
+    return dtypes
+
+
+def save_frame(data, file_path):
+    """
+    Save a dataframe to a parquet file, with the dtypes returned by frame_dtypes in the metadata of the file so
+    load_frame returns the same dtypes. The object columns with integers and missing values (e.g. the GT columns masked
+    on the repeated rows of the data merged to many) are saved as nullable integers, instead of floats.
+    :param data: dataframe
+    :param file_path: path to the parquet file
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    dtypes = frame_dtypes(data)
+    integer_cols = [col for col, dtype in dtypes.items()
+                    if dtype['type'] == 'object' and pd.api.types.infer_dtype(data[col], skipna=True) == 'integer']
+    table = pa.Table.from_pandas(data.astype({col: 'Int64' for col in integer_cols}))
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           FRAME_DTYPES_METADATA_KEY: json.dumps(dtypes).encode()})
+    pq.write_table(table, file_path)
+
+
+def load_frame(file_path):
+    """
+    :param file_path: path to a parquet file saved by save_frame
+    :return: dataframe with the dtypes of the saved dataframe
+    """
+    import pyarrow.parquet as pq
+    table = pq.read_table(file_path)
+    dtypes = json.loads(table.schema.metadata[FRAME_DTYPES_METADATA_KEY])
+    data = table.to_pandas()
+    for col, dtype in dtypes.items():
+        if dtype['type'] == 'category':
+            # Parquet files do not keep the categories that are not strings (e.g. 'Region ID') nor the categorical
+            # columns without values
+            data[col] = data[col].astype(pd.CategoricalDtype(
+                pd.Index(dtype['categories'], dtype=dtype['categories_type']), dtype['ordered']))
+        else:
+            # The missing values are read as None, or as pd.NA for the integers saved as nullable integers
+            values = data[col].astype(object)
+            data[col] = values.where(values.notna(), np.nan)
+    return data
+
+
+class PreprocessCache:
+    """
+    On-disk cache of preprocessed dataframes (clean data and dropped data) stored as parquet files. Each entry is keyed
+    by the content of the input file and the preprocess parameters, and the least recently used entries are evicted when
+    the cache grows over its maximum size.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=constants.CACHE_MAX_SIZE_MB):
+        """
+        :param cache_dir: path to the folder where the cache entries are saved
+        :param max_size_mb: maximum size (megabytes) of the cache folder
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(file_path, **params):
+        """
+        :param file_path: path to the input data file
+        :param params: preprocess parameters, they must be serializable to JSON
+        :return: key of the cache entry for the file and parameters
+        """
+        key_digest = hashlib.sha256()
+        key_digest.update(str(constants.CACHE_VERSION).encode())
+        key_digest.update(file_hash(file_path).encode())
+        key_digest.update(json.dumps(params, sort_keys=True).encode())
+        return key_digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        :param key: key returned by get_key
+        :return: tuple with the clean and dropped dataframes, None if the entry is not in the cache
+        """
+        entry_path = self._entry_path(key)
+        if not os.path.isdir(entry_path):
+            return None
+        try:
+            clean_data = load_frame(os.path.join(entry_path, CLEAN_DATA_FILE_NAME))
+            dropped_data = load_frame(os.path.join(entry_path, DROPPED_DATA_FILE_NAME))
+        except (OSError, ValueError, TypeError, KeyError, NotImplementedError):
+            # Remove damaged entries
+            shutil.rmtree(entry_path, ignore_errors=True)
+            return None
+        # Mark the entry as recently used
+        os.utime(entry_path)
+        return clean_data, dropped_data
+
+    def store(self, key, clean_data, dropped_data):
+        """
+        Save the preprocessed dataframes and evict old entries if required.
+        :param key: key returned by get_key
+        :param clean_data: dataframe with the preprocessed data
+        :param dropped_data: dataframe with the data dropped during the preprocess
+        :return: True if the entry was saved, False if the data can not be saved as parquet
+        """
+        temp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+        try:
+            save_frame(clean_data, os.path.join(temp_path, CLEAN_DATA_FILE_NAME))
+            save_frame(dropped_data, os.path.join(temp_path, DROPPED_DATA_FILE_NAME))
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+            os.replace(temp_path, self._entry_path(key))
+        except (OSError, ValueError, TypeError, NotImplementedError) as e:
+            logger.warning("Preprocessed data could not be cached: %s", e)
+            shutil.rmtree(temp_path, ignore_errors=True)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the size of the cache is not greater than its maximum size.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_path = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or not os.path.isdir(entry_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_path, f)) for f in os.listdir(entry_path))
+            entries.append((os.path.getmtime(entry_path), size, entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total_size -= size
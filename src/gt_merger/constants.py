@@ -24,14 +24,73 @@ MIN_TRIP_LENGTH = 20
 # Default maximum tolerated difference (milliseconds) between matched ground truth data activity and OBA data activity'
 TOLERANCE = 3600000
 
+# Default level of the log messages printed while running
+LOG_LEVEL = 'INFO'
+
+# Default number of worker processes used to merge the data
+WORKERS = 1
+
+# Folder (inside the output folder) where preprocessed input data is cached
+FOLDER_CACHE = 'cache'
+# Default maximum size (megabytes) of the cache folder
+CACHE_MAX_SIZE_MB = 2048
+# Version of the preprocessed data format, increase it to invalidate cached data after changing the preprocess
+CACHE_VERSION = 6
+
+# Folder (inside the output folder) where the state of the incremental merge is saved
+FOLDER_STATE = 'state'
+# Version of the incremental merge state format, increase it to discard saved states after changing the merge
+STATE_VERSION = 3
+# Columns identifying a GT trip and an OBA activity between versions of the input data files
+GT_KEY_COLS_LIST = ['GT_Collector', 'GT_TourID', 'GT_TripID']
+OBA_KEY_COLS_LIST = ['User ID', 'Trip ID']
+# Value of the list of GT sheets to read every sheet of the GT workbook
+GT_ALL_SHEETS = '*'
+
+# Default number of rows read at once from the OBA csv file
+OBA_CHUNK_SIZE = 100000
+
+# Default backend merging the data to many: pandas (in memory) or sqlite (file backed, the merged data is streamed to
+# the output files)
+MERGE_BACKEND = 'pandas'
+# File name of the database of the sqlite backend, created in a temporary sub-folder of the output folder
+SQL_DATABASE_FILE_NAME = 'merge.sqlite'
+# Number of merged rows read at once from the database of the sqlite backend and written to the output files
+SQL_CHUNK_SIZE = 100000
+
+# Default number of threads writing the output files while the data is merged, 0 to write them before going on
+WRITER_THREADS = 2
+# Default maximum number of output files queued or being written, further writes wait for one of them to finish
+MAX_PENDING_WRITES = 4
+
+# Folder used to save the benchmark results
+BENCHMARK_DIR = 'benchmark_results'
+# Maximum distance (meters) between the origins of a GT trip and of its activity in the spatio-temporal benchmark stage
+BENCHMARK_MAX_ORIGIN_DISTANCE = 500
+
+# Folder used to save the output of the jobs of a batch run, the status of the jobs and the summary of the batch
+BATCH_OUTPUT_DIR = 'batch_output'
+BATCH_STATUS_FILE_NAME = 'batch_status.json'
+BATCH_SUMMARY_FILE_NAME = 'batch_summary.csv'
+
 # Folders to save logs an merged data
 FOLDER_LOGS = 'logs'
 FOLDER_MERGED_DATA = 'merged_data'
+FOLDER_ANALYTICS = 'analytics'
 
-# File names for logs and output
-GT_DROPPED_DATA_FILE_NAME = "droppedGtData.csv"
-OBA_DROPPED_DATA_FILE_NAME = "droppedObaData.csv"
+# File names for logs and output, the extension of the data files depends on the output format
+GT_DROPPED_DATA_FILE_NAME = "droppedGtData"
+OBA_DROPPED_DATA_FILE_NAME = "droppedObaData"
+RUN_REPORT_FILE_NAME = "run_report.json"
+PROFILE_FILE_NAME = "profile"
 MERGED_DATA_FILE_NAME = "mergedData"
+NUM_MATCHES_FILE_NAME = "num_matches"
+UNMATCHED_DATA_FILE_NAME = "oba_records_without_match_on_GT"
+TOLERANCE_SUMMARY_FILE_NAME = "tolerance_summary"
+MODE_CONFUSION_FILE_NAME = "mode_confusion"
+
+# Default format of the output data files: csv, parquet or feather
+OUTPUT_FORMAT = 'csv'
 
 # List of columns where NaN values are not allowed
 OBA_RELEVANT_COLS_LIST = ['Activity Start Date and Time* (UTC)', 'Origin location Date and Time (*best) (UTC)',
@@ -39,6 +98,23 @@ OBA_RELEVANT_COLS_LIST = ['Activity Start Date and Time* (UTC)', 'Origin locatio
                           'Destination Location Date and Time (*best) (UTC)']
 GT_RELEVANT_COLS_LIST = ['GT_Date', 'GT_TimeOrig', 'GT_TimeDest']
 
+# Column of the dropped data logs with the reason why each row was dropped, and the reasons
+DROP_REASON_COL = 'Drop Reason'
+DROP_REASON_STILL = 'STILL mode'
+DROP_REASON_NAN = 'NaN in '
+DROP_REASON_TOO_SHORT = 'Activity too short'
+DROP_REASON_TOO_NEAR = 'Trip too near'
+
+# Columns of the OBA csv file parsed as datetimes and format of the datetimes exported by OBA Firebase Export App
+OBA_DATETIME_COLS_LIST = ['Activity Start Date and Time* (UTC)', 'Origin location Date and Time (*best) (UTC)',
+                          'Destination Location Date and Time (*best) (UTC)']
+OBA_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Columns of the OBA csv file always loaded as strings
+OBA_STRING_COLS_LIST = ['User ID', 'Google Activity', 'Origin Location Provider (*best)',
+                        'Destination Location Provider (*best)']
+# Columns of OBA_NEW_COLUMNS_ORDER added during the merge, they are not in the OBA csv file
+OBA_COMPUTED_COLS_LIST = ['Manual Assignment', 'Time_Difference', 'Distance_Difference', 'GT_DateTimeOrigUTC']
+
 # Boolean to generate results in tolerance ranges every N milliseconds up to the TOLERANCE value
 CALCULATE_EVERY_N_SECS = 30000
 
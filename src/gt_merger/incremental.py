@@ -0,0 +1,418 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.cache import load_frame, save_frame
+from src.gt_merger.interval_join import (GT_ALWAYS_REPEATED_COLS, expand_windows, matched_bitmap, to_epoch_ns,
+                                         window_bounds)
+from src.gt_merger.metrics import add_differences
+from src.gt_merger.partition import PartitionIndex
+
+# Internal columns added to the data kept in the state: hash of the key of the row and oba user of the number of
+# matches (its 'User ID' column only has the last 4 characters)
+KEY_COL = '_key'
+USER_COL = '_user'
+STATE_COLS_LIST = [KEY_COL, USER_COL]
+
+# Name of the file with the version and parameters of the state, the dataframes are saved as parquet files
+STATE_FILE_NAME = "state.json"
+
+logger = logging.getLogger(__name__)
+
+
+def row_hashes(data):
+    """
+    :param data: dataframe
+    :return: uint64 array with a hash of the values of every row
+    """
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+def without_state_columns(data):
+    """
+    :param data: dataframe kept in the state
+    :return: dataframe without the internal columns of the state, to be saved to the output files
+    """
+    return data.drop(columns=[col for col in STATE_COLS_LIST if col in data.columns])
+
+
+class RowStore:
+    """
+    Preprocessed rows (clean and dropped) of an input data file, identified by the hash of their key columns. The hash
+    of every raw row is kept to find the rows that are new or changed in the next version of the file, so only those
+    rows are preprocessed again.
+    """
+
+    def __init__(self, key_cols):
+        """
+        :param key_cols: list of columns identifying a row, e.g. constants.GT_KEY_COLS_LIST
+        """
+        self.key_cols = key_cols
+        # Key hash and raw row hash of every row, in the order of the input data
+        self.rows = pd.DataFrame({KEY_COL: np.empty(0, np.uint64), 'content': np.empty(0, np.uint64)})
+        self.clean = None
+        self.dropped = None
+
+    def _sorted(self, data):
+        """ Rows of data sorted like self.rows """
+        order = pd.Index(self.rows[KEY_COL]).get_indexer(data[KEY_COL])
+        return data.take(np.argsort(order, kind='stable')).reset_index(drop=True)
+
+    def update(self, raw_data, preprocess):
+        """
+        Preprocess the rows of raw_data that are new or changed and replace the stored rows with the same key. Stored
+        rows missing in raw_data are kept, so raw_data can be the whole input file or only the rows added to it. The
+        stored rows missing in raw_data are sorted first, followed by the rows of raw_data in the same order, so the
+        result is the same as preprocessing the whole file, or the concatenation of the files added so far.
+        :param raw_data: dataframe loaded from the input data file
+        :param preprocess: function receiving a dataframe and returning the clean rows and the dropped rows
+        :return: tuple with the key hashes of the new and changed rows and the clean rows that they replaced
+        """
+        keys = row_hashes(raw_data[self.key_cols])
+        contents = row_hashes(raw_data)
+        # Keep the last version of duplicated keys
+        last = ~pd.Series(keys).duplicated(keep='last').to_numpy()
+        if not last.all():
+            logger.warning("%d rows with a duplicated %s are replaced by the last one.", (~last).sum(),
+                           " + ".join(self.key_cols))
+            raw_data, keys, contents = raw_data[last], keys[last], contents[last]
+
+        stored_positions = pd.Index(self.rows[KEY_COL]).get_indexer(keys)
+        known = stored_positions >= 0
+        updated = ~known
+        updated[known] = self.rows['content'].to_numpy()[stored_positions[known]] != contents[known]
+        updated_keys = keys[updated]
+
+        missing = np.ones(len(self.rows), dtype=bool)
+        missing[stored_positions[known]] = False
+        self.rows = pd.concat([self.rows[missing], pd.DataFrame({KEY_COL: keys, 'content': contents})],
+                              ignore_index=True)
+
+        replaced_rows = None
+        if self.clean is not None:
+            replaced_rows = self.clean[self.clean[KEY_COL].isin(updated_keys)]
+            self.clean = self.clean[~self.clean[KEY_COL].isin(updated_keys)]
+            self.dropped = self.dropped[~self.dropped[KEY_COL].isin(updated_keys)]
+        if updated.any() or self.clean is None:
+            new_clean, new_dropped = preprocess(raw_data[updated].assign(**{KEY_COL: updated_keys}))
+            self.clean = new_clean if self.clean is None else pd.concat([self.clean, new_clean])
+            self.dropped = new_dropped if self.dropped is None else pd.concat([self.dropped, new_dropped])
+        self.clean = self._sorted(self.clean)
+        self.dropped = self._sorted(self.dropped)
+        return updated_keys, replaced_rows
+
+    def save(self, folder, name):
+        save_frame(self.rows, os.path.join(folder, name + '_rows.parquet'))
+        save_frame(self.clean, os.path.join(folder, name + '_clean.parquet'))
+        save_frame(self.dropped, os.path.join(folder, name + '_dropped.parquet'))
+
+    def load(self, folder, name):
+        self.rows = load_frame(os.path.join(folder, name + '_rows.parquet'))
+        self.clean = load_frame(os.path.join(folder, name + '_clean.parquet'))
+        self.dropped = load_frame(os.path.join(folder, name + '_dropped.parquet'))
+
+
+def merge_pairs(gt_data, oba_index, users, repeat_gt_rows):
+    """
+    Merge to many the trips of gt_data with the activities of some oba users, like merge_user_to_many for every
+    collector and oba user but in one vectorized pass, so the time depends on the number of trips instead of the number
+    of collectors and oba users. The key of the trip is added to the results, so they can be replaced by the next
+    incremental run.
+    :param gt_data: dataframe with the preprocessed GT trips to be merged
+    :param oba_index: PartitionIndex of the preprocessed oba data by 'User ID'
+    :param users: list of oba users to be merged
+    :param repeat_gt_rows: boolean value to indicate if the GT data must be repeated on every row of a bunch of matches
+    :return: dataframe with the merged data and dataframe with the number of matches by GT trip and oba user
+    """
+    gt_index = PartitionIndex(gt_data, 'GT_Collector', 'GT_DateTimeOrigUTC')
+    users = np.asarray(users, dtype=object)
+    starts, valid_starts = to_epoch_ns(oba_index.data['Activity Start Date and Time* (UTC)'])
+    window_starts, valid_orig = to_epoch_ns(gt_index.data['GT_DateTimeOrigUTC'])
+    window_ends, valid_dest = to_epoch_ns(gt_index.data['GT_DateTimeDestUTC'])
+    valid_windows = valid_orig & valid_dest
+
+    # Activities of every oba user (positions on oba_index.data) matched by every trip
+    lo = np.empty((len(users), len(gt_data)), dtype=np.int64)
+    hi = np.empty((len(users), len(gt_data)), dtype=np.int64)
+    for user_position, oba_user in enumerate(users):
+        oba_start, oba_end = oba_index.range(oba_user)
+        # NaT values are sorted last and never match
+        num_valid = int(valid_starts[oba_start:oba_end].sum())
+        user_lo, user_hi = window_bounds(starts[oba_start:oba_start + num_valid], window_starts, window_ends)
+        lo[user_position] = user_lo + oba_start
+        hi[user_position] = np.where(valid_windows, user_hi, user_lo) + oba_start
+
+    # Pairs of trip and oba user sorted by collector, oba user and trip start time
+    pair_trips = []
+    pair_users = []
+    for collector in gt_index.keys:
+        gt_start, gt_end = gt_index.range(collector)
+        pair_trips.append(np.tile(np.arange(gt_start, gt_end), len(users)))
+        pair_users.append(np.repeat(np.arange(len(users)), gt_end - gt_start))
+    pair_trips = np.concatenate(pair_trips) if pair_trips else np.empty(0, dtype=np.int64)
+    pair_users = np.concatenate(pair_users) if pair_users else np.empty(0, dtype=np.int64)
+    pair_lo = lo[pair_users, pair_trips]
+    pair_hi = hi[pair_users, pair_trips]
+    pair_positions, point_positions, offsets = expand_windows(pair_lo, pair_hi)
+
+    # Repeat each GT trip as many times as matches were found (at least once)
+    gt_block = gt_index.data.take(pair_trips[pair_positions]).reset_index(drop=True)
+    gt_block['GT_DateTimeOrigUTC_Backup'] = gt_block['GT_DateTimeOrigUTC']
+    # Remove (Fill with NaN) repeated GT rows unless required no to
+    repeated = offsets > 0
+    if not repeat_gt_rows and repeated.any():
+        for col in gt_block.columns.difference(GT_ALWAYS_REPEATED_COLS):
+            if gt_block[col].dtype.kind in 'iub':
+                gt_block[col] = gt_block[col].astype(object)
+            gt_block[col] = gt_block[col].mask(repeated)
+    gt_block[KEY_COL] = gt_index.data[KEY_COL].to_numpy()[pair_trips[pair_positions]]
+
+    oba_block = oba_index.data.reset_index(drop=True).reindex(point_positions).reset_index(drop=True)
+    merged_df = pd.concat([gt_block, oba_block], axis=1)
+    # Make sure the bunch of matches has the 'User Id' even for the empty rows
+    merged_df['User ID'] = users[pair_users[pair_positions]]
+    merged_df = add_differences(merged_df)
+
+    # Number of matches by GT trip and oba user
+    matches_df = gt_index.data.take(pair_trips).reset_index(drop=True)
+    matches_df['User ID'] = [oba_user[-4:] for oba_user in users[pair_users]]
+    matches_df['GT_NumberOfTransitions'] = pair_hi - pair_lo
+    matches_df[USER_COL] = users[pair_users]
+    return merged_df, matches_df
+
+
+def unmatched_activities(gt_data, oba_data):
+    """
+    Find the oba activities without a match on the trips of every collector, like merge_to_many but without merging.
+    :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+    :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+    :return: dataframe with the oba activities without a match on GT data
+    """
+    gt_index = PartitionIndex(gt_data, 'GT_Collector', 'GT_DateTimeOrigUTC')
+    oba_index = PartitionIndex(oba_data, 'User ID', 'Activity Start Date and Time* (UTC)')
+    # Convert the datetimes once instead of once per collector and oba user
+    starts, valid_starts = to_epoch_ns(oba_index.data['Activity Start Date and Time* (UTC)'])
+    window_starts, valid_orig = to_epoch_ns(gt_index.data['GT_DateTimeOrigUTC'])
+    window_ends, valid_dest = to_epoch_ns(gt_index.data['GT_DateTimeDestUTC'])
+    valid_windows = valid_orig & valid_dest
+
+    positions = []
+    collectors = []
+    for collector in gt_index.keys:
+        gt_start, gt_end = gt_index.range(collector)
+        for oba_user in oba_index.keys:
+            oba_start, oba_end = oba_index.range(oba_user)
+            # NaT values are sorted last and never match
+            num_valid = int(valid_starts[oba_start:oba_end].sum())
+            lo, hi = window_bounds(starts[oba_start:oba_start + num_valid], window_starts[gt_start:gt_end],
+                                   window_ends[gt_start:gt_end])
+            hi = np.where(valid_windows[gt_start:gt_end], hi, lo)
+            unmatched = np.flatnonzero(~matched_bitmap(lo, hi, oba_end - oba_start)) + oba_start
+            positions.append(unmatched)
+            collectors.append(np.full(len(unmatched), collector, dtype=object))
+
+    unmatched_df = oba_index.data.take(np.concatenate(positions) if positions else np.empty(0, dtype=np.int64))
+    unmatched_df = unmatched_df[constants.OBA_UNMATCHED_NEW_COLUMNS_ORDER].reset_index(drop=True)
+    unmatched_df['User ID'] = unmatched_df['User ID'].str[-4:]
+    unmatched_df.insert(loc=0, column='GT_Collector',
+                        value=np.concatenate(collectors) if collectors else np.empty(0, dtype=object))
+    return unmatched_df
+
+
+class IncrementalState:
+    """
+    State of the incremental merge saved between runs: the preprocessed GT trips and oba activities and the data merged
+    to many. On every run only the input rows that are new or changed since the last run are preprocessed, and only the
+    GT trips whose matches can change (new and changed trips and trips overlapping a new, changed or replaced activity)
+    are merged again; the results of the other trips are reused.
+    """
+
+    def __init__(self, state_dir, **params):
+        """
+        :param state_dir: path to the folder where the state is saved
+        :param params: parameters of the preprocess and the merge, the saved state is discarded if they change
+        """
+        self.state_dir = state_dir
+        self.params = params
+        self.gt = RowStore(constants.GT_KEY_COLS_LIST)
+        self.oba = RowStore(constants.OBA_KEY_COLS_LIST)
+        # Data merged to many, with the key of the trip and the oba user of every row
+        self.merged = None
+        self.matches = None
+        # Trips and activity start times (nanoseconds since epoch) updated since the data was merged
+        self._updated_trips = np.empty(0, dtype=np.uint64)
+        self._updated_times = np.empty(0, dtype=np.int64)
+
+    def _metadata(self):
+        return {'version': constants.STATE_VERSION, 'parameters': self.params}
+
+    def load(self):
+        """
+        Load the saved state if it exists and was saved with the same version and parameters. If the state can not be
+        read (e.g. its files are damaged), it is discarded and all the data is merged again.
+        :return: True if the state was loaded
+        """
+        state_file_path = os.path.join(self.state_dir, STATE_FILE_NAME)
+        if not os.path.isfile(state_file_path):
+            return False
+        try:
+            with open(state_file_path) as f:
+                metadata = json.load(f)
+            expected_metadata = json.loads(json.dumps(self._metadata()))
+            if {key: metadata.get(key) for key in expected_metadata} != expected_metadata:
+                logger.warning("The incremental state in %s was saved with other parameters, all the data is merged "
+                               "again.", self.state_dir)
+                return False
+            self.gt.load(self.state_dir, 'gt')
+            self.oba.load(self.state_dir, 'oba')
+            if metadata.get('merged'):
+                self.merged = load_frame(os.path.join(self.state_dir, 'merged.parquet'))
+                self.matches = load_frame(os.path.join(self.state_dir, 'matches.parquet'))
+        except (OSError, ValueError, TypeError, KeyError, NotImplementedError) as e:
+            logger.warning("The incremental state in %s could not be read, all the data is merged again: %s",
+                           self.state_dir, e)
+            self.gt = RowStore(constants.GT_KEY_COLS_LIST)
+            self.oba = RowStore(constants.OBA_KEY_COLS_LIST)
+            self.merged = self.matches = None
+            return False
+        return True
+
+    def save(self):
+        """
+        Save the state, replacing the saved state only once all its files are written. The merged data is not saved if
+        the input data was updated after merging it.
+        """
+        temp_dir = self.state_dir.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        self.gt.save(temp_dir, 'gt')
+        self.oba.save(temp_dir, 'oba')
+        metadata = self._metadata()
+        metadata['merged'] = self.merged is not None and not self._updated_trips.size and not self._updated_times.size
+        if metadata['merged']:
+            save_frame(self.merged, os.path.join(temp_dir, 'merged.parquet'))
+            save_frame(self.matches, os.path.join(temp_dir, 'matches.parquet'))
+        with open(os.path.join(temp_dir, STATE_FILE_NAME), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+        old_dir = self.state_dir.rstrip(os.sep) + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.isdir(self.state_dir):
+            os.replace(self.state_dir, old_dir)
+        os.replace(temp_dir, self.state_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def update_gt(self, gt_data, preprocess):
+        """
+        :param gt_data: dataframe loaded from the ground truth data file, all of it or only the new rows
+        :param preprocess: function receiving a dataframe and returning the clean rows and the dropped rows
+        :return: number of new or changed rows
+        """
+        updated_keys, _ = self.gt.update(gt_data, preprocess)
+        self._updated_trips = np.concatenate([self._updated_trips, updated_keys])
+        return len(updated_keys)
+
+    def update_oba(self, oba_data, preprocess):
+        """
+        :param oba_data: dataframe loaded from the oba data file, all of it or only the new rows
+        :param preprocess: function receiving a dataframe and returning the clean rows and the dropped rows
+        :return: number of new or changed rows
+        """
+        updated_keys, replaced_rows = self.oba.update(oba_data, preprocess)
+        # The trips overlapping the old or the new version of an activity are merged again
+        updated_rows = [self.oba.clean[self.oba.clean[KEY_COL].isin(updated_keys)]]
+        if replaced_rows is not None:
+            updated_rows.append(replaced_rows)
+        for rows in updated_rows:
+            times, valid = to_epoch_ns(rows['Activity Start Date and Time* (UTC)'])
+            self._updated_times = np.concatenate([self._updated_times, times[valid]])
+        return len(updated_keys)
+
+    def merge_to_many(self, repeat_gt_rows):
+        """
+        Merge to many the trips affected by the updated input rows and reuse the saved results of the other trips, the
+        results are the same as merging all the preprocessed data with merge_to_many.
+        :param repeat_gt_rows: boolean value to indicate if the GT data must be repeated on every row of a bunch of
+        matches
+        :return: dataframe with the merged data, dataframe with the number of matches by GT trip and oba_user(phone) and
+        dataframe with the oba activities without a match on GT data.
+        """
+        gt_data = self.gt.clean
+        oba_index = PartitionIndex(without_state_columns(self.oba.clean), 'User ID',
+                                   'Activity Start Date and Time* (UTC)')
+        users = pd.Index(oba_index.keys).dropna()
+        trip_keys = gt_data[KEY_COL].to_numpy()
+
+        if self.merged is None or self.merged.empty:
+            to_merge = np.ones(len(gt_data), dtype=bool)
+            new_users = users[:0]
+        else:
+            # Trips updated or overlapping the start of an updated activity
+            window_starts, valid_orig = to_epoch_ns(gt_data['GT_DateTimeOrigUTC'])
+            window_ends, valid_dest = to_epoch_ns(gt_data['GT_DateTimeDestUTC'])
+            lo, hi = window_bounds(np.sort(self._updated_times), window_starts, window_ends)
+            to_merge = np.isin(trip_keys, self._updated_trips) | ((hi > lo) & valid_orig & valid_dest)
+            new_users = users[~users.isin(self.merged['User ID'])]
+        logger.info("Merging %d of %d trips and %d new oba users.", to_merge.sum(), len(gt_data), len(new_users))
+
+        # Saved results of the trips that are kept, for the oba users that still have activities
+        kept_trips = trip_keys[~to_merge]
+        merged_parts = []
+        matches_parts = []
+        if self.merged is not None:
+            merged_parts.append(self.merged[self.merged[KEY_COL].isin(kept_trips) &
+                                            self.merged['User ID'].isin(users)])
+            matches_parts.append(self.matches[self.matches[KEY_COL].isin(kept_trips) &
+                                              self.matches[USER_COL].isin(users)])
+        for gt_rows, gt_users in ((gt_data[to_merge], users), (gt_data[~to_merge], new_users)):
+            if len(gt_rows) and len(gt_users):
+                merged_df, matches_df = merge_pairs(gt_rows, oba_index, gt_users, repeat_gt_rows)
+                merged_parts.append(merged_df)
+                matches_parts.append(matches_df)
+
+        # Sort the results like merge_to_many: by collector, oba user and trip start time
+        gt_index = PartitionIndex(gt_data, 'GT_Collector', 'GT_DateTimeOrigUTC')
+        collector_codes = pd.factorize(gt_data['GT_Collector'])[0]
+        trip_order = pd.DataFrame({'collector': collector_codes[gt_index.positions],
+                                   'trip': np.arange(len(gt_data))}, index=trip_keys[gt_index.positions])
+
+        def sort_results(parts, user_col):
+            if not parts:
+                return pd.DataFrame()
+            results = pd.concat(parts, ignore_index=True)
+            if results.empty:
+                return results
+            order = trip_order.loc[results[KEY_COL].to_numpy()]
+            user_codes = users.get_indexer(results[user_col])
+            positions = np.lexsort((order['trip'].to_numpy(), user_codes, order['collector'].to_numpy()))
+            return results.take(positions).reset_index(drop=True)
+
+        self.merged = sort_results(merged_parts, 'User ID')
+        self.matches = sort_results(matches_parts, USER_COL)
+        self._updated_trips = np.empty(0, dtype=np.uint64)
+        self._updated_times = np.empty(0, dtype=np.int64)
+
+        return (self.merged, without_state_columns(self.matches),
+                unmatched_activities(self.gt.clean, self.oba.clean))
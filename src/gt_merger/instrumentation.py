@@ -0,0 +1,170 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import contextlib
+import datetime
+import json
+import logging
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_mb(who='self'):
+    """
+    :param who: 'self' for this process or 'children' for the finished child processes (e.g. the merge workers)
+    :return: peak resident set size (megabytes), None if it is not available on this platform
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class RunReport:
+    """
+    Record the wall time, CPU time, peak RSS and number of rows of the stages of a run, to be saved as a JSON file.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.started = datetime.datetime.now()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        """
+        Context manager recording a stage when it finishes. The record is yielded, so the number of rows (or any other
+        JSON serializable value) can be added to it, e.g. record['rows'] = len(data).
+        :param name: name of the stage
+        :param info: values added to the record, e.g. the tolerance
+        """
+        record = {'name': name, 'started': datetime.datetime.now().isoformat(timespec='milliseconds')}
+        record.update(info)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - start_wall
+            record['cpu_seconds'] = time.process_time() - start_cpu
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.stages.append(record)
+
+    def extend(self, stages):
+        """
+        Add the stages recorded by another report, e.g. the report of a task run by a worker process.
+        :param stages: list of stage records
+        """
+        self.stages.extend(stages)
+
+    def to_dict(self, **info):
+        """
+        :param info: values added to the report, e.g. the command line arguments
+        :return: dictionary with the summary of the run and the list of stages
+        """
+        report = {'started': self.started.isoformat(timespec='seconds'),
+                  'finished': datetime.datetime.now().isoformat(timespec='seconds')}
+        report.update(info)
+        report.update({'wall_seconds': time.perf_counter() - self._start_wall,
+                       'cpu_seconds': time.process_time() - self._start_cpu,
+                       'peak_rss_mb': peak_rss_mb(),
+                       'peak_rss_children_mb': peak_rss_mb('children'),
+                       'stages': self.stages})
+        return report
+
+    def write(self, path, **info):
+        """
+        Save the report to a JSON file.
+        :param path: path to the JSON file
+        :param info: values added to the report, e.g. the command line arguments
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(**info), f, indent=2, default=str)
+
+
+# Report where the stages of the current run are recorded
+_active_report = None
+
+
+def set_active_report(report):
+    """
+    :param report: RunReport recording the stages of the current run, None to stop recording
+    """
+    global _active_report
+    _active_report = report
+
+
+def add_stages(stages):
+    """
+    Add stages recorded by another report, e.g. the report of a task run by a worker process, to the active report.
+    :param stages: list of stage records
+    """
+    if _active_report is not None:
+        _active_report.extend(stages)
+
+
+def stage(name, **info):
+    """
+    Record a stage on the active report, see RunReport.stage. The stage is not recorded if there is no active report.
+    :param name: name of the stage
+    :param info: values added to the record
+    """
+    return (_active_report or RunReport()).stage(name, **info)
+
+
+@contextlib.contextmanager
+def profile(output_path, profiler='cprofile'):
+    """
+    Profile the code run inside the context and save the profile to a file.
+    :param output_path: path to the profile file without extension, '.prof' (cProfile, can be read with pstats or
+    snakeviz) or '.html' (pyinstrument) is added
+    :param profiler: 'cprofile' or 'pyinstrument', cProfile is used if pyinstrument is not installed
+    """
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, cProfile is used instead.")
+        else:
+            pyinstrument_profiler = Profiler()
+            pyinstrument_profiler.start()
+            try:
+                yield
+            finally:
+                pyinstrument_profiler.stop()
+                with open(output_path + '.html', 'w') as f:
+                    f.write(pyinstrument_profiler.output_html())
+            return
+
+    import cProfile
+    c_profiler = cProfile.Profile()
+    c_profiler.enable()
+    try:
+        yield
+    finally:
+        c_profiler.disable()
+        c_profiler.dump_stats(output_path + '.prof')
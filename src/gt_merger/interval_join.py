@@ -0,0 +1,153 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+
+# GT columns that are kept on every row of a bunch of matches even when GT rows are not repeated
+GT_ALWAYS_REPEATED_COLS = ['GT_DateTimeOrigUTC', 'GT_LatOrig', 'GT_LonOrig', 'GT_TourID', 'GT_TripID']
+
+
+def to_epoch_ns(values):
+    """
+    Convert a datetime like series to an int64 array of nanoseconds since epoch (UTC).
+    :param values: series with tz-aware or tz-naive (assumed UTC) datetimes
+    :return: tuple with the int64 array and a boolean array that is False where the value was NaT
+    """
+    datetimes = pd.to_datetime(pd.Series(values), utc=True)
+    valid = datetimes.notna().to_numpy()
+    return datetimes.to_numpy(dtype='datetime64[ns]').view('i8'), valid
+
+
+def window_bounds(points, window_starts, window_ends):
+    """
+    Find for every closed window [window_starts[i], window_ends[i]] the range of positions [lo[i], hi[i]) of the sorted
+    array points whose values fall inside the window.
+    :param points: sorted int64 array
+    :param window_starts: int64 array with the start of every window
+    :param window_ends: int64 array with the end of every window
+    :return: tuple of int64 arrays (lo, hi), empty windows have lo == hi
+    """
+    lo = np.searchsorted(points, window_starts, side='left')
+    hi = np.searchsorted(points, window_ends, side='right')
+    return lo, np.maximum(hi, lo)
+
+
+def expand_windows(lo, hi):
+    """
+    Expand the window ranges returned by window_bounds into one output row per (window, point) pair. Windows without
+    points produce a single row whose point position is -1.
+    :param lo: int64 array with the first matched point position of every window
+    :param hi: int64 array with the position after the last matched point of every window
+    :return: tuple of int64 arrays (window_positions, point_positions, offsets), offsets is the rank of each row within
+    its window
+    """
+    counts = hi - lo
+    rows = np.maximum(counts, 1)
+    window_positions = np.repeat(np.arange(len(lo)), rows)
+    first_row = np.cumsum(rows) - rows
+    offsets = np.arange(rows.sum()) - np.repeat(first_row, rows)
+    point_positions = np.repeat(lo, rows) + offsets
+    point_positions[np.repeat(counts == 0, rows)] = -1
+    return window_positions, point_positions, offsets
+
+
+def matched_bitmap(lo, hi, num_points):
+    """
+    Build a bitmap flagging the points that fall inside at least one window.
+    :param lo: int64 array with the first matched point position of every window
+    :param hi: int64 array with the position after the last matched point of every window
+    :param num_points: number of points
+    :return: boolean array of length num_points
+    """
+    coverage = np.bincount(lo, minlength=num_points + 1) - np.bincount(hi, minlength=num_points + 1)
+    return np.cumsum(coverage[:num_points]) > 0
+
+
+def match_flags(window_starts, window_ends, valid_windows, points, valid_points):
+    """
+    Flag the windows [window_starts[i], window_ends[i]] with at least one point inside and the points inside at least
+    one window.
+    :param window_starts: int64 array with the start of every window
+    :param window_ends: int64 array with the end of every window
+    :param valid_windows: boolean array that is False for the windows that never match
+    :param points: int64 array, not sorted
+    :param valid_points: boolean array that is False for the points that never match
+    :return: tuple of boolean arrays, with the flags of the windows and with the flags of the points
+    """
+    order = np.argsort(np.where(valid_points, points, np.iinfo(np.int64).max), kind='stable')
+    num_valid = int(valid_points.sum())
+    lo, hi = window_bounds(points[order[:num_valid]], window_starts, window_ends)
+    hi = np.where(valid_windows, hi, lo)
+    matched_points = np.zeros(len(points), dtype=bool)
+    matched_points[order[:num_valid]] = matched_bitmap(lo, hi, num_valid)
+    return hi > lo, matched_points
+
+
+def merge_user_to_many(gt_data_collector, oba_data_user, collector, oba_user, repeat_gt_rows):
+    """
+    Match every trip of a collector with all the activities of an oba user starting between 'GT_DateTimeOrigUTC' and
+    'GT_DateTimeDestUTC' in one vectorized pass.
+    :param gt_data_collector: dataframe with the GT trips of one collector sorted by 'GT_DateTimeOrigUTC'
+    :param oba_data_user: dataframe with the activities of one oba user sorted by 'Activity Start Date and Time* (UTC)'
+    :param collector: name of the collector
+    :param oba_user: id of the oba user
+    :param repeat_gt_rows: boolean value to indicate if the GT data must be repeated on every row of a bunch of matches
+    :return: dataframe with the merged data, dataframe with the number of matches by GT trip and dataframe with the oba
+    activities without a match
+    """
+    starts, valid_starts = to_epoch_ns(oba_data_user['Activity Start Date and Time* (UTC)'])
+    # NaT values are sorted last and never match
+    num_valid = int(valid_starts.sum())
+    window_starts, valid_orig = to_epoch_ns(gt_data_collector['GT_DateTimeOrigUTC'])
+    window_ends, valid_dest = to_epoch_ns(gt_data_collector['GT_DateTimeDestUTC'])
+
+    lo, hi = window_bounds(starts[:num_valid], window_starts, window_ends)
+    valid_windows = valid_orig & valid_dest
+    hi = np.where(valid_windows, hi, lo)
+    window_positions, point_positions, offsets = expand_windows(lo, hi)
+
+    # Repeat each GT trip as many times as matches were found (at least once)
+    gt_block = gt_data_collector.take(window_positions).reset_index(drop=True)
+    gt_block['GT_DateTimeOrigUTC_Backup'] = gt_block['GT_DateTimeOrigUTC']
+    # Remove (Fill with NaN) repeated GT rows unless required no to
+    repeated = offsets > 0
+    if not repeat_gt_rows and repeated.any():
+        for col in gt_block.columns.difference(GT_ALWAYS_REPEATED_COLS):
+            if gt_block[col].dtype.kind in 'iub':
+                gt_block[col] = gt_block[col].astype(object)
+            gt_block[col] = gt_block[col].mask(repeated)
+
+    oba_block = oba_data_user.reset_index(drop=True).reindex(point_positions).reset_index(drop=True)
+    merged_df = pd.concat([gt_block, oba_block], axis=1)
+    # Make sure the bunch of matches has the 'User Id' even for the empty rows
+    merged_df['User ID'] = oba_user
+
+    # Number of matches by GT trip
+    matches_df = gt_data_collector.copy()
+    matches_df['User ID'] = oba_user[-4:]
+    matches_df['GT_NumberOfTransitions'] = hi - lo
+
+    # OBA trips without GT Data match
+    matched = matched_bitmap(lo, hi, len(oba_data_user))
+    unmatched_trips_df = oba_data_user.loc[~matched, constants.OBA_UNMATCHED_NEW_COLUMNS_ORDER]
+    unmatched_trips_df['User ID'] = oba_user[-4:]
+    unmatched_trips_df.insert(loc=0, column='GT_Collector', value=collector)
+
+    return merged_df, matches_df, unmatched_trips_df
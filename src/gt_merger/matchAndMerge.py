@@ -15,33 +15,57 @@
  * limitations under the License.
  */
  """
+import contextlib
+import importlib.util
+import logging
 import os
-# Import dependencies
-from collections import defaultdict
-from pathlib import Path
-
-import haversine as hs
-import numpy as np
-import pandas as pd
-from haversine import Unit
 
 from src.gt_merger import constants
 from src.gt_merger.args import get_parser
-from src.gt_merger.preprocess import preprocess_gt_data, preprocess_oba_data, is_valid_oba_dataframe, \
-    is_valid_gt_dataframe
+from src.gt_merger.instrumentation import RunReport, profile, set_active_report, stage
+from src.gt_merger.writers import AsyncOutputWriter, OutputWriter, is_output_format_available
+
+logger = logging.getLogger(__name__)
+
+# Functions that were defined in this module before the library API was added. They are imported from merging.py when
+# they are used, so pandas is not imported until the command line arguments and the input files are checked
+MERGING_FUNCTIONS = ['merge', 'merge_to_many', 'prepare_merged_data']
+
+
+def __getattr__(name):
+    if name in MERGING_FUNCTIONS:
+        from src.gt_merger import merging
+        return getattr(merging, name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
 
 
 # -------------------------------------------
 
-def main():
+def main(args=None):
+    """
+    Run the merger from the command line.
+    :param args: list of command line arguments, the arguments of the process are used if it is None
+    """
+    command_line_args = get_parser(args)
+    logging.basicConfig(level=command_line_args.logLevel, format='%(message)s')
+    run(command_line_args)
+
+
+def run(command_line_args):
+    """
+    Check the command line arguments and the input files, and merge them. The process exits (SystemExit) after
+    logging an error if an argument or an input file is not valid.
+    :param command_line_args: command line arguments returned by get_parser
+    :return: MergeSession with the merged data
+    """
     # Verify if the OBA input file exists
     if not os.path.isfile(command_line_args.obaFile):
-        print("OBA data file not found:", command_line_args.obaFile)
+        logger.error("OBA data file not found: %s", command_line_args.obaFile)
         exit()
 
     # Verify if GT input file exists
     if not os.path.isfile(command_line_args.gtFile):
-        print("Ground truth data file not found:", command_line_args.gtFile)
+        logger.error("Ground truth data file not found: %s", command_line_args.gtFile)
         exit()
 
     # Verify if there is a list of devices
@@ -52,19 +76,63 @@ def main():
                 list_of_devices = f.readline().split(",")
                 list_of_devices = [s.strip() for s in list_of_devices]
         else:
-            print("File with white list of devices not found:", command_line_args.deviceList)
+            logger.error("File with white list of devices not found: %s", command_line_args.deviceList)
             exit()
     else:
         list_of_devices = []
 
+    # Verify if the maximum origin distance is valid
+    if command_line_args.maxOriginDistance is not None and command_line_args.maxOriginDistance <= 0:
+        logger.error("The maximum origin distance must be greater than zero: %s", command_line_args.maxOriginDistance)
+        exit()
+    if command_line_args.maxOriginDistance is not None and command_line_args.optimalAssignment:
+        logger.error("The maximum origin distance can not be used with the optimal assignment.")
+        exit()
+
+    # Verify if the global timeline can be used with the other options
+    if command_line_args.globalTimeline and not command_line_args.mergeOneToOne:
+        logger.error("The global timeline only merges one to one, use it with mergeOneToOne.")
+        exit()
+    if command_line_args.globalTimeline and (command_line_args.maxOriginDistance is not None or
+                                             command_line_args.optimalAssignment):
+        logger.error("The global timeline can not be used with the maximum origin distance or the optimal assignment.")
+        exit()
+
+    # Verify if the backend can merge the data with the other options
+    if command_line_args.backend == 'sqlite' and command_line_args.incremental:
+        logger.error("The sqlite backend can not be used with the incremental merge.")
+        exit()
+    if command_line_args.backend == 'sqlite' and command_line_args.mergeOneToOne:
+        logger.error("The sqlite backend only merges to many, it can not be used with mergeOneToOne.")
+        exit()
+
+    # Verify if the analytics can be computed and plotted
+    if command_line_args.analytics and command_line_args.backend == 'sqlite':
+        logger.error("The analytics can not be computed with the sqlite backend.")
+        exit()
+    if command_line_args.plots and not command_line_args.analytics:
+        logger.error("The plots require the analytics, use --analytics.")
+        exit()
+    if command_line_args.plots and importlib.util.find_spec('matplotlib') is None:
+        logger.error("matplotlib is required to plot the analytics.")
+        exit()
+
+    # Verify if the libraries required by the output format are installed
+    if not is_output_format_available(command_line_args.outputFormat):
+        logger.error("pyarrow is required to save the output data as %s files.", command_line_args.outputFormat)
+        exit()
+    if command_line_args.incremental and importlib.util.find_spec('pyarrow') is None:
+        logger.error("pyarrow is required to save the state of the incremental merge.")
+        exit()
+
     # Verify if the data folder exists
     if not os.path.isdir(command_line_args.outputDir):
-        print("Data folder not found, trying to create it in the current working directory:",
-              command_line_args.outputDir)
+        logger.info("Data folder not found, trying to create it in the current working directory: %s",
+                    command_line_args.outputDir)
         try:
             os.makedirs(command_line_args.outputDir, exist_ok=True)
         except OSError:
-            print("There was an error while creating the data folder:", command_line_args.outputDir)
+            logger.error("There was an error while creating the data folder: %s", command_line_args.outputDir)
             exit()
 
     # Create sub-folders for output an logs
@@ -73,7 +141,7 @@ def main():
         try:
             os.mkdir(path_logs)
         except OSError:
-            print("There was an error while creating the sub folder for logs:", path_logs)
+            logger.error("There was an error while creating the sub folder for logs: %s", path_logs)
             exit()
 
     path_output = os.path.join(command_line_args.outputDir, constants.FOLDER_MERGED_DATA)
@@ -81,52 +149,51 @@ def main():
         try:
             os.mkdir(path_output)
         except OSError:
-            print("There was an error while creating the sub-folder for output files:", path_logs)
+            logger.error("There was an error while creating the sub-folder for output files: %s", path_logs)
             exit()
 
-    # Create path OS independent for excel file
-    excel_path = Path(command_line_args.gtFile)
-    # Load ground truth data to a dataframe
-    gt_data = pd.read_excel(excel_path)
-    # Validate gt dataframe
-    if not is_valid_gt_dataframe(gt_data):
-        print("Ground truth data frame is empty or does not have the required columns.")
-        exit()
-
-    # Preprocess ground truth data
-    gt_data, data_gt_dropped = preprocess_gt_data(gt_data, command_line_args.removeStillMode)
-
-    print("Ground truth data preprocessed.")
-    # Save data to be dropped to a csv file
-    dropped_file_path = os.path.join(command_line_args.outputDir, constants.FOLDER_LOGS,
-                                     constants.GT_DROPPED_DATA_FILE_NAME)
-    data_gt_dropped.to_csv(path_or_buf=dropped_file_path, index=False)
-
-    # Create path OS independent for csv file
-    csv_path = Path(command_line_args.obaFile)
-    # Load OBA data
-    oba_data = pd.read_csv(csv_path)
-    # Validate oba dataframe
-    if not is_valid_oba_dataframe(oba_data):
-        print("OBA data frame is empty or does not have the required columns.")
+    # Record the stages of the run, and profile them if required
+    report = RunReport()
+    set_active_report(report)
+    # The output files are written by background threads while the data is merged, unless writerThreads is 0
+    writer = OutputWriter(command_line_args.outputFormat, command_line_args.compression)
+    with profile(os.path.join(path_logs, constants.PROFILE_FILE_NAME), command_line_args.profile) \
+            if command_line_args.profile else contextlib.nullcontext(), \
+            AsyncOutputWriter(writer, command_line_args.writerThreads, command_line_args.maxPendingWrites) \
+            if command_line_args.writerThreads > 0 else contextlib.nullcontext(writer) as writer:
+        session = merge_files(command_line_args, list_of_devices, writer)
+    set_active_report(None)
+
+    # Save the run report to the logs folder
+    report_file_path = os.path.join(path_logs, constants.RUN_REPORT_FILE_NAME)
+    report.write(report_file_path, arguments=vars(command_line_args))
+    logger.info("Run report saved to %s", report_file_path)
+    return session
+
+
+def merge_files(command_line_args, list_of_devices, writer):
+    """
+    Load, preprocess and merge the input data files and save the results, according to the command line arguments.
+    :param command_line_args: command line arguments returned by get_parser
+    :param list_of_devices: list of OBA devices to be merged, all the devices are merged if the list is empty
+    :param writer: OutputWriter or AsyncOutputWriter saving the output data files
+    :return: MergeSession with the merged data
+    """
+    # The data libraries are imported once the arguments and the input files are checked, so --help and wrong
+    # arguments do not wait for them
+    from src.gt_merger.analytics import ToleranceAnalytics
+    from src.gt_merger.session import MergeConfig, MergeSession
+
+    session = MergeSession(MergeConfig.from_args(command_line_args, list_of_devices))
+    try:
+        session.load(command_line_args.gtFile, command_line_args.obaFile)
+    except ValueError as e:
+        logger.error(str(e))
         exit()
 
-    # If a devices white list was provided, list the devices
-    if list_of_devices:
-        oba_data = oba_data[oba_data["User ID"].isin(list_of_devices)]
-
-    # Preprocess OBA data
-    oba_data, data_csv_dropped = preprocess_oba_data(oba_data, command_line_args.minActivityDuration,
-                                                     command_line_args.minTripLength, command_line_args.removeStillMode)
-    print("OBA data preprocessed.")
-    print(oba_data.info())
-    print(gt_data.info())
-
     # Data preprocessing IS OVER
-    # Save oba dropped data to a csv file
-    dropped_file_path = os.path.join(command_line_args.outputDir, constants.FOLDER_LOGS,
-                                     constants.OBA_DROPPED_DATA_FILE_NAME)
-    data_csv_dropped.to_csv(path_or_buf=dropped_file_path, index=False)
+    # Save the dropped data to files
+    session.save_dropped(os.path.join(command_line_args.outputDir, constants.FOLDER_LOGS), writer)
 
     if command_line_args.iterateOverTol:
         first_tol = 30000
@@ -135,190 +202,29 @@ def main():
         save_to_path = os.path.join(constants.FOLDER_MERGED_DATA)
         first_tol = constants.TOLERANCE
 
-    for tol in range(first_tol, command_line_args.tolerance + 1, constants.CALCULATE_EVERY_N_SECS):
-        print("TOLERANCE:", str(tol))
-        # merge dataframes one to one or one to many according to the commandline parameter
-        if command_line_args.mergeOneToOne:
-            merged_data_frame, num_matches_df = merge(gt_data, oba_data, tol)
-        else:
-            merged_data_frame, num_matches_df, unmatched_oba_trips_df = merge_to_many(gt_data, oba_data, tol)
-            # Save unmatched oba records to csv
-            unmatched_file_path = os.path.join(command_line_args.outputDir, save_to_path,
-                                               "oba_records_without_match_on_GT.csv")
-            unmatched_oba_trips_df.to_csv(path_or_buf=unmatched_file_path, index=False)
-
-        # Calculate difference
-        merged_data_frame['Time_Difference'] = merged_data_frame.apply(
-            lambda x: (x['Activity Start Date and Time* (UTC)'] - x['GT_DateTimeOrigUTC_Backup']) / np.timedelta64(1, 's')
-            if pd.notna(x['Activity Start Date and Time* (UTC)']) else "", 1)
-
-        # Calculate distance between GT and OBA starting points
-        merged_data_frame['Distance_Difference'] = merged_data_frame.apply(
-            lambda row: hs.haversine((row['GT_LatOrig'], row['GT_LonOrig']),
-                                     (row['Origin latitude (*best)'], row['Origin longitude (*best)']),
-                                     unit=Unit.METERS), axis=1)
-
-        # Add Manual Assignment Column before reorganize
-        merged_data_frame["Manual Assignment"] = ''
-        # Reorder merged dataframe columns
-        new_column_orders = constants.GT_NEW_COLUMNS_ORDER + constants.OBA_NEW_COLUMNS_ORDER
-        merged_data_frame = merged_data_frame[new_column_orders]
-        # Save merged data to csv
-        merged_file_path = os.path.join(command_line_args.outputDir, save_to_path,
-                                        constants.MERGED_DATA_FILE_NAME + "_" + str(tol) + ".csv")
-        num_matches_file_path = os.path.join(command_line_args.outputDir, save_to_path,
-                                             "num_matches" + "_" + str(tol) + ".csv")
-        merged_data_frame.to_csv(path_or_buf=merged_file_path, index=False)
-        num_matches_df.to_csv(path_or_buf=num_matches_file_path, index=False)
-
-
-def merge(gt_data, oba_data, tolerance):
-    """
-    Merge gt_data dataframe and oba_data dataframe using the nearest value between columns 'gt_data.GT_DateTimeOrigUTC' and
-    'oba_data.Activity Start Date and Time* (UTC)'. Before merging, the data is grouped by 'GT_Collector' on gt_data and
-    each row on gt_data will be paired with one or none of the rows on oba_data grouped by userId.
-    :param tolerance: maximum allowed difference (seconds) between 'gt_data.GT_DateTimeOrigUTC' and
-    'oba_data.Activity Start Date and Time* (UTC)'.
-    :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
-    :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
-    :return: dataframe with the merged data and a dataframe with summary of matches by collector/oba_user(phone).
-    """
-    list_collectors = gt_data['GT_Collector'].unique()
-    list_oba_users = oba_data['User ID'].unique()
-    merged_df = pd.DataFrame()
-    matches_df = pd.DataFrame(list_collectors, columns=['GT_Collector'])
-    list_total_trips = []
-    list_matches = []
-    matches_dict = defaultdict(list)
-    for collector in list_collectors:
-        print("Merging data for collector ", collector)
-        # Create dataframe for a collector on list_collectors
-        gt_data_collector = gt_data[gt_data["GT_Collector"] == collector]
-        # Make sure dataframe is sorted by 'ClosesTime'
-        gt_data_collector.sort_values('GT_DateTimeOrigUTC', inplace=True)
-        # Add total trips per collector
-        list_total_trips.append(len(gt_data_collector))
-        i = 0
-        list_matches_by_phone = []
-        for oba_user in list_oba_users:
-            # Create a dataframe with the oba_user activities only
-            oba_data_user = oba_data[oba_data["User ID"] == oba_user]
-            # Make sure dataframes is sorted by 'Activity Start Date and Time* (UTC)'
-            oba_data_user.sort_values('Activity Start Date and Time* (UTC)', inplace=True)
-
-            temp_merge = pd.merge_asof(gt_data_collector, oba_data_user, left_on="GT_DateTimeOrigUTC",
-                                       right_on="Activity Start Date and Time* (UTC)",
-                                       direction="forward",
-                                       tolerance=pd.Timedelta(str(tolerance) + "ms"), left_by='GT_Mode',
-                                       right_by='Google Activity')
-            merged_df = pd.concat([merged_df, temp_merge], ignore_index=True)
-            # Print number of matches
-            print("\t Oba user", oba_user[-4:], "\tMatches: ", (temp_merge["User ID"] == oba_user).sum(), " out of ",
-                  (temp_merge["GT_Collector"] == collector).sum())
-
-            list_matches_by_phone.append((temp_merge["User ID"] == oba_user).sum())
-            matches_dict[oba_user[-4:]].append((temp_merge["User ID"] == oba_user).sum())
-            i += 1
-        list_matches.append(list_matches_by_phone)
-    matches_df['total_trips'] = list_total_trips
-    numbers_df = pd.DataFrame.from_dict(matches_dict)
-    matches_df = pd.concat([matches_df, numbers_df], axis=1)
-    print("matches", matches_df.head())
-    print("List of matches", list_matches)
-    return merged_df, matches_df
-
-
-def merge_to_many(gt_data, oba_data, tolerance):
-    """
-    Merge gt_data dataframe and oba_data dataframe using the nearest value between columns 'gt_data.GT_DateTimeOrigUTC' and
-    'oba_data.Activity Start Date and Time* (UTC)'. Before merging, the data is grouped by 'GT_Collector' on gt_data and
-    each row on gt_data will be paired with one or none of the rows on oba_data grouped by userId.
-    :param tolerance: maximum allowed difference (seconds) between 'gt_data.GT_DateTimeOrigUTC' and
-    'oba_data.Activity Start Date and Time* (UTC)'.
-    :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
-    :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
-    :return: dataframe with the merged data.
-    """
-    # List of unique collectors and and unique users
-    list_collectors = gt_data['GT_Collector'].unique()
-    list_oba_users = oba_data['User ID'].unique()
-
-    # Create empty dataframes to be returned
-    merged_df = pd.DataFrame()
-    matches_df = pd.DataFrame()
-    all_unmatched_trips_df = pd.DataFrame()
-
-    list_total_trips = []
-    for collector in list_collectors:
-        print("Merging data for collector ", collector)
-        # Create dataframe for a collector on list_collectors
-        gt_data_collector = gt_data[gt_data["GT_Collector"] == collector]
-        # Make sure dataframe is sorted by 'ClosesTime'
-        gt_data_collector.sort_values('GT_DateTimeOrigUTC', inplace=True)
-        # Add total trips per collector
-        list_total_trips.append(len(gt_data_collector))
-        i = 0
-        for oba_user in list_oba_users:
-            # Create a dataframe with the oba_user activities only
-            oba_data_user = oba_data[oba_data["User ID"] == oba_user]
-            # Make sure dataframes is sorted by 'Activity Start Date and Time* (UTC)'
-            oba_data_user.sort_values('Activity Start Date and Time* (UTC)', inplace=True)
-
-            # Create df for OBA trips without GT Data match
-            oba_unmatched_trips_df = oba_data_user.copy()
-
-            # Iterate over each trip of one collector to match it with zero to many activities of an oba_data_user
-            for index, row in gt_data_collector.iterrows():
-                bunch_of_matches = oba_data_user[(oba_data_user['Activity Start Date and Time* (UTC)'] >=
-                                                 row['GT_DateTimeOrigUTC']) &
-                                                 (oba_data_user['Activity Start Date and Time* (UTC)'] <=
-                                                  row['GT_DateTimeDestUTC'])
-                                                 ]
-                # Get the size of bunch_of_matches to create a repeated dataframe to concatenate with
-                if bunch_of_matches.empty:
-                    len_bunch = 1
-                else:
-                    len_bunch = bunch_of_matches.shape[0]
-                    # Remove matched rows from unmatched trips df
-                    oba_unmatched_trips_df = pd.merge(oba_unmatched_trips_df, bunch_of_matches, indicator=True, how='outer').\
-                        query('_merge=="left_only"').drop('_merge', axis=1)
-
-                subset_df = gt_data_collector.loc[[index], :]
-                # Repeat the firs row `len_bunch` times.
-                new_df = pd.DataFrame(np.repeat(subset_df.values, len_bunch, axis=0))
-                new_df.columns = gt_data_collector.columns
-                # Add backup Start Time Columns
-                new_df['GT_DateTimeOrigUTC_Backup'] = new_df['GT_DateTimeOrigUTC']
-
-                # Remove (Fill with NaN) repeated GT rows unless required no to
-                if len_bunch > 1 and not command_line_args.repeatGtRows:
-                    new_df.loc[1:, new_df.columns.difference(['GT_DateTimeOrigUTC', 'GT_LatOrig', 'GT_LonOrig',
-                                                              'GT_TourID', 'GT_TripID'])] = np.NaN
-
-                temp_merge = pd.concat([new_df.reset_index(drop=True), bunch_of_matches.reset_index(drop=True)],
-                                       axis=1)
-                # Make sure the bunch of matches has the 'User Id' even for the empty rows
-                temp_merge["User ID"] = oba_user
-                # Merge running matches with current set of found matches
-                merged_df = pd.concat([merged_df, temp_merge], ignore_index=True)
-
-                # Add oba_user and number of many matches to the matches_df
-                subset_df["User ID"] = oba_user[-4:]
-                subset_df["GT_NumberOfTransitions"] = 0 if bunch_of_matches.empty else len_bunch
-                matches_df = pd.concat([matches_df, subset_df], ignore_index=True)
-
-            # Reorder the OBA columns
-            oba_unmatched_trips_df= oba_unmatched_trips_df[constants.OBA_UNMATCHED_NEW_COLUMNS_ORDER]
-            # Add Collector and device to unmatched trips
-            oba_unmatched_trips_df['User ID'] = oba_user[-4:]
-            # oba_unmatched_trips_df['GT_Collector'] = collector
-            oba_unmatched_trips_df.insert(loc=0, column='GT_Collector', value=collector)
-            # Append the unmatched trips per collector/device to the all unmatched df
-            all_unmatched_trips_df = pd.concat([all_unmatched_trips_df, oba_unmatched_trips_df], ignore_index=True)
-
-    return merged_df, matches_df, all_unmatched_trips_df
+    # Create the sub-folder for the merged data of every tolerance
+    if not os.path.isdir(os.path.join(command_line_args.outputDir, save_to_path)):
+        try:
+            os.makedirs(os.path.join(command_line_args.outputDir, save_to_path), exist_ok=True)
+        except OSError:
+            logger.error("There was an error while creating the sub-folder for output files: %s", save_to_path)
+            exit()
+
+    # Merge and save the data of every tolerance. When iterating over the tolerances, parquet and feather data is saved
+    # as a dataset partitioned by tolerance
+    analytics = ToleranceAnalytics() if command_line_args.analytics else None
+    session.save_results(os.path.join(command_line_args.outputDir, save_to_path), writer,
+                         range(first_tol, command_line_args.tolerance + 1, constants.CALCULATE_EVERY_N_SECS),
+                         partitioned=command_line_args.iterateOverTol, analytics=analytics)
+
+    # Save the statistics of every tolerance, accumulated while the data was merged
+    if analytics is not None:
+        analytics_path = os.path.join(command_line_args.outputDir, constants.FOLDER_ANALYTICS)
+        with stage('save_analytics'):
+            analytics.save(analytics_path, writer, command_line_args.plots)
+        logger.info("Analytics saved to %s", analytics_path)
+    return session
 
 
 if __name__ == '__main__':
-    command_line_args = get_parser()
     main()
@@ -0,0 +1,141 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import logging
+
+from src.gt_merger import constants
+from src.gt_merger.assignment import AssignmentSweep
+from src.gt_merger.instrumentation import stage
+from src.gt_merger.interval_join import merge_user_to_many
+from src.gt_merger.metrics import add_differences
+from src.gt_merger.parallel import get_shared_data, map_in_pool
+from src.gt_merger.partition import PartitionIndex
+from src.gt_merger.results import ResultBuilder, ColumnarResultBuilder
+from src.gt_merger.schema import with_numpy_dtypes
+from src.gt_merger.spatial import SpatialSweep
+from src.gt_merger.sweep import ToleranceSweep
+from src.gt_merger.timeline import TimelineSweep
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_merged_data(merged_data_frame):
+    """
+    Reorder the columns of the merged data to be exported.
+    :param merged_data_frame: dataframe returned by merge or merge_to_many
+    :return: dataframe with the columns in GT_NEW_COLUMNS_ORDER + OBA_NEW_COLUMNS_ORDER
+    """
+    # Add Manual Assignment Column before reorganize
+    merged_data_frame["Manual Assignment"] = ''
+    # Reorder merged dataframe columns
+    new_column_orders = constants.GT_NEW_COLUMNS_ORDER + constants.OBA_NEW_COLUMNS_ORDER
+    return merged_data_frame[new_column_orders]
+
+
+def merge(gt_data, oba_data, tolerance, max_distance=None, optimal_assignment=False, global_timeline=False):
+    """
+    Merge gt_data dataframe and oba_data dataframe using the nearest value between columns 'gt_data.GT_DateTimeOrigUTC' and
+    'oba_data.Activity Start Date and Time* (UTC)'. Before merging, the data is grouped by 'GT_Collector' on gt_data and
+    each row on gt_data will be paired with one or none of the rows on oba_data grouped by userId.
+    Use ToleranceSweep directly to merge the same data with several tolerances.
+    :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+    'oba_data.Activity Start Date and Time* (UTC)'.
+    :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+    :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+    :param max_distance: maximum distance (meters) between 'gt_data.GT_LatOrig/GT_LonOrig' and
+    'oba_data.Origin latitude/longitude (*best)', if it is not None the rows are paired by SpatialSweep
+    :param optimal_assignment: True to assign every activity to at most one GT trip with AssignmentSweep
+    :param global_timeline: True to search the activities of all the devices at once with TimelineSweep, the merged
+    data is then in long format (a row for every matched GT trip and device, and for every GT trip without a match)
+    :return: dataframe with the merged data and a dataframe with summary of matches by collector/oba_user(phone).
+    """
+    if max_distance is not None and optimal_assignment:
+        raise ValueError("The maximum origin distance can not be used with the optimal assignment.")
+    if global_timeline and (max_distance is not None or optimal_assignment):
+        raise ValueError("The global timeline can not be used with the maximum origin distance or the optimal "
+                         "assignment.")
+    if global_timeline:
+        return TimelineSweep(gt_data, oba_data, tolerance).merge(tolerance)
+    if max_distance is not None:
+        return SpatialSweep(gt_data, oba_data, max_distance, tolerance).merge(tolerance)
+    if optimal_assignment:
+        return AssignmentSweep(gt_data, oba_data).merge(tolerance)
+    return ToleranceSweep(gt_data, oba_data).merge(tolerance)
+
+
+def merge_to_many(gt_data, oba_data, tolerance, workers=1, repeat_gt_rows=False):
+    """
+    Merge gt_data dataframe and oba_data dataframe using the nearest value between columns 'gt_data.GT_DateTimeOrigUTC' and
+    'oba_data.Activity Start Date and Time* (UTC)'. Before merging, the data is grouped by 'GT_Collector' on gt_data and
+    each row on gt_data will be paired with one or none of the rows on oba_data grouped by userId.
+    :param tolerance: maximum allowed difference (seconds) between 'gt_data.GT_DateTimeOrigUTC' and
+    'oba_data.Activity Start Date and Time* (UTC)'.
+    :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+    :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+    :param workers: number of worker processes merging the data of the collectors in parallel
+    :param repeat_gt_rows: boolean value to indicate if the GT data must be repeated on every row of a bunch of matches
+    :return: dataframe with the merged data, dataframe with the number of matches by GT trip and oba_user(phone) and
+    dataframe with the oba activities without a match on GT data.
+    """
+    # Index both dataframes once, sorted by collector/user and then by start time. The blocks of every collector and
+    # user are merged to object columns, so the categorical and boolean columns are cast to them once
+    gt_index = PartitionIndex(with_numpy_dtypes(gt_data), 'GT_Collector', 'GT_DateTimeOrigUTC')
+    oba_index = PartitionIndex(with_numpy_dtypes(oba_data), 'User ID', 'Activity Start Date and Time* (UTC)')
+
+    # Create builders for the dataframes to be returned
+    merged_builder = ColumnarResultBuilder(constants.GT_NEW_COLUMNS_ORDER + constants.OBA_NEW_COLUMNS_ORDER,
+                                           capacity=gt_data['GT_Collector'].notna().sum() * len(oba_index.keys))
+    matches_builder = ResultBuilder()
+    unmatched_builder = ResultBuilder()
+
+    # The results of every collector are returned in the same order as the list of collectors
+    shared_data = {'gt_index': gt_index, 'oba_index': oba_index, 'repeat_gt_rows': repeat_gt_rows}
+    for collector_results in map_in_pool(merge_collector_task, gt_index.keys, workers, shared_data):
+        for temp_merge, temp_matches, oba_unmatched_trips_df in collector_results:
+            # Merge running matches with current set of found matches
+            merged_builder.append(temp_merge)
+            matches_builder.append(temp_matches)
+            # Append the unmatched trips per collector/device to the all unmatched df
+            unmatched_builder.append(oba_unmatched_trips_df)
+
+    merged_df = merged_builder.build()
+    # Calculate time and distance differences between GT and OBA starting points
+    with stage('metrics', rows=len(merged_df)):
+        merged_df = add_differences(merged_df)
+
+    return merged_df, matches_builder.build(), unmatched_builder.build()
+
+
+def merge_collector_task(collector):
+    """
+    Merge the trips of a collector with the activities of every oba user, the indexed data is read from the shared data
+    of map_in_pool.
+    :param collector: name of the collector
+    :return: list with the merged data, the number of matches and the unmatched activities of every oba user
+    """
+    shared_data = get_shared_data()
+    logger.info("Merging data for collector %s", collector)
+    # Trips of the collector sorted by 'GT_DateTimeOrigUTC'
+    gt_data_collector = shared_data['gt_index'].get(collector)
+    collector_results = []
+    for oba_user in shared_data['oba_index'].keys:
+        # Activities of the oba_user sorted by 'Activity Start Date and Time* (UTC)'
+        oba_data_user = shared_data['oba_index'].get(oba_user)
+        # Match all the trips of the collector with zero to many activities of the oba_user in one pass
+        collector_results.append(merge_user_to_many(gt_data_collector, oba_data_user, collector, oba_user,
+                                                    shared_data['repeat_gt_rows']))
+    return collector_results
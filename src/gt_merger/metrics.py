@@ -0,0 +1,72 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import numpy as np
+import pandas as pd
+
+# Mean earth radius (meters), same value used by the haversine package
+EARTH_RADIUS_METERS = 6371008.8
+
+
+def to_float_array(values):
+    """
+    :param values: array like with numeric values
+    :return: float64 numpy array, values that are not numeric are NaN
+    """
+    return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great-circle distance (meters) between two arrays of points.
+    :param lat1: latitudes (decimal degrees) of the first points
+    :param lon1: longitudes (decimal degrees) of the first points
+    :param lat2: latitudes (decimal degrees) of the second points
+    :param lon2: longitudes (decimal degrees) of the second points
+    :return: float64 array with the distances, NaN where any coordinate is NaN
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(to_float_array(values)) for values in (lat1, lon1, lat2, lon2))
+    d = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+    return EARTH_RADIUS_METERS * (2 * np.arcsin(np.sqrt(d)))
+
+
+def time_difference(end, start):
+    """
+    Calculate the difference (seconds) between two arrays of datetimes.
+    :param end: tz-aware or UTC datetimes
+    :param start: tz-aware or UTC datetimes
+    :return: float64 array with end - start, NaN where any datetime is NaT
+    """
+    end = pd.to_datetime(pd.Series(end).reset_index(drop=True), utc=True)
+    start = pd.to_datetime(pd.Series(start).reset_index(drop=True), utc=True)
+    return ((end - start) / np.timedelta64(1, 's')).to_numpy(dtype=np.float64)
+
+
+def add_differences(merged_data_frame):
+    """
+    Add to the merged data the time difference ('Time_Difference') and the distance ('Distance_Difference') between the
+    GT and the OBA starting points.
+    :param merged_data_frame: dataframe with the merged data
+    :return: the merged dataframe
+    """
+    merged_data_frame['Time_Difference'] = time_difference(merged_data_frame['Activity Start Date and Time* (UTC)'],
+                                                           merged_data_frame['GT_DateTimeOrigUTC_Backup'])
+    merged_data_frame['Distance_Difference'] = haversine_distance(merged_data_frame['GT_LatOrig'],
+                                                                  merged_data_frame['GT_LonOrig'],
+                                                                  merged_data_frame['Origin latitude (*best)'],
+                                                                  merged_data_frame['Origin longitude (*best)'])
+    return merged_data_frame
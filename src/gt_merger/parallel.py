@@ -0,0 +1,62 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import multiprocessing
+
+# Data shared with the tasks run by map_in_pool, set once in every worker process
+_shared_data = {}
+
+
+def get_shared_data():
+    """
+    :return: dictionary with the shared data given to map_in_pool, to be used by the tasks
+    """
+    return _shared_data
+
+
+def _init_worker(shared_data):
+    _shared_data.clear()
+    _shared_data.update(shared_data)
+
+
+def map_in_pool(function, tasks, workers, shared_data, ordered=True):
+    """
+    Run function(task) for every task, in a pool of worker processes if workers is greater than one. The shared data
+    (e.g. the input dataframes) is given to every worker once when the pool is created instead of being pickled with
+    every task; with the fork start method, the default on Linux, the workers read it from the memory of the parent
+    process without copying it.
+    :param function: module level function receiving a task, it can read the shared data with get_shared_data()
+    :param tasks: list with the (small, picklable) arguments of every call
+    :param workers: number of worker processes, the tasks are run in this process if it is not greater than one
+    :param shared_data: dictionary with the data shared by all the tasks
+    :param ordered: False to return the result of every task as soon as it is done, e.g. to record the progress of
+    long tasks
+    :return: iterator with the results in the same order as the tasks, regardless of the number of workers, or in the
+    order they are done if ordered is False
+    """
+    tasks = list(tasks)
+    if workers <= 1 or len(tasks) <= 1:
+        _init_worker(shared_data)
+        try:
+            for task in tasks:
+                yield function(task)
+        finally:
+            _shared_data.clear()
+        return
+
+    with multiprocessing.Pool(min(workers, len(tasks)), initializer=_init_worker, initargs=(shared_data,)) as pool:
+        yield from (pool.imap(function, tasks) if ordered else pool.imap_unordered(function, tasks))
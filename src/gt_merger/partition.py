@@ -0,0 +1,80 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import numpy as np
+import pandas as pd
+
+from src.gt_merger.interval_join import to_epoch_ns
+
+
+def sort_key(epoch_ns, valid):
+    """
+    :return: int64 array to sort datetimes in ascending order with the NaT values last
+    """
+    return np.where(valid, epoch_ns, np.iinfo(np.int64).max)
+
+
+class PartitionIndex:
+    """
+    Index of a dataframe sorted once by a key column and then by a time column, so the rows of every key are a
+    contiguous range of the sorted dataframe. The rows of a key are returned as a slice of the sorted dataframe instead
+    of filtering and sorting the whole dataframe again for every key.
+    """
+
+    def __init__(self, data, key_col, time_col):
+        """
+        :param data: dataframe to be indexed
+        :param key_col: name of the column with the partition key, e.g. 'GT_Collector' or 'User ID'
+        :param time_col: name of the datetime column used to sort the rows of each key, NaT values are sorted last
+        """
+        # Keys in order of appearance, like data[key_col].unique()
+        self.keys = data[key_col].unique()
+        codes, uniques = pd.factorize(data[key_col])
+        # Rows with NaN keys (code -1) are sorted first and do not belong to any partition
+        sorted_positions = np.lexsort((sort_key(*to_epoch_ns(data[time_col])), codes))
+        sorted_codes = codes[sorted_positions]
+        starts = np.searchsorted(sorted_codes, np.arange(len(uniques)), side='left')
+        ends = np.searchsorted(sorted_codes, np.arange(len(uniques)), side='right')
+
+        # Position on data of every row of the sorted dataframe
+        self.positions = sorted_positions
+        self.data = data.take(sorted_positions)
+        self._ranges = dict(zip(uniques, zip(starts, ends)))
+
+    def range(self, key):
+        """
+        :param key: partition key
+        :return: tuple with the first row and the last row + 1 of the key on the sorted dataframe, (0, 0) if the key
+        does not exist
+        """
+        return self._ranges.get(key, (0, 0))
+
+    def rows(self, key):
+        """
+        :param key: partition key
+        :return: int64 array with the positions on the indexed dataframe of the rows of the key, sorted by time
+        """
+        start, end = self.range(key)
+        return self.positions[start:end]
+
+    def get(self, key):
+        """
+        :param key: partition key
+        :return: slice of the sorted dataframe with the rows of the key, sorted by time
+        """
+        start, end = self.range(key)
+        return self.data.iloc[start:end]
@@ -15,12 +15,11 @@
  * limitations under the License.
  */
  """
-import datetime
-
+import numpy as np
 import pandas as pd
-import pytz
 
 from src.gt_merger import constants
+from src.gt_merger.instrumentation import stage
 
 
 def is_valid_oba_dataframe(df_csv):
@@ -55,6 +54,89 @@ def is_valid_gt_dataframe(df_gt):
     return True
 
 
+def parse_time_of_day(values):
+    """
+    Parse a column with times of the day, e.g. datetime.time values loaded from a xlsx file or 'HH:MM:SS' strings.
+    Each distinct value is parsed only once.
+    :param values: series with the times of the day
+    :return: series with the timedelta since midnight of each time, NaT if the value is not a time
+    """
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+    unique_offsets = pd.Series(pd.NaT, index=uniques.index, dtype='timedelta64[ns]')
+    # Fast path for 'HH:MM:SS' values
+    is_clock_time = uniques.str.fullmatch(r'\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?').to_numpy()
+    clock_times = uniques[is_clock_time]
+    clock_times = clock_times.where(clock_times.str.count(':') == 2, clock_times + ':00')
+    unique_offsets[is_clock_time] = pd.to_timedelta(clock_times, errors='coerce')
+    unique_offsets[(unique_offsets >= pd.Timedelta(days=1)).to_numpy()] = pd.NaT
+    # Parse the rest of the values as date-times, e.g. '3:28:15 PM'
+    retry = ~is_clock_time & ~uniques.isin(['nan', 'NaT', 'None']).to_numpy()
+    if retry.any():
+        date_times = pd.to_datetime(uniques[retry], errors='coerce')
+        unique_offsets[retry] = date_times - date_times.dt.normalize()
+
+    offsets = unique_offsets.to_numpy()[np.maximum(codes, 0)]
+    offsets[codes < 0] = np.timedelta64('NaT')
+    return pd.Series(offsets, index=values.index)
+
+
+def localize_by_time_zone(date_times, time_zones):
+    """
+    Localize naive date-times to their time zones, processing all the rows of each time zone at once.
+    Ambiguous and non-existent times are resolved as standard time, like pytz localize(is_dst=False).
+    :param date_times: series with naive date-times
+    :param time_zones: series with the time zone name of each date-time
+    :return: tuple with the localized date-times (object series if there are several time zones) and the date-times
+    converted to UTC
+    """
+    # The rows are aligned by position, the index can have duplicate labels
+    index = date_times.index
+    date_times = date_times.reset_index(drop=True)
+    localized_groups = []
+    utc_groups = []
+    for time_zone, group in date_times.groupby(time_zones.reset_index(drop=True), sort=False, observed=True):
+        localized = group.dt.tz_localize(time_zone, ambiguous=np.zeros(len(group), dtype=bool),
+                                         nonexistent=pd.Timedelta(hours=1))
+        localized_groups.append(localized)
+        utc_groups.append(localized.dt.tz_convert('UTC'))
+    if not localized_groups:
+        empty = pd.Series(pd.NaT, index=index, dtype='datetime64[ns, UTC]')
+        return empty, empty
+    localized = pd.concat(localized_groups).reindex(date_times.index).set_axis(index)
+    utc = pd.concat(utc_groups).reindex(date_times.index).set_axis(index)
+    return localized, utc
+
+
+def nan_rules(data, columns):
+    """
+    :param data: dataframe to be preprocessed
+    :param columns: list of columns where NaN values are not allowed
+    :return: list of (drop reason, boolean series flagging the rows with NaN), one per column
+    """
+    return [(constants.DROP_REASON_NAN + col, data[col].isna()) for col in columns]
+
+
+def split_dropped_rows(data, rules):
+    """
+    Split the rows of a dataframe into kept and dropped rows, recording on the dropped rows the first rule that dropped
+    each of them.
+    :param data: dataframe to be preprocessed
+    :param rules: list of (drop reason, boolean series flagging the rows to be dropped)
+    :return: dataframe with the kept rows, dataframe with the dropped rows and their reason on DROP_REASON_COL and
+    boolean array flagging the kept rows
+    """
+    reasons = np.full(len(data), None, dtype=object)
+    # Apply the rules backwards so the first matching rule is recorded
+    for reason, dropped in reversed(rules):
+        reasons[np.asarray(dropped, dtype=bool)] = reason
+    keep = pd.isna(reasons)
+
+    dropped_data = data[~keep].reset_index(drop=True)
+    dropped_data[constants.DROP_REASON_COL] = reasons[~keep]
+    return data[keep], dropped_data, keep
+
+
 def preprocess_oba_data(data_csv, min_activity_duration, min_trip_length, remove_still_mode) -> object:
     """ Preprocess the csv data file from oba-firebase-export as follows:
         - Change activity start date datatype from str to datetime
@@ -62,6 +144,7 @@ def preprocess_oba_data(data_csv, min_activity_duration, min_trip_length, remove
         - Drop observations that does not match the time duration and distance requirements from command_line_args
           minActivityDuration and minTripLength
         - Add column required to be used as key while merging with ground truth data
+        - Generates a log with the dropped rows and the reason why each row was dropped
 
     :param data_csv: A data frame loaded from a csv file generated by oba-firebase-export
     :param min_activity_duration: numeric value representing minimum valid activity duration in seconds.
@@ -69,40 +152,29 @@ def preprocess_oba_data(data_csv, min_activity_duration, min_trip_length, remove
     :param remove_still_mode: boolean value to indicate if records with STILL mode must be removed
     :return: Preprocessed dataframe
     """
-
+    # Assure that 'Activity Start Date and Time* (UTC)', 'Origin location Date and Time (*best) (UTC)' and
+    # 'Destination Location Date and Time (*best) (UTC)' are datetime
+    with stage('preprocess_oba.parse_datetimes', rows=len(data_csv)):
+        data_csv = data_csv.assign(**{col: pd.to_datetime(data_csv[col], errors='coerce', utc=True)
+                                      for col in constants.OBA_DATETIME_COLS_LIST})
+
+    # Rules to drop rows, in order of precedence
+    rules = []
     # Remove records with STILL mode if required
     if remove_still_mode:
-        data_csv = data_csv[data_csv['Google Activity'] != 'STILL']
-
-    # Assure that 'Activity Start Date and Time* (UTC)' is datetime
-    data_csv['Activity Start Date and Time* (UTC)'] = pd.to_datetime(data_csv['Activity Start Date and Time* (UTC)'],
-                                                                     errors='coerce', utc=True)
-
-    # Assure that 'Origin location Date and Time (*best) (UTC)' is datetime
-    data_csv['Origin location Date and Time (*best) (UTC)'] = pd.to_datetime(data_csv['Origin location Date and Time '
-                                                                                      '(*best) (UTC)'],
-                                                                             errors='coerce', utc=True)
-
-    # Assure that 'Destination Location Date and Time (*best) (UTC)' is datetime
-    data_csv['Destination Location Date and Time (*best) (UTC)'] = pd.to_datetime(
-        data_csv['Destination Location Date and Time (*best) (UTC)'],
-        errors='coerce', utc=True)
-
+        rules.append((constants.DROP_REASON_STILL, data_csv['Google Activity'] == 'STILL'))
     # Drop NaN rows for relevant columns
-    clean_data_csv = data_csv.dropna(
-        subset=constants.OBA_RELEVANT_COLS_LIST)
-
+    rules += nan_rules(data_csv, constants.OBA_RELEVANT_COLS_LIST)
     # Keep only trips with Duration greater or equal than command_line_args.minActivityDuration minutes and distance
     # greater of equal than command_line_args.minTripLength
-    clean_data_csv = clean_data_csv[(clean_data_csv['Duration* (minutes)'] >= min_activity_duration) & (
-            clean_data_csv['Origin-Destination Bird-Eye Distance* (meters)'] >= min_trip_length)]
-
-    # Add the data to be dropped to a data frame
-    data_csv_dropped = pd.merge(data_csv, clean_data_csv, how='outer', indicator=True).query("_merge != 'both'").drop(
-        '_merge', axis=1).reset_index(drop=True)
+    rules.append((constants.DROP_REASON_TOO_SHORT, data_csv['Duration* (minutes)'] < min_activity_duration))
+    rules.append((constants.DROP_REASON_TOO_NEAR,
+                  data_csv['Origin-Destination Bird-Eye Distance* (meters)'] < min_trip_length))
 
     # Return clean data and dropped data as separated dataframes
-    return clean_data_csv, data_csv_dropped
+    with stage('preprocess_oba.drop_rows', rows=len(data_csv)):
+        clean_data, dropped_data, _ = split_dropped_rows(data_csv, rules)
+    return clean_data, dropped_data
 
 
 def preprocess_gt_data(gt_data, remove_still_mode):
@@ -113,7 +185,7 @@ def preprocess_gt_data(gt_data, remove_still_mode):
         - Create GT_DateTimeCombined column joining GT_Date and GT_TimeOrig columns
         - Assign timezone to GT_DateTimeCombined
         - Add column required to be used as key while merging with ground truth data
-        - Generates a log with the dropped rows during the preprocess
+        - Generates a log with the dropped rows during the preprocess and the reason why each row was dropped
     Returns:
         Preprocessed gt dataframe
         :param gt_data: A data frame loaded from a xls file generated manually from GT data collection process
@@ -123,43 +195,34 @@ def preprocess_gt_data(gt_data, remove_still_mode):
     unnamed_cols = [col for col in gt_data.columns if 'Unnamed' in col]
     gt_data = gt_data.drop(unnamed_cols, axis=1)
 
+    # Change the GT_TimeOrig and GT_TimeDest columns to datetime.time, NaT if the change is not possible
+    with stage('preprocess_gt.parse_times', rows=len(gt_data)):
+        time_orig_offset = parse_time_of_day(gt_data['GT_TimeOrig'])
+        time_dest_offset = parse_time_of_day(gt_data['GT_TimeDest'])
+        gt_data = gt_data.assign(GT_TimeOrig=(pd.Timestamp(0) + time_orig_offset).dt.time,
+                                 GT_TimeDest=(pd.Timestamp(0) + time_dest_offset).dt.time)
+
+    # Rules to drop rows, in order of precedence
+    rules = []
     # Remove records with STILL mode if required
     if remove_still_mode:
-        gt_data = gt_data[gt_data.GT_Mode != 'STILL']
-
-    # Change data type of TimeOrig to string to make possible date-time casting
-    gt_data.GT_TimeOrig = gt_data.GT_TimeOrig.astype(str)
-    # Change the GT_TimeOrig column to datetime.time, coerce will produce NaT if the change is not possible
-    gt_data['GT_TimeOrig'] = pd.to_datetime(gt_data['GT_TimeOrig'], errors='coerce').dt.time
-
-    # Change data type of GT_TimeDest to string to make possible date-time casting
-    gt_data.GT_TimeDest = gt_data.GT_TimeDest.astype(str)
-    # Change the GT_TimeDest column to datetime.time, coerce will produce NaT if the change is not possible
-    gt_data['GT_TimeDest'] = pd.to_datetime(gt_data['GT_TimeDest'], errors='coerce').dt.time
-
-    # Drop rows with NaT on GT_Date or GT_TimeOrig
-    clean_gt_data = gt_data.dropna(subset=constants.GT_RELEVANT_COLS_LIST)
-
-    # Add the data to be dropped to a data frame
-    data_gt_dropped = pd.merge(gt_data, clean_gt_data, how='outer', indicator=True).query("_merge != 'both'").drop(
-        '_merge', axis=1).reset_index(drop=True)
-
-    # Create GT_DateTimeCombined column
-    clean_gt_data.loc[:, 'GT_DateTimeCombined'] = clean_gt_data.apply(
-        lambda x: datetime.datetime.combine(x.GT_Date, x.GT_TimeOrig), 1)
-    # Assign timezone to GT_DateTimeCombined
-    clean_gt_data.loc[:, 'GT_DateTimeCombined'] = clean_gt_data.apply(
-        lambda x: pytz.timezone(x.GT_TimeZone).localize(x.GT_DateTimeCombined), 1)
-    # Add column to be used in function "merge_asoft"
-    clean_gt_data.loc[:, 'GT_DateTimeOrigUTC'] = clean_gt_data['GT_DateTimeCombined'].dt.tz_convert('UTC')
-
-    # Create GT_DateTimeDestCombined column
-    clean_gt_data.loc[:, 'GT_DateTimeDestCombined'] = clean_gt_data.apply(
-        lambda x: datetime.datetime.combine(x.GT_Date, x.GT_TimeDest), 1)
-    # Assign timezone to GT_DateTimeDestCombined
-    clean_gt_data.loc[:, 'GT_DateTimeDestCombined'] = clean_gt_data.apply(
-        lambda x: pytz.timezone(x.GT_TimeZone).localize(x.GT_DateTimeDestCombined), 1)
-    # Add column to be used in "merge" functions
-    clean_gt_data.loc[:, 'GT_DateTimeDestUTC'] = clean_gt_data['GT_DateTimeDestCombined'].dt.tz_convert('UTC')
+        rules.append((constants.DROP_REASON_STILL, gt_data['GT_Mode'] == 'STILL'))
+    # Drop rows with NaT on GT_Date, GT_TimeOrig or GT_TimeDest
+    rules += nan_rules(gt_data, constants.GT_RELEVANT_COLS_LIST)
+    with stage('preprocess_gt.drop_rows', rows=len(gt_data)):
+        clean_gt_data, data_gt_dropped, keep = split_dropped_rows(gt_data, rules)
+
+    with stage('preprocess_gt.localize', rows=len(clean_gt_data)):
+        # Create GT_DateTimeCombined and GT_DateTimeDestCombined columns joining GT_Date with GT_TimeOrig and
+        # GT_TimeDest. The offsets of the kept rows are taken by position, the index can have duplicate labels
+        gt_date = pd.to_datetime(clean_gt_data['GT_Date']).dt.normalize()
+        date_time_orig = gt_date + time_orig_offset.to_numpy()[keep]
+        date_time_dest = gt_date + time_dest_offset.to_numpy()[keep]
+        # Assign timezone and add the UTC columns to be used in "merge" functions
+        clean_gt_data = clean_gt_data.copy()
+        clean_gt_data['GT_DateTimeCombined'], clean_gt_data['GT_DateTimeOrigUTC'] = localize_by_time_zone(
+            date_time_orig, clean_gt_data['GT_TimeZone'])
+        clean_gt_data['GT_DateTimeDestCombined'], clean_gt_data['GT_DateTimeDestUTC'] = localize_by_time_zone(
+            date_time_dest, clean_gt_data['GT_TimeZone'])
 
     return clean_gt_data, data_gt_dropped
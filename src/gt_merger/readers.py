@@ -0,0 +1,189 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.schema import apply_gt_schema, apply_oba_schema
+
+# Columns of the OBA export used by the merger, the rest of the columns of the file are not loaded
+OBA_INPUT_COLUMNS = [col for col in constants.OBA_NEW_COLUMNS_ORDER if col not in constants.OBA_COMPUTED_COLS_LIST]
+
+# Columns of GT_NEW_COLUMNS_ORDER added during the preprocess and the merge, they are not in the GT data file
+GT_COMPUTED_COLS_LIST = ['GT_DateTimeCombined', 'GT_DateTimeDestCombined', 'GT_DateTimeOrigUTC_Backup',
+                         'GT_DateTimeDestUTC']
+# Columns of the GT data file used by the merger, the rest of the columns of the file are not loaded
+GT_INPUT_COLUMNS = [col for col in constants.GT_NEW_COLUMNS_ORDER if col not in GT_COMPUTED_COLS_LIST]
+
+
+def is_valid_oba_file(csv_path):
+    """
+    Validate if the oba exported csv file has at least one row and includes the required columns to perform the
+    preprocess, without loading the whole file.
+    :param csv_path: path to the csv file exported from OBA Firebase Export App
+    :return: True if the file is not empty and includes the required columns, False otherwise
+    """
+    try:
+        first_rows = pd.read_csv(csv_path, nrows=1)
+    except pd.errors.EmptyDataError:
+        return False
+    if first_rows.empty:
+        return False
+    return set(constants.OBA_RELEVANT_COLS_LIST).issubset(first_rows.columns)
+
+
+def parse_oba_datetime(values):
+    """
+    Parse a column of datetimes exported by OBA Firebase Export App, e.g. '2019-06-16T00:49:52Z'.
+    :param values: series with the datetime strings
+    :return: series with UTC datetimes, NaT if the value is not a datetime
+    """
+    date_times = pd.to_datetime(values, format=constants.OBA_DATETIME_FORMAT, errors='coerce', utc=True)
+    # Values with other formats are parsed the slow way
+    retry = date_times.isna() & values.notna()
+    if retry.any():
+        date_times[retry] = pd.to_datetime(values[retry], errors='coerce', utc=True)
+    return date_times
+
+
+def read_oba_data(csv_path, list_of_devices, remove_still_mode, chunk_size=constants.OBA_CHUNK_SIZE):
+    """
+    Read the csv file exported from OBA Firebase Export App in chunks, loading only the columns used by the merger and
+    keeping only the rows of the devices white list and, if required, without STILL mode. The memory required is bounded
+    by the chunk size and the number of rows kept instead of the size of the file.
+    :param csv_path: path to the csv file exported from OBA Firebase Export App
+    :param list_of_devices: list of 'User ID' to keep, all the devices are kept if the list is empty
+    :param remove_still_mode: boolean value to indicate if records with STILL mode must be removed
+    :param chunk_size: number of rows read at once
+    :return: dataframe with the rows kept and the columns of the file in OBA_INPUT_COLUMNS, with the types of
+    schema.apply_oba_schema
+    """
+    input_columns = set(OBA_INPUT_COLUMNS)
+    dtypes = {col: str for col in constants.OBA_STRING_COLS_LIST}
+    reader = pd.read_csv(csv_path, usecols=lambda col: col in input_columns, dtype=dtypes, chunksize=chunk_size)
+
+    chunks = []
+    for chunk in reader:
+        keep = pd.Series(True, index=chunk.index)
+        # If a devices white list was provided, keep only those devices
+        if list_of_devices:
+            keep &= chunk['User ID'].isin(list_of_devices)
+        # Remove records with STILL mode if required
+        if remove_still_mode:
+            keep &= chunk['Google Activity'] != 'STILL'
+        chunk = chunk[keep].copy()
+        for col in constants.OBA_DATETIME_COLS_LIST:
+            chunk[col] = parse_oba_datetime(chunk[col])
+        # Chunks without rows are kept too, so the dtypes are the same as reading the whole file at once
+        chunks.append(chunk)
+
+    # The columns are cast once all the chunks are read, so the categoricals have the categories of every chunk
+    return apply_oba_schema(pd.concat(chunks, ignore_index=True))
+
+
+def convert_gt_cell(value):
+    """
+    :param value: value of a cell of the GT workbook read by openpyxl, None if the cell is empty
+    :return: value converted like pd.read_excel does: empty cells are '', whole numbers are int and error values (e.g.
+    '#N/A') are NaN
+    """
+    from openpyxl.cell.cell import ERROR_CODES
+    if value is None:
+        return ''
+    if isinstance(value, str) and value in ERROR_CODES:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def read_gt_sheet(sheet):
+    """
+    Read the columns in GT_INPUT_COLUMNS of a sheet of the GT workbook with the public read-only API of openpyxl. The
+    sheet xml is streamed, and only the cells from the first to the last column used by the merger are converted.
+    :param sheet: worksheet of a workbook opened in read-only mode
+    :return: dataframe with the same values and types as pd.read_excel
+    """
+    from pandas.io.parsers import TextParser
+    # The dimensions saved in the file can be wrong, the rows are read until the end of the sheet like pd.read_excel
+    sheet.reset_dimensions()
+    header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    positions = [i for i, name in enumerate(header) if name in GT_INPUT_COLUMNS]
+    if not positions:
+        return pd.DataFrame()
+    offsets = [position - positions[0] for position in positions]
+
+    data = []
+    last_row_with_data = -1
+    for row in sheet.iter_rows(min_row=2, min_col=positions[0] + 1, max_col=positions[-1] + 1, values_only=True):
+        values = [convert_gt_cell(row[offset]) if offset < len(row) else '' for offset in offsets]
+        if any(value != '' for value in values):
+            last_row_with_data = len(data)
+        data.append(values)
+    # Trim trailing empty rows
+    data = data[:last_row_with_data + 1]
+    # Parse the values like pd.read_excel, e.g. '' is NaN
+    return TextParser([[header[position] for position in positions]] + data, header=0, skip_blank_lines=False).read()
+
+
+def read_gt_data(gt_path, sheets=None):
+    """
+    Read the GT data file, loading only the columns used by the merger (GT_INPUT_COLUMNS). The file can be the xlsx
+    workbook filled in during the data collection, read in read-only streaming mode, or a csv or parquet export of its
+    sheet.
+    :param gt_path: path to the xlsx, csv or parquet file
+    :param sheets: list of names of the xlsx sheets to be read, e.g. one sheet for every collector,
+    constants.GT_ALL_SHEETS to read every sheet or None to read the first sheet. The sheets are appended in order, and
+    the sheet name is used as 'GT_Collector' if the sheets are selected and a sheet does not have that column.
+    :return: dataframe with the columns of the file in GT_INPUT_COLUMNS, with the types of schema.apply_gt_schema
+    """
+    extension = os.path.splitext(str(gt_path))[1].lower()
+    if extension == '.csv':
+        return apply_gt_schema(pd.read_csv(gt_path, usecols=lambda col: col in GT_INPUT_COLUMNS,
+                                           float_precision='round_trip'))
+    if extension == '.parquet':
+        import pyarrow.parquet as pq
+        file_columns = pq.ParquetFile(gt_path).schema_arrow.names
+        return apply_gt_schema(pd.read_parquet(gt_path,
+                                               columns=[col for col in file_columns if col in GT_INPUT_COLUMNS]))
+    if extension not in ('.xlsx', '.xlsm'):
+        raise ValueError("Ground truth data file must be a xlsx, csv or parquet file: " + str(gt_path))
+
+    import openpyxl
+    workbook = openpyxl.load_workbook(gt_path, read_only=True, data_only=True)
+    try:
+        # The sheet names are collector names only if the sheets are selected
+        collector_sheets = sheets is not None
+        if sheets is None:
+            sheets = workbook.sheetnames[:1]
+        elif sheets == constants.GT_ALL_SHEETS:
+            sheets = workbook.sheetnames
+        missing_sheets = [name for name in sheets if name not in workbook.sheetnames]
+        if missing_sheets:
+            raise ValueError("Sheets not found in the ground truth data file: " + ", ".join(missing_sheets))
+        sheet_data = []
+        for name in sheets:
+            data = read_gt_sheet(workbook[name])
+            if collector_sheets and 'GT_Collector' not in data.columns and not data.empty:
+                data.insert(0, 'GT_Collector', name)
+            sheet_data.append(data)
+    finally:
+        workbook.close()
+    return apply_gt_schema(sheet_data[0] if len(sheet_data) == 1 else pd.concat(sheet_data, ignore_index=True))
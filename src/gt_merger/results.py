@@ -0,0 +1,201 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import numpy as np
+import pandas as pd
+
+
+def conform_to_schema(data, columns):
+    """
+    Reorder the columns of a dataframe to follow a schema.
+    :param data: dataframe
+    :param columns: list with the names of the schema columns
+    :return: dataframe with the schema columns (NaN if missing in data) followed by the columns of data out of the
+    schema
+    """
+    extra_columns = [col for col in data.columns if col not in set(columns)]
+    return data.reindex(columns=list(columns) + extra_columns)
+
+
+class ResultBuilder:
+    """
+    Collect the dataframes produced on every merge iteration and materialize the result with a single concat, instead
+    of copying the accumulated dataframe on every iteration.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def append(self, chunk):
+        """
+        Add a dataframe to the result.
+        :param chunk: dataframe with the rows of one iteration
+        """
+        self._chunks.append(chunk)
+
+    def build(self):
+        """
+        :return: dataframe with all the collected rows and a new index
+        """
+        if not self._chunks:
+            return pd.DataFrame()
+        return pd.concat(self._chunks, ignore_index=True)
+
+
+class _ColumnBuffer:
+    """
+    Growable numpy array holding the values of one output column. Rows not written yet are missing values (NaN/NaT).
+    """
+
+    def __init__(self, dtype, capacity, tz=None, position=0):
+        self.tz = tz
+        # Integer and boolean arrays can not hold missing values, so they must start without gaps
+        if position > 0 and dtype.kind in 'iu':
+            dtype = np.dtype('float64')
+        elif position > 0 and dtype.kind == 'b':
+            dtype = np.dtype(object)
+        self.array = self._allocate(dtype, capacity)
+
+    @staticmethod
+    def _allocate(dtype, capacity):
+        if dtype.kind == 'f':
+            return np.full(capacity, np.nan, dtype=dtype)
+        if dtype.kind in 'mM':
+            return np.full(capacity, dtype.type('NaT'), dtype=dtype)
+        if dtype.kind == 'O':
+            return np.full(capacity, np.nan, dtype=object)
+        return np.empty(capacity, dtype=dtype)
+
+    def _replace(self, dtype, position, capacity=None):
+        """ Move the first `position` values to a new array with `dtype` """
+        capacity = len(self.array) if capacity is None else capacity
+        new_array = self._allocate(dtype, capacity)
+        if dtype.kind == 'O' and self.array.dtype.kind != 'O':
+            new_array[:position] = self.to_series(position).to_numpy(dtype=object)
+            self.tz = None
+        else:
+            new_array[:position] = self.array[:position]
+        self.array = new_array
+
+    def grow(self, capacity, position):
+        self._replace(self.array.dtype, position, capacity)
+
+    def mark_gap(self, position):
+        """ Make sure the array can hold missing values for a chunk without this column """
+        if self.array.dtype.kind in 'iu':
+            self._replace(np.dtype('float64'), position)
+        elif self.array.dtype.kind == 'b':
+            self._replace(np.dtype(object), position)
+
+    def write(self, values, position):
+        """
+        Copy the values of a series to the array starting at `position`, upcasting the array if required.
+        """
+        dtype, tz = _storage_dtype(values)
+        current = self.array.dtype
+        if current.kind == 'O':
+            pass
+        elif dtype.kind in 'iuf' and current.kind in 'iuf':
+            target = np.result_type(current, dtype)
+            if target != current:
+                self._replace(target, position)
+        elif dtype != current or tz != self.tz:
+            self._replace(np.dtype(object), position)
+
+        end = position + len(values)
+        if self.array.dtype.kind == 'O':
+            self.array[position:end] = values.to_numpy(dtype=object)
+        else:
+            self.array[position:end] = values.to_numpy(dtype=self.array.dtype)
+
+    def to_series(self, num_rows):
+        values = pd.Series(self.array[:num_rows])
+        if self.tz is not None:
+            values = values.dt.tz_localize('UTC').dt.tz_convert(self.tz)
+        return values
+
+
+def _storage_dtype(values):
+    """ Numpy dtype (and timezone) used to store the values of a series """
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        return np.dtype('datetime64[ns]'), values.dtype.tz
+    if isinstance(values.dtype, np.dtype):
+        return values.dtype, None
+    return np.dtype(object), None
+
+
+class ColumnarResultBuilder:
+    """
+    Preallocated builder for results sharing a fixed schema, e.g. GT_NEW_COLUMNS_ORDER + OBA_NEW_COLUMNS_ORDER. The
+    values of every chunk are copied column by column into numpy arrays that grow by doubling their capacity, so each
+    output column is materialized once. Schema columns missing in every chunk are returned filled with NaN and columns
+    out of the schema are returned after the schema columns.
+    """
+
+    def __init__(self, columns, capacity=1024):
+        """
+        :param columns: list with the names of the schema columns
+        :param capacity: expected number of rows of the result
+        """
+        self.columns = list(columns)
+        self._capacity = max(int(capacity), 1)
+        self._buffers = {}
+        self._extra_columns = []
+        self._position = 0
+
+    def __len__(self):
+        return self._position
+
+    def append(self, chunk):
+        """
+        Copy the rows of a dataframe to the result.
+        :param chunk: dataframe with the rows of one iteration
+        """
+        num_rows = len(chunk)
+        if self._position + num_rows > self._capacity:
+            self._capacity = max(2 * self._capacity, self._position + num_rows)
+            for buffer in self._buffers.values():
+                buffer.grow(self._capacity, self._position)
+
+        for col in chunk.columns:
+            values = chunk[col]
+            if col not in self._buffers:
+                dtype, tz = _storage_dtype(values)
+                self._buffers[col] = _ColumnBuffer(dtype, self._capacity, tz, self._position)
+                if col not in self.columns:
+                    self._extra_columns.append(col)
+            self._buffers[col].write(values, self._position)
+
+        for col, buffer in self._buffers.items():
+            if col not in chunk.columns:
+                buffer.mark_gap(self._position)
+        self._position += num_rows
+
+    def build(self):
+        """
+        :return: dataframe with the schema columns followed by the extra columns
+        """
+        data = {}
+        for col in self.columns + self._extra_columns:
+            if col in self._buffers:
+                data[col] = self._buffers[col].to_series(self._position)
+            else:
+                data[col] = np.full(self._position, np.nan)
+        return pd.DataFrame(data, columns=self.columns + self._extra_columns)
@@ -0,0 +1,186 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import logging
+import os
+import shutil
+import tempfile
+
+from src.gt_merger import constants
+from src.gt_merger.analytics import tolerance_statistics
+from src.gt_merger.instrumentation import RunReport, add_stages, stage
+from src.gt_merger.merging import prepare_merged_data
+from src.gt_merger.parallel import get_shared_data, map_in_pool
+from src.gt_merger.sql_backend import SqlMergeBackend
+from src.gt_merger.writers import AsyncOutputWriter
+
+logger = logging.getLogger(__name__)
+
+
+def save_dropped(gt_dropped, oba_dropped, output_path, writer):
+    """
+    Save the ground truth and OBA rows dropped by the preprocess.
+    :param gt_dropped: dataframe with the ground truth rows dropped by the preprocess
+    :param oba_dropped: dataframe with the OBA rows dropped by the preprocess
+    :param output_path: path to the output folder, usually the logs folder
+    :param writer: OutputWriter saving the files, an AsyncOutputWriter writes them while the data is merged
+    """
+    with stage('save_dropped_gt', rows=len(gt_dropped)) as record:
+        writer.write(gt_dropped, output_path, constants.GT_DROPPED_DATA_FILE_NAME, on_written=record_size(record))
+    with stage('save_dropped_oba', rows=len(oba_dropped)) as record:
+        writer.write(oba_dropped, output_path, constants.OBA_DROPPED_DATA_FILE_NAME, on_written=record_size(record))
+
+
+def save_results(output_path, writer, tolerances, workers, sweep=None, merged_to_many=None, partitioned=False,
+                 analytics=None):
+    """
+    Save the merged data and the number of matches of every tolerance, in parallel if more than one worker is
+    required, and the oba activities without a match when merging to many.
+    :param output_path: path to the output folder
+    :param writer: OutputWriter or AsyncOutputWriter saving the files
+    :param tolerances: list of tolerances (milliseconds)
+    :param workers: number of worker processes merging and saving the data of the tolerances
+    :param sweep: ToleranceSweep with the candidate matches of the data merged one to one
+    :param merged_to_many: tuple with the data merged to many, the number of matches and the unmatched oba activities,
+    used if sweep is None
+    :param partitioned: True to save parquet and feather data as a dataset partitioned by tolerance
+    :param analytics: ToleranceAnalytics accumulating the statistics of the data merged with every tolerance, they
+    are not computed if it is None
+    """
+    if sweep is not None:
+        shared_data = {'sweep': sweep, 'analytics': analytics is not None}
+    else:
+        merged_data_frame, num_matches_df, unmatched_df = merged_to_many
+        shared_data = {'merged_data': merged_data_frame, 'num_matches': num_matches_df}
+        if analytics is not None:
+            # The data merged to many is the same for every tolerance, so its statistics are computed once
+            with stage('analytics', rows=len(merged_data_frame)):
+                summary, confusion = tolerance_statistics(merged_data_frame, None)
+            for tol in tolerances:
+                analytics.add((dict(summary, tolerance=tol), confusion.assign(tolerance=tol)))
+        # Save unmatched oba records to a file
+        with stage('save_unmatched', rows=len(unmatched_df)) as record:
+            writer.write(unmatched_df, output_path, constants.UNMATCHED_DATA_FILE_NAME,
+                         on_written=record_size(record))
+
+    shared_data.update(writer=writer, output_path=output_path, partitioned=partitioned)
+    if workers > 1 and len(tolerances) > 1 and isinstance(writer, AsyncOutputWriter):
+        # The worker processes write the files of their tolerances themselves
+        writer.flush()
+        shared_data['writer'] = writer.writer
+    for task_stages, statistics in map_in_pool(save_tolerance_task, tolerances, workers, shared_data):
+        add_stages(task_stages)
+        if statistics is not None:
+            analytics.add(statistics)
+
+
+def save_sql_results(gt_data, oba_data, output_path, writer, tolerances, partitioned=False, repeat_gt_rows=False):
+    """
+    Merge the data to many with SqlMergeBackend and save it, see save_results. The database is created in a
+    temporary sub-folder of the output folder, and the merged data and the number of matches are the same for every
+    tolerance, so they are streamed to the files of the first tolerance and copied to the files of the other ones.
+    :param gt_data: preprocessed ground truth dataframe
+    :param oba_data: preprocessed OBA dataframe
+    :param output_path: path to the output folder
+    :param writer: OutputWriter or AsyncOutputWriter saving the files
+    :param tolerances: list of tolerances (milliseconds)
+    :param partitioned: True to save parquet and feather data as a dataset partitioned by tolerance
+    :param repeat_gt_rows: True to repeat the ground truth rows matched with several oba activities
+    """
+    with tempfile.TemporaryDirectory(dir=output_path) as database_dir, \
+            SqlMergeBackend(gt_data, oba_data, os.path.join(database_dir, constants.SQL_DATABASE_FILE_NAME),
+                            repeat_gt_rows) as backend:
+        with stage('save_unmatched', rows=backend.num_unmatched_rows) as record:
+            sample = None if writer.output_format == 'csv' else backend.unmatched_sample()
+            writer.write_chunks(backend.unmatched_chunks(), output_path, constants.UNMATCHED_DATA_FILE_NAME,
+                                sample=sample, on_written=record_size(record))
+
+        merged_path = num_matches_path = None
+        for tol in tolerances:
+            logger.info("TOLERANCE: %s", tol)
+            location = writer.tolerance_location(output_path, constants.MERGED_DATA_FILE_NAME, tol, partitioned)
+            with stage('save_merged', tolerance=tol, rows=backend.num_merged_rows) as record:
+                if merged_path is None:
+                    sample = None if writer.output_format == 'csv' else backend.merged_sample()
+                    merged_path = writer.write_chunks(backend.merged_chunks(), *location, sample=sample,
+                                                      on_written=record_size(record))
+                else:
+                    record['bytes'] = file_size(shutil.copyfile(merged_path, writer.path(*location)))
+            location = writer.tolerance_location(output_path, constants.NUM_MATCHES_FILE_NAME, tol, partitioned)
+            with stage('save_num_matches', tolerance=tol, rows=backend.num_matches_rows) as record:
+                if num_matches_path is None:
+                    sample = None if writer.output_format == 'csv' else backend.num_matches_sample()
+                    num_matches_path = writer.write_chunks(backend.num_matches_chunks(), *location, sample=sample,
+                                                           on_written=record_size(record))
+                else:
+                    record['bytes'] = file_size(shutil.copyfile(num_matches_path, writer.path(*location)))
+
+
+def save_tolerance_task(tol):
+    """
+    Merge the data for one tolerance and save it to files, the merged data is read from the shared data of map_in_pool:
+    a ToleranceSweep ('sweep') or the data merged to many ('merged_data' and 'num_matches'), and the files are saved
+    with the OutputWriter 'writer' to the folder 'output_path'. The statistics of the data merged one to one are
+    computed if 'analytics' is True.
+    :param tol: tolerance
+    :return: tuple with the list of the stages recorded while merging and saving the data, and the statistics of the
+    merged data returned by tolerance_statistics (None if they are not computed)
+    """
+    shared_data = get_shared_data()
+    # The task can run on a worker process, so its stages are returned to be added to the report of the run
+    task_report = RunReport()
+    logger.info("TOLERANCE: %s", tol)
+    # merge dataframes one to one or one to many according to the commandline parameter
+    if 'sweep' in shared_data:
+        with task_report.stage('merge', tolerance=tol) as record:
+            merged_data_frame, num_matches_df = shared_data['sweep'].merge(tol)
+            merged_data_frame = prepare_merged_data(merged_data_frame)
+            record['rows'] = len(merged_data_frame)
+    else:
+        merged_data_frame, num_matches_df = shared_data['merged_data'], shared_data['num_matches']
+    # The statistics are computed before the writer takes ownership of the merged data
+    statistics = None
+    if shared_data.get('analytics'):
+        with task_report.stage('analytics', tolerance=tol, rows=len(merged_data_frame)):
+            statistics = tolerance_statistics(merged_data_frame, tol)
+
+    # Save merged data to files
+    writer, output_path, partitioned = shared_data['writer'], shared_data['output_path'], shared_data['partitioned']
+    with task_report.stage('save_merged', tolerance=tol, rows=len(merged_data_frame)) as record:
+        writer.write_tolerance(merged_data_frame, output_path, constants.MERGED_DATA_FILE_NAME, tol, partitioned,
+                               on_written=record_size(record))
+    with task_report.stage('save_num_matches', tolerance=tol, rows=len(num_matches_df)) as record:
+        writer.write_tolerance(num_matches_df, output_path, constants.NUM_MATCHES_FILE_NAME, tol, partitioned,
+                               on_written=record_size(record))
+    return task_report.stages, statistics
+
+
+def file_size(file_path):
+    """
+    :param file_path: path to a file
+    :return: size (bytes) of the file, recorded on the run report
+    """
+    return os.path.getsize(file_path)
+
+
+def record_size(record):
+    """
+    :param record: record of a stage saving a file
+    :return: function recording the size of the file on the record, called by the writer once the file is written,
+    which can be after the stage finishes if the writer is an AsyncOutputWriter
+    """
+    return lambda file_path: record.update(bytes=file_size(file_path))
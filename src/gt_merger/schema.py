@@ -0,0 +1,137 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import numpy as np
+import pandas as pd
+
+# Modes of the GT trips and of the OBA activities, 'GT_Mode' and 'Google Activity' are categoricals sharing these
+# categories (and the modes out of this list found in the data, sorted), so the modes of both frames are compared by
+# their codes
+MODE_CATEGORIES = ['IN_BUS', 'IN_VEHICLE', 'ON_BICYCLE', 'ON_FOOT', 'RUNNING', 'STILL', 'TILTING', 'UNKNOWN', 'WALKING',
+                   'WALKING/RUNNING']
+
+# Columns with few distinct values repeated on many rows, loaded as categoricals
+GT_CATEGORY_COLS_LIST = ['GT_Collector', 'GT_TimeZone']
+OBA_CATEGORY_COLS_LIST = ['User ID', 'Region ID', 'Vehicle type', 'Origin Location Provider (*best)',
+                          'Destination Location Provider (*best)']
+
+# Columns recorded as 32 bit floats by the OBA app, loaded as float32 without losing precision. The coordinates have up
+# to 10 significant digits, so they are kept as float64
+OBA_FLOAT32_COLS_LIST = ['Activity Start/Origin Time Diff* (minutes)', 'Origin Horizontal Accuracy (meters) (*best)',
+                         'Activity End/Destination Time Diff* (minutes)',
+                         'Destination Horizontal Accuracy (meters) (*best)', 'Duration* (minutes)',
+                         'Origin-Destination Bird-Eye Distance* (meters)',
+                         'Origin fused Horizontal Accuracy (meters)', 'Origin gps Horizontal Accuracy (meters)',
+                         'Origin network Horizontal Accuracy (meters)',
+                         'Destination fused Horizontal Accuracy (meters)',
+                         'Destination gps Horizontal Accuracy (meters)',
+                         'Destination network Horizontal Accuracy (meters)']
+
+# Flags of the OBA export, loaded as nullable booleans (missing values are kept)
+OBA_BOOL_COLS_LIST = ['Ignoring Battery Optimizations', 'Talk Back Enabled', 'Power Save Mode Enabled']
+
+
+def to_mode_category(values):
+    """
+    :param values: series with 'GT_Mode' or 'Google Activity' values
+    :return: categorical series with MODE_CATEGORIES and the rest of the modes of the values as categories
+    """
+    other_modes = set(values.dropna().unique()) - set(MODE_CATEGORIES)
+    return values.astype(pd.CategoricalDtype(MODE_CATEGORIES + sorted(other_modes, key=str)))
+
+
+def to_category(values):
+    """
+    :param values: series
+    :return: categorical series with the sorted distinct values as categories, or the series if it is categorical
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.remove_unused_categories()
+    return values.astype('category')
+
+
+def to_boolean(values):
+    """
+    :param values: series with True/False values, as booleans or as text, and missing values
+    :return: nullable boolean series, the values that are not booleans are missing values
+    """
+    if pd.api.types.is_bool_dtype(values):
+        return values.astype('boolean')
+    text = values.astype(str).str.lower()
+    return pd.Series(pd.array(np.where(text == 'true', True, np.where(text == 'false', False, None)),
+                              dtype='boolean'), index=values.index)
+
+
+def apply_gt_schema(gt_data):
+    """
+    Cast the columns of the GT data to compact types: categoricals for the repeated strings and the shared mode
+    categories for 'GT_Mode'. The columns missing in the data are ignored.
+    :param gt_data: dataframe with GT data
+    :return: dataframe with the typed columns
+    """
+    casts = {col: to_category for col in GT_CATEGORY_COLS_LIST}
+    casts['GT_Mode'] = to_mode_category
+    return apply_casts(gt_data, casts)
+
+
+def apply_oba_schema(oba_data):
+    """
+    Cast the columns of the OBA data to compact types: categoricals for the repeated strings, the shared mode categories
+    for 'Google Activity', float32 for the accuracies, durations and distances and nullable booleans for the flags.
+    The columns missing in the data are ignored.
+    :param oba_data: dataframe with OBA data
+    :return: dataframe with the typed columns
+    """
+    casts = {col: to_category for col in OBA_CATEGORY_COLS_LIST}
+    casts['Google Activity'] = to_mode_category
+    casts.update({col: lambda values: values.astype(np.float32) for col in OBA_FLOAT32_COLS_LIST})
+    casts.update({col: to_boolean for col in OBA_BOOL_COLS_LIST})
+    return apply_casts(oba_data, casts)
+
+
+def apply_casts(data, casts):
+    """
+    :param data: dataframe
+    :param casts: dictionary with the function casting the values of every column
+    :return: copy of the dataframe with the columns cast
+    """
+    return data.assign(**{col: cast(data[col]) for col, cast in casts.items() if col in data.columns})
+
+
+def with_numpy_dtypes(data):
+    """
+    Cast the categorical and nullable boolean columns to object columns, e.g. before slicing and concatenating many
+    small blocks of the data, which is slower with a pandas block for each of those columns.
+    :param data: dataframe
+    :return: dataframe with numpy dtypes, the same dataframe if every column has a numpy dtype
+    """
+    extension_cols = [col for col, dtype in data.dtypes.items()
+                      if not isinstance(dtype, (np.dtype, pd.DatetimeTZDtype))]
+    if not extension_cols:
+        return data
+    return data.astype({col: object for col in extension_cols})
+
+
+def same_categories(first_values, second_values):
+    """
+    :param first_values: series
+    :param second_values: series
+    :return: True if both series are categoricals with the same categories, so their codes can be compared
+    """
+    return isinstance(first_values.dtype, pd.CategoricalDtype) and \
+        isinstance(second_values.dtype, pd.CategoricalDtype) and \
+        first_values.cat.categories.equals(second_values.cat.categories)
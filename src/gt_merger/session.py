@@ -0,0 +1,455 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import copy
+import io
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.assignment import AssignmentSweep
+from src.gt_merger.cache import PreprocessCache, is_cache_available
+from src.gt_merger.incremental import IncrementalState, without_state_columns
+from src.gt_merger.instrumentation import stage
+from src.gt_merger.interval_join import match_flags, to_epoch_ns
+from src.gt_merger.merging import merge_to_many, prepare_merged_data
+from src.gt_merger.preprocess import preprocess_gt_data, preprocess_oba_data, is_valid_gt_dataframe
+from src.gt_merger.readers import is_valid_oba_file, read_gt_data, read_oba_data
+from src.gt_merger.saving import save_dropped, save_results, save_sql_results
+from src.gt_merger.schema import apply_gt_schema, apply_oba_schema
+from src.gt_merger.spatial import SpatialSweep
+from src.gt_merger.sweep import ToleranceSweep
+from src.gt_merger.timeline import TimelineSweep
+from src.gt_merger.writers import OutputWriter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_gt_sheets(gt_sheets):
+    """
+    :param gt_sheets: value of the gtSheets command line argument, comma separated names of sheets
+    :return: list of names of sheets, constants.GT_ALL_SHEETS or None (the first sheet) if the value is empty
+    """
+    if not gt_sheets:
+        return None
+    if gt_sheets.strip() == constants.GT_ALL_SHEETS:
+        return constants.GT_ALL_SHEETS
+    return [name.strip() for name in gt_sheets.split(",")]
+
+
+class MergeConfig:
+    """
+    Options of a merge session, with the same meaning and default values as the command line arguments of matchAndMerge.
+    """
+
+    def __init__(self, min_activity_duration=constants.MIN_ACTIVITY_DURATION,
+                 min_trip_length=constants.MIN_TRIP_LENGTH, remove_still_mode=True, device_list=(),
+                 merge_one_to_one=False, repeat_gt_rows=False, tolerance=constants.TOLERANCE,
+                 workers=constants.WORKERS, chunk_size=constants.OBA_CHUNK_SIZE, cache_dir=None,
+                 cache_max_size=constants.CACHE_MAX_SIZE_MB, state_dir=None, gt_sheets=None, max_origin_distance=None,
+                 optimal_assignment=False, backend=constants.MERGE_BACKEND, global_timeline=False):
+        """
+        :param min_activity_duration: minimum activity time span (minutes), shorter activities are dropped
+        :param min_trip_length: minimum length distance (meters) of a trip, shorter trips are dropped
+        :param remove_still_mode: boolean value to indicate if records with STILL mode must be removed
+        :param device_list: list of OBA devices to be merged, all the devices are merged if the list is empty
+        :param merge_one_to_one: True to merge every GT trip with the nearest activity, False to merge it with all the
+        activities starting during the trip
+        :param repeat_gt_rows: boolean value to indicate if the GT data must be repeated on every row of a bunch of
+        matches, when merging to many
+        :param tolerance: maximum difference (milliseconds) between the start of a GT trip and of its activity
+        :param workers: number of worker processes
+        :param chunk_size: number of rows read at once from the OBA data file
+        :param cache_dir: path to directory where preprocessed input data is cached, None to not use the cache
+        :param cache_max_size: maximum size (megabytes) of the cache directory
+        :param state_dir: path to directory where the state of the incremental merge is saved, None to preprocess and
+        merge all the input data
+        :param gt_sheets: list of names of the sheets of the GT workbook to be read, constants.GT_ALL_SHEETS to read
+        every sheet or None to read the first sheet
+        :param max_origin_distance: maximum distance (meters) between the origins of a GT trip and of its activity when
+        merging one to one, None to pair them only by their start times
+        :param optimal_assignment: True to assign every activity to at most one GT trip when merging one to one, it can
+        not be used with max_origin_distance
+        :param backend: 'pandas' or 'sqlite', backend merging to many when the results are saved. The sqlite backend
+        merges the data on a file backed database and streams the merged data to the output files, it can not be used
+        with the incremental merge
+        :param global_timeline: True to merge one to one with TimelineSweep, searching the activities of all the devices
+        on a single timeline and saving the merged data in long format, it can not be used with max_origin_distance or
+        optimal_assignment
+        """
+        self.min_activity_duration = min_activity_duration
+        self.min_trip_length = min_trip_length
+        self.remove_still_mode = remove_still_mode
+        self.device_list = list(device_list)
+        self.merge_one_to_one = merge_one_to_one
+        self.repeat_gt_rows = repeat_gt_rows
+        self.tolerance = tolerance
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache_dir = cache_dir
+        self.cache_max_size = cache_max_size
+        self.state_dir = state_dir
+        self.gt_sheets = gt_sheets
+        self.max_origin_distance = max_origin_distance
+        self.optimal_assignment = optimal_assignment
+        self.backend = backend
+        self.global_timeline = global_timeline
+
+    @classmethod
+    def from_args(cls, args, list_of_devices=()):
+        """
+        :param args: command line arguments returned by get_parser
+        :param list_of_devices: list of OBA devices read from the deviceList file
+        :return: MergeConfig with the options of the command line arguments
+        """
+        return cls(min_activity_duration=args.minActivityDuration, min_trip_length=args.minTripLength,
+                   remove_still_mode=args.removeStillMode, device_list=list_of_devices,
+                   merge_one_to_one=args.mergeOneToOne, repeat_gt_rows=args.repeatGtRows, tolerance=args.tolerance,
+                   workers=args.workers, chunk_size=args.chunkSize,
+                   cache_dir=None if args.noCache
+                   else (args.cacheDir or os.path.join(args.outputDir, constants.FOLDER_CACHE)),
+                   cache_max_size=args.cacheMaxSize,
+                   state_dir=(args.stateDir or os.path.join(args.outputDir, constants.FOLDER_STATE))
+                   if args.incremental else None, gt_sheets=parse_gt_sheets(args.gtSheets),
+                   max_origin_distance=args.maxOriginDistance, optimal_assignment=args.optimalAssignment,
+                   backend=args.backend, global_timeline=args.globalTimeline)
+
+    def replace(self, **changes):
+        """
+        :param changes: options to be changed, e.g. tolerance=60000
+        :return: copy of the config with the changed options
+        """
+        config = copy.copy(self)
+        for name, value in changes.items():
+            if not hasattr(config, name):
+                raise TypeError("Unknown merge option: " + name)
+            setattr(config, name, value)
+        return config
+
+    def __repr__(self):
+        return 'MergeConfig(' + ', '.join(name + '=' + repr(value) for name, value in vars(self).items()) + ')'
+
+
+class MergeSession:
+    """
+    Load and preprocess the input data once and merge it as many times as required, e.g. with different tolerances or
+    options, without the command line. The preprocessed data, the candidate matches of the one to one merge and the
+    data merged to many are kept in memory, so only the first merge of every kind does the expensive work:
+
+        session = MergeSession(MergeConfig(merge_one_to_one=True)).load('gt.xlsx', 'oba.csv')
+        for tolerance in [30000, 60000, 90000]:
+            merged_data, num_matches, _ = session.merge(tolerance)
+    """
+
+    def __init__(self, config=None):
+        """
+        :param config: MergeConfig with the options of the session, the default options are used if it is None
+        """
+        self.config = config or MergeConfig()
+        self.gt_data = self.gt_dropped = None
+        self.oba_data = self.oba_dropped = None
+        self._sweep = None
+        self._merged_to_many = {}
+
+        # State of the incremental merge, it keeps the preprocessed input data so the cache is not used
+        self.state = None
+        if self.config.state_dir:
+            self.state = IncrementalState(self.config.state_dir,
+                                          minActivityDuration=self.config.min_activity_duration,
+                                          minTripLength=self.config.min_trip_length,
+                                          removeStillMode=self.config.remove_still_mode,
+                                          deviceList=sorted(self.config.device_list),
+                                          repeatGtRows=self.config.repeat_gt_rows)
+            with stage('load_state') as record:
+                record['loaded'] = self.state.load()
+
+        # Cache of preprocessed input data
+        self.cache = None
+        if self.config.cache_dir and not self.state:
+            if is_cache_available():
+                self.cache = PreprocessCache(self.config.cache_dir, self.config.cache_max_size)
+            else:
+                logger.warning("pyarrow is not installed, preprocessed data will not be cached.")
+
+    def load(self, gt_file, oba_file):
+        """
+        Load and preprocess the ground truth and OBA data.
+        :param gt_file: see load_gt
+        :param oba_file: see load_oba
+        :return: the session
+        """
+        self.load_gt(gt_file)
+        self.load_oba(oba_file)
+        if logger.isEnabledFor(logging.DEBUG):
+            for data in (self.oba_data, self.gt_data):
+                buffer = io.StringIO()
+                data.info(buf=buffer)
+                logger.debug(buffer.getvalue())
+        return self
+
+    def load_gt(self, gt_file):
+        """
+        Load and preprocess the ground truth data, the results of the previous merges are discarded.
+        :param gt_file: path to XLSX file including the Ground Truth data (or to a CSV or Parquet export of it), or
+        dataframe with its data (not cached)
+        :return: the session
+        """
+        self._discard_results()
+        from_file = not isinstance(gt_file, pd.DataFrame)
+        cache_key = self.cache.get_key(Path(gt_file), removeStillMode=self.config.remove_still_mode,
+                                       gtSheets=self.config.gt_sheets) \
+            if self.cache and from_file else None
+        with stage('load_gt') as record:
+            cached_gt_data = self.cache.load(cache_key) if cache_key else None
+            if cached_gt_data:
+                gt_data, self.gt_dropped = cached_gt_data
+            else:
+                # Load ground truth data to a dataframe
+                gt_data = read_gt_data(Path(gt_file), self.config.gt_sheets) if from_file else apply_gt_schema(gt_file)
+            record.update(rows=len(gt_data), from_cache=bool(cached_gt_data))
+
+        if cached_gt_data:
+            logger.info("Ground truth data loaded from cache.")
+        else:
+            # Validate gt dataframe
+            if not is_valid_gt_dataframe(gt_data):
+                raise ValueError("Ground truth data frame is empty or does not have the required columns.")
+
+            # Preprocess ground truth data
+            with stage('preprocess_gt') as record:
+                if self.state:
+                    # Only the new and changed rows are preprocessed
+                    record['updated_rows'] = self.state.update_gt(
+                        gt_data, lambda data: preprocess_gt_data(data, self.config.remove_still_mode))
+                    gt_data, self.gt_dropped = (without_state_columns(self.state.gt.clean),
+                                                without_state_columns(self.state.gt.dropped))
+                else:
+                    gt_data, self.gt_dropped = preprocess_gt_data(gt_data, self.config.remove_still_mode)
+                record.update(rows=len(gt_data), dropped_rows=len(self.gt_dropped))
+            if cache_key:
+                with stage('cache_gt'):
+                    self.cache.store(cache_key, gt_data, self.gt_dropped)
+        self.gt_data = gt_data
+        logger.info("Ground truth data preprocessed.")
+        return self
+
+    def load_oba(self, oba_file):
+        """
+        Load and preprocess the OBA data, the results of the previous merges are discarded.
+        :param oba_file: path to CSV file exported from OBA Firebase Export App, or dataframe returned by read_oba_data
+        (not cached, and the devices white list and STILL mode are not filtered again)
+        :return: the session
+        """
+        self._discard_results()
+        from_file = not isinstance(oba_file, pd.DataFrame)
+        cache_key = self.cache.get_key(Path(oba_file), minActivityDuration=self.config.min_activity_duration,
+                                       minTripLength=self.config.min_trip_length,
+                                       removeStillMode=self.config.remove_still_mode,
+                                       deviceList=sorted(self.config.device_list)) \
+            if self.cache and from_file else None
+        with stage('load_oba') as record:
+            cached_oba_data = self.cache.load(cache_key) if cache_key else None
+            if cached_oba_data:
+                oba_data, self.oba_dropped = cached_oba_data
+            elif from_file:
+                # Validate oba data file
+                if not is_valid_oba_file(Path(oba_file)):
+                    raise ValueError("OBA data frame is empty or does not have the required columns.")
+
+                # Load OBA data in chunks, keeping only the devices in the white list if it was provided
+                oba_data = read_oba_data(Path(oba_file), self.config.device_list, self.config.remove_still_mode,
+                                         self.config.chunk_size)
+            else:
+                oba_data = apply_oba_schema(oba_file)
+            record.update(rows=len(oba_data), from_cache=bool(cached_oba_data))
+
+        if cached_oba_data:
+            logger.info("OBA data loaded from cache.")
+        else:
+            # Preprocess OBA data
+            with stage('preprocess_oba') as record:
+                if self.state:
+                    # Only the new and changed rows are preprocessed
+                    record['updated_rows'] = self.state.update_oba(oba_data, self._preprocess_oba)
+                    oba_data, self.oba_dropped = (without_state_columns(self.state.oba.clean),
+                                                  without_state_columns(self.state.oba.dropped))
+                else:
+                    oba_data, self.oba_dropped = self._preprocess_oba(oba_data)
+                record.update(rows=len(oba_data), dropped_rows=len(self.oba_dropped))
+            if cache_key:
+                with stage('cache_oba'):
+                    self.cache.store(cache_key, oba_data, self.oba_dropped)
+        self.oba_data = oba_data
+        logger.info("OBA data preprocessed.")
+        return self
+
+    def _preprocess_oba(self, oba_data):
+        return preprocess_oba_data(oba_data, self.config.min_activity_duration, self.config.min_trip_length,
+                                   self.config.remove_still_mode)
+
+    def _discard_results(self):
+        self._sweep = None
+        self._merged_to_many = {}
+
+    def _check_loaded(self):
+        if self.gt_data is None or self.oba_data is None:
+            raise ValueError("The ground truth and OBA data must be loaded before merging.")
+
+    def _save_state(self):
+        if self.state:
+            with stage('save_state'):
+                self.state.save()
+
+    @property
+    def sweep(self):
+        """
+        :return: ToleranceSweep with the candidate matches of the loaded data, found on the first one to one merge, or
+        SpatialSweep if the config has a max_origin_distance, or AssignmentSweep if it has optimal_assignment, or
+        TimelineSweep if it has global_timeline
+        """
+        self._check_loaded()
+        if self._sweep is None:
+            if self.config.max_origin_distance is not None and self.config.optimal_assignment:
+                raise ValueError("The maximum origin distance can not be used with the optimal assignment.")
+            if self.config.global_timeline and (self.config.max_origin_distance is not None or
+                                                self.config.optimal_assignment):
+                raise ValueError("The global timeline can not be used with the maximum origin distance or the optimal "
+                                 "assignment.")
+            with stage('tolerance_sweep'):
+                if self.config.global_timeline:
+                    self._sweep = TimelineSweep(self.gt_data, self.oba_data, self.config.tolerance)
+                elif self.config.optimal_assignment:
+                    self._sweep = AssignmentSweep(self.gt_data, self.oba_data)
+                elif self.config.max_origin_distance is not None:
+                    self._sweep = SpatialSweep(self.gt_data, self.oba_data, self.config.max_origin_distance,
+                                               self.config.tolerance)
+                else:
+                    self._sweep = ToleranceSweep(self.gt_data, self.oba_data)
+            self._save_state()
+        return self._sweep
+
+    def merge(self, tolerance=None, merge_one_to_one=None, repeat_gt_rows=None):
+        """
+        Merge the loaded data, the options of the config are used for the arguments that are None.
+        :param tolerance: maximum difference (milliseconds) between the start of a GT trip and of its activity
+        :param merge_one_to_one: True to merge every GT trip with the nearest activity, False to merge it with all the
+        activities starting during the trip
+        :param repeat_gt_rows: boolean value to indicate if the GT data must be repeated on every row of a bunch of
+        matches, when merging to many
+        :return: dataframe with the merged data (columns in GT_NEW_COLUMNS_ORDER + OBA_NEW_COLUMNS_ORDER), dataframe
+        with the number of matches and dataframe with the oba activities without a match on GT data (None when merging
+        one to one). The dataframes merged to many are shared by the next calls, so they must not be modified.
+        """
+        tolerance = self.config.tolerance if tolerance is None else tolerance
+        merge_one_to_one = self.config.merge_one_to_one if merge_one_to_one is None else merge_one_to_one
+        repeat_gt_rows = self.config.repeat_gt_rows if repeat_gt_rows is None else repeat_gt_rows
+
+        if merge_one_to_one:
+            merged_data_frame, num_matches_df = self.sweep.merge(tolerance)
+            return prepare_merged_data(merged_data_frame), num_matches_df, None
+
+        self._check_loaded()
+        # Merging to many does not depend on the tolerance, so the data is merged only once
+        if repeat_gt_rows not in self._merged_to_many:
+            with stage('merge_to_many') as record:
+                if self.state and repeat_gt_rows == self.config.repeat_gt_rows:
+                    # Only the trips affected by the new and changed rows are merged
+                    merged_data_frame, num_matches_df, unmatched_df = self.state.merge_to_many(repeat_gt_rows)
+                else:
+                    merged_data_frame, num_matches_df, unmatched_df = merge_to_many(
+                        self.gt_data, self.oba_data, tolerance, self.config.workers, repeat_gt_rows)
+                record.update(rows=len(merged_data_frame), unmatched_rows=len(unmatched_df))
+            if self.state and repeat_gt_rows == self.config.repeat_gt_rows:
+                self._save_state()
+            self._merged_to_many[repeat_gt_rows] = (prepare_merged_data(merged_data_frame), num_matches_df,
+                                                    unmatched_df)
+        return self._merged_to_many[repeat_gt_rows]
+
+    def match_summary(self, tolerance=None):
+        """
+        Count the GT trips and the OBA activities merged with each other with the options of the config, without
+        building the merged data.
+        :param tolerance: maximum difference (milliseconds) between the start of a GT trip and of its activity when
+        merging one to one, the tolerance of the config if it is None
+        :return: dict with the number of GT trips and OBA activities ('gt_trips' and 'oba_activities'), the number of
+        them merged at least once ('matched_trips' and 'matched_activities') and their rates ('trip_match_rate' and
+        'activity_match_rate')
+        """
+        self._check_loaded()
+        tolerance = self.config.tolerance if tolerance is None else tolerance
+        if self.config.merge_one_to_one:
+            gt_positions, oba_positions = self.sweep.matched_pairs(tolerance)
+            matched_trips, matched_activities = len(np.unique(gt_positions)), len(np.unique(oba_positions))
+        else:
+            # Every trip is merged with the activities of every oba user starting during the trip
+            orig, valid_orig = to_epoch_ns(self.gt_data['GT_DateTimeOrigUTC'])
+            dest, valid_dest = to_epoch_ns(self.gt_data['GT_DateTimeDestUTC'])
+            starts, valid_starts = to_epoch_ns(self.oba_data['Activity Start Date and Time* (UTC)'])
+            trips, activities = match_flags(orig, dest, valid_orig & valid_dest, starts, valid_starts)
+            matched_trips, matched_activities = int(trips.sum()), int(activities.sum())
+        return {'gt_trips': len(self.gt_data), 'matched_trips': matched_trips,
+                'trip_match_rate': matched_trips / len(self.gt_data) if len(self.gt_data) else 0.0,
+                'oba_activities': len(self.oba_data), 'matched_activities': matched_activities,
+                'activity_match_rate': matched_activities / len(self.oba_data) if len(self.oba_data) else 0.0}
+
+    def save_dropped(self, output_path, writer=None):
+        """
+        Save the ground truth and OBA rows dropped by the preprocess.
+        :param output_path: path to the output folder, usually the logs folder
+        :param writer: OutputWriter saving the files, csv files are saved if it is None. An AsyncOutputWriter writes
+        them while the data is merged
+        """
+        save_dropped(self.gt_dropped, self.oba_dropped, output_path, writer or OutputWriter())
+
+    def save_results(self, output_path, writer=None, tolerances=None, partitioned=False, analytics=None):
+        """
+        Merge the data with the options of the config and save the merged data and the number of matches of every
+        tolerance, in parallel if more than one worker is required, and the oba activities without a match when merging
+        to many. The data merged to many is saved with the backend of the config. The files are written when it returns,
+        including the ones queued before on an AsyncOutputWriter.
+        :param output_path: path to the output folder
+        :param writer: OutputWriter or AsyncOutputWriter saving the files, csv files are saved if it is None
+        :param tolerances: list of tolerances (milliseconds), only the tolerance of the config if it is None
+        :param partitioned: True to save parquet and feather data as a dataset partitioned by tolerance
+        :param analytics: ToleranceAnalytics accumulating the statistics of the data merged with every tolerance, they
+        are not computed if it is None. They can not be computed with the sqlite backend
+        """
+        writer = writer or OutputWriter()
+        tolerances = [self.config.tolerance] if tolerances is None else list(tolerances)
+        if self.config.workers > 1:
+            # The worker processes must not be forked while other threads write the pending files
+            writer.flush()
+        # Find the candidate matches once, the merged data for each tolerance is derived from them
+        if self.config.merge_one_to_one:
+            save_results(output_path, writer, tolerances, self.config.workers, sweep=self.sweep,
+                         partitioned=partitioned, analytics=analytics)
+        elif self.config.backend == 'sqlite':
+            if analytics is not None:
+                raise ValueError("The analytics can not be computed with the sqlite backend.")
+            if self.state:
+                raise ValueError("The sqlite backend can not be used with the incremental merge.")
+            self._check_loaded()
+            save_sql_results(self.gt_data, self.oba_data, output_path, writer, tolerances, partitioned,
+                             self.config.repeat_gt_rows)
+        else:
+            save_results(output_path, writer, tolerances, self.config.workers, merged_to_many=self.merge(),
+                         partitioned=partitioned, analytics=analytics)
+        writer.flush()
@@ -0,0 +1,224 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import numpy as np
+
+from src.gt_merger.instrumentation import stage
+from src.gt_merger.interval_join import expand_windows
+from src.gt_merger.metrics import EARTH_RADIUS_METERS, haversine_distance, to_float_array
+from src.gt_merger.sweep import ToleranceSweep, match_keys, user_mode_keys
+
+# Offsets (rows, columns) of a grid cell and of its eight neighbours
+NEIGHBOUR_OFFSETS = [(row, col) for row in (-1, 0, 1) for col in (-1, 0, 1)]
+
+
+class OriginGrid:
+    """
+    Grid of cells at least max_distance wide (along the meridians and the parallels) over the origins of the GT trips
+    and of the OBA activities, so the points closer than max_distance to a point are always in its cell or in one of
+    the eight neighbouring cells.
+    """
+
+    def __init__(self, latitudes, longitudes, max_distance):
+        """
+        :param latitudes: float64 array with the latitudes (decimal degrees) of all the points indexed on the grid
+        :param longitudes: float64 array with the longitudes (decimal degrees) of all the points indexed on the grid
+        :param max_distance: maximum distance (meters) between the points of a candidate pair
+        """
+        valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        max_abs_latitude = np.abs(latitudes[valid]).max() if valid.any() else 0.0
+        angle = max_distance / EARTH_RADIUS_METERS
+        # Two points closer than max_distance differ by less than this in latitude, and in longitude if both are not
+        # farther than max_abs_latitude from the equator (from the haversine formula)
+        self.lat_size = np.degrees(angle)
+        cos_latitude = np.cos(np.radians(max_abs_latitude))
+        self.lon_size = np.degrees(2 * np.arcsin(min(1.0, np.sin(angle / 2) / cos_latitude))) if cos_latitude > 0 \
+            else 360.0
+        rows, cols = self._cells(latitudes, longitudes)
+        # The cells are numbered row by row, with an empty row and column on every side for the neighbours
+        self._first_row = rows[valid].min() - 1 if valid.any() else 0
+        self._first_col = cols[valid].min() - 1 if valid.any() else 0
+        self._num_cols = (cols[valid].max() - self._first_col + 2) if valid.any() else 1
+
+    def _cells(self, latitudes, longitudes):
+        with np.errstate(invalid='ignore'):
+            rows = np.floor(np.nan_to_num(latitudes) / self.lat_size).astype(np.int64)
+            cols = np.floor(np.nan_to_num(longitudes) / self.lon_size).astype(np.int64)
+        return rows, cols
+
+    def cells(self, latitudes, longitudes, offset=(0, 0)):
+        """
+        :param latitudes: float64 array with latitudes (decimal degrees) of points indexed on the grid
+        :param longitudes: float64 array with longitudes (decimal degrees) of points indexed on the grid
+        :param offset: tuple with the offset (rows, columns) of the returned cells, e.g. (-1, 1) for the neighbour at
+        the south east
+        :return: int64 array with the cell of every point, -1 where the latitude or the longitude is missing
+        """
+        rows, cols = self._cells(latitudes, longitudes)
+        cells = (rows + offset[0] - self._first_row) * self._num_cols + cols + offset[1] - self._first_col
+        return np.where(np.isnan(latitudes) | np.isnan(longitudes), -1, cells)
+
+
+def spatial_candidates(window_starts, window_keys, window_cells, points, point_keys, point_cells, window):
+    """
+    Find for every window start all the points with the same key, in the same grid cell or in a neighbouring cell,
+    whose value is equal or greater than the window start and not greater than the window start plus the window.
+    :param window_starts: int64 array with the start of every window
+    :param window_keys: int array with the key of every window, negative keys never match
+    :param window_cells: list with the int64 arrays of the cells of the windows, its cell and every neighbouring cell
+    :param points: int64 array with the value of every point
+    :param point_keys: int array with the key of every point, negative keys never match
+    :param point_cells: int64 array with the cell of every point, negative cells never match
+    :param window: length of the windows, in the units of the points
+    :return: tuple of int64 arrays with the position of the window and the position of the point of every candidate
+    pair
+    """
+    valid_points = np.flatnonzero((point_keys >= 0) & (point_cells >= 0))
+    if not len(valid_points) or not len(window_starts):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # Every (key, cell) of the points is numbered as a group, and the values are replaced by their rank among the values
+    # and the window bounds, so the points are sorted by a single int64 value (group, rank)
+    num_cells = int(max(point_cells.max(), max(cells.max() for cells in window_cells))) + 1
+    groups, point_groups = np.unique(point_keys[valid_points].astype(np.int64) * num_cells + point_cells[valid_points],
+                                     return_inverse=True)
+    values, ranks = np.unique(np.concatenate([points[valid_points], window_starts, window_starts + window]),
+                              return_inverse=True)
+    num_ranks = len(values)
+    sorted_points = point_groups * num_ranks + ranks[:len(valid_points)]
+    order = np.argsort(sorted_points, kind='stable')
+    sorted_points = sorted_points[order]
+    valid_points = valid_points[order]
+    start_ranks = ranks[len(valid_points):len(valid_points) + len(window_starts)]
+    end_ranks = ranks[len(valid_points) + len(window_starts):]
+
+    window_positions = []
+    point_positions = []
+    for cells in window_cells:
+        # Group of the cell of every window, the windows whose group has no points do not match
+        window_groups = window_keys.astype(np.int64) * num_cells + cells
+        group_positions = np.minimum(np.searchsorted(groups, window_groups), len(groups) - 1)
+        valid_windows = (window_keys >= 0) & (cells >= 0) & (groups[group_positions] == window_groups)
+        lo = np.searchsorted(sorted_points, group_positions * num_ranks + start_ranks, side='left')
+        hi = np.searchsorted(sorted_points, group_positions * num_ranks + end_ranks, side='right')
+        hi = np.where(valid_windows, np.maximum(hi, lo), lo)
+        cell_windows, cell_points, _ = expand_windows(lo, hi)
+        found = cell_points >= 0
+        window_positions.append(cell_windows[found])
+        point_positions.append(valid_points[cell_points[found]])
+    return np.concatenate(window_positions), np.concatenate(point_positions)
+
+
+class SpatialSweep(ToleranceSweep):
+    """
+    Match every GT trip and oba user with the activity of the same mode starting within the tolerance after the GT trip
+    start, and whose origin is not farther than max_distance from the GT trip origin. Among these candidates, the one
+    with the lowest combined cost (time gap / tolerance + distance / max_distance) is merged. The candidates are found
+    with a grid of the origins, so the pairs of activities and trips far from each other are never evaluated.
+    The candidate pairs are found once for the largest tolerance, the merge for any lower tolerance only selects the
+    best candidate of every merged row among them.
+    """
+
+    def __init__(self, gt_data, oba_data, max_distance, max_tolerance):
+        """
+        :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+        :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+        :param max_distance: maximum distance (meters) between the origins of the GT trip and of its activity
+        :param max_tolerance: largest tolerance (milliseconds) to be merged, the candidates are found again if the data
+        is merged with a greater tolerance
+        """
+        if not max_distance > 0:
+            raise ValueError("The maximum origin distance must be greater than zero.")
+        self.max_distance = max_distance
+        self.max_tolerance = max_tolerance
+        super().__init__(gt_data, oba_data)
+
+    def _find_candidates(self, gt_data, oba_data, pair_rows):
+        """
+        Find every candidate pair of a merged row and an activity within the max_tolerance and the max_distance.
+        :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+        :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+        :param pair_rows: list with the positions of the GT trips and of the oba user activities of every pair
+        """
+        self._pair_rows = pair_rows
+        gt_orig, gt_modes, oba_start, oba_modes = match_keys(gt_data, oba_data)
+        gt_lat = to_float_array(gt_data['GT_LatOrig'])
+        gt_lon = to_float_array(gt_data['GT_LonOrig'])
+        oba_lat = to_float_array(oba_data['Origin latitude (*best)'])
+        oba_lon = to_float_array(oba_data['Origin longitude (*best)'])
+        grid = OriginGrid(np.concatenate([gt_lat, oba_lat]), np.concatenate([gt_lon, oba_lon]), self.max_distance)
+        gt_cells = [grid.cells(gt_lat, gt_lon, offset) for offset in NEIGHBOUR_OFFSETS]
+        oba_cells = grid.cells(oba_lat, oba_lon)
+
+        # The key of the candidates is the oba user and the mode, so the pairs of every collector and oba user are
+        # searched at once
+        merged_keys, oba_keys = user_mode_keys(self._merged_users(), gt_modes[self._gt_positions], self._user_rows,
+                                               oba_modes)
+        merged_rows, candidates = spatial_candidates(gt_orig[self._gt_positions], merged_keys,
+                                                     [cells[self._gt_positions] for cells in gt_cells], oba_start,
+                                                     oba_keys, oba_cells, int(self.max_tolerance) * 1000000)
+
+        # Time and distance differences between GT and OBA starting points of every candidate pair, the pairs farther
+        # than max_distance (in the neighbouring cells) are dropped
+        with stage('metrics', rows=len(candidates)):
+            gt_positions = self._gt_positions[merged_rows]
+            distances = haversine_distance(gt_lat[gt_positions], gt_lon[gt_positions], oba_lat[candidates],
+                                           oba_lon[candidates])
+            near = distances <= self.max_distance
+            self._pair_merged_rows = merged_rows[near]
+            self._pair_candidates = candidates[near]
+            self._pair_gaps = oba_start[self._pair_candidates] - gt_orig[gt_positions[near]]
+            self._pair_distances = distances[near]
+
+    def select(self, tolerance):
+        """
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: tuple with the boolean array flagging the merged rows with a match within the tolerance and the
+        max_distance, and the position on oba_data, time difference (seconds) and distance (meters) of the match of
+        every merged row
+        """
+        if tolerance > self.max_tolerance:
+            self.max_tolerance = tolerance
+            self._find_candidates(self._gt_data, self._oba_data, self._pair_rows)
+
+        # Best candidate of every merged row, the ties are broken by the time gap and then by the order of the data
+        window = max(int(tolerance), 1) * 1000000
+        within = np.flatnonzero(self._pair_gaps <= int(tolerance) * 1000000)
+        costs = self._pair_gaps[within] / window + self._pair_distances[within] / self.max_distance
+        order = within[np.lexsort((self._pair_candidates[within], self._pair_gaps[within], costs,
+                                   self._pair_merged_rows[within]))]
+        merged_rows, first = np.unique(self._pair_merged_rows[order], return_index=True)
+        best = order[first]
+
+        num_rows = len(self._gt_positions)
+        matched = np.zeros(num_rows, dtype=bool)
+        matched[merged_rows] = True
+        candidates = np.full(num_rows, -1, dtype=np.int64)
+        candidates[merged_rows] = self._pair_candidates[best]
+        time_differences = np.full(num_rows, np.nan)
+        time_differences[merged_rows] = self._pair_gaps[best] / 1e9
+        distances = np.full(num_rows, np.nan)
+        distances[merged_rows] = self._pair_distances[best]
+        return matched, candidates, time_differences, distances
+
+    def matched(self, tolerance):
+        """
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: boolean array flagging the merged rows with a match within the tolerance and the max_distance
+        """
+        return self.select(tolerance)[0]
@@ -0,0 +1,363 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.instrumentation import stage
+from src.gt_merger.interval_join import GT_ALWAYS_REPEATED_COLS, to_epoch_ns
+from src.gt_merger.merging import prepare_merged_data
+from src.gt_merger.metrics import add_differences
+from src.gt_merger.partition import PartitionIndex
+from src.gt_merger.results import conform_to_schema
+from src.gt_merger.schema import with_numpy_dtypes
+
+# Tables with the keys of the preprocessed data. The position of every trip and activity is its row on the data sorted
+# by collector/user and then by start time, and the datetimes are nanoseconds since epoch (NULL if they are missing)
+CREATE_TABLES_SQL = """
+CREATE TABLE collectors (collector INTEGER PRIMARY KEY);
+CREATE TABLE oba_users (user INTEGER PRIMARY KEY);
+CREATE TABLE gt_trips (position INTEGER PRIMARY KEY, collector INTEGER NOT NULL, orig INTEGER, dest INTEGER);
+CREATE TABLE oba_activities (position INTEGER PRIMARY KEY, user INTEGER NOT NULL, start INTEGER);
+"""
+CREATE_INDEXES_SQL = """
+CREATE INDEX gt_trips_collector ON gt_trips (collector, position);
+CREATE INDEX oba_activities_user ON oba_activities (user, start, position);
+CREATE INDEX oba_activities_start ON oba_activities (start);
+"""
+
+# Range join of every trip of a collector with the activities of every oba user starting during the trip, with one row
+# without activity (-1) for the trips without matches. The rows are sorted like the ones merged to many by pandas
+RANGE_JOIN_SQL = """
+FROM collectors c CROSS JOIN oba_users u CROSS JOIN gt_trips g
+LEFT JOIN oba_activities o ON o.user = u.user AND o.start BETWEEN g.orig AND g.dest
+WHERE g.collector = c.collector
+"""
+MERGED_ROWS_SQL = "SELECT g.position, u.user, coalesce(o.position, -1)" + RANGE_JOIN_SQL + \
+                  "ORDER BY c.collector, u.user, g.position, o.start, o.position"
+NUM_MATCHES_SQL = "SELECT g.position, u.user, count(o.position)" + RANGE_JOIN_SQL + \
+                  "GROUP BY c.collector, u.user, g.position ORDER BY c.collector, u.user, g.position"
+# Number of trips of every collector and oba user (rows of the number of matches), number of merged rows and minimum and
+# maximum number of matches of a trip, aggregated in the database
+MATCHES_SUMMARY_SQL = "SELECT count(*), coalesce(sum(max(n, 1)), 0), coalesce(min(n), 1), coalesce(max(n), 0) " \
+                      "FROM (SELECT count(o.position) AS n" + RANGE_JOIN_SQL + \
+                      "GROUP BY c.collector, u.user, g.position)"
+
+# Anti join of the activities of every oba user with the trips of every collector
+MATCHED_ACTIVITIES_SQL = """
+CREATE TEMP TABLE matched_activities AS
+SELECT DISTINCT g.collector, o.position FROM gt_trips g JOIN oba_activities o ON o.start BETWEEN g.orig AND g.dest;
+CREATE UNIQUE INDEX temp.matched_activities_position ON matched_activities (collector, position);
+"""
+UNMATCHED_ROWS_SQL = """
+SELECT c.collector, o.position FROM collectors c CROSS JOIN oba_activities o
+WHERE NOT EXISTS (SELECT 1 FROM matched_activities m WHERE m.collector = c.collector AND m.position = o.position)
+ORDER BY c.collector, o.position
+"""
+NUM_UNMATCHED_ROWS_SQL = "SELECT count(*) FROM (" + UNMATCHED_ROWS_SQL + ")"
+
+
+def to_sql_values(epoch_ns, valid):
+    """
+    :param epoch_ns: int64 array with nanoseconds since epoch
+    :param valid: boolean array that is False where the datetime is missing
+    :return: list with the int values, None where the datetime is missing
+    """
+    values = epoch_ns.astype(object)
+    values[~valid] = None
+    return values.tolist()
+
+
+class SqlMergeBackend:
+    """
+    Merge the data to many on a file backed SQLite database, so the merged data does not have to fit in memory. The
+    keys of the preprocessed trips and activities are loaded into tables, the range join of the trips and the activities
+    and the anti join of the activities without a match are run as SQL, and the merged rows are read from the database
+    in chunks, like the number of matches and the unmatched activities. Every chunk is built from the preprocessed data
+    like in merge_to_many, so the data written from the chunks is the same as the data merged to many by pandas.
+
+        with SqlMergeBackend(gt_data, oba_data, 'merge.sqlite') as backend:
+            writer.write_chunks(backend.merged_chunks(), folder, name)
+    """
+
+    def __init__(self, gt_data, oba_data, database_path, repeat_gt_rows=False):
+        """
+        :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+        :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+        :param database_path: path to the SQLite database file, it must not exist
+        :param repeat_gt_rows: boolean value to indicate if the GT data must be repeated on every row of a bunch of
+        matches
+        """
+        self.repeat_gt_rows = repeat_gt_rows
+        # Data sorted by collector/user and then by start time, the categorical and boolean columns are cast like in
+        # merge_to_many
+        self._gt_data = PartitionIndex(with_numpy_dtypes(gt_data), 'GT_Collector', 'GT_DateTimeOrigUTC') \
+            .data.reset_index(drop=True)
+        self._oba_data = PartitionIndex(with_numpy_dtypes(oba_data), 'User ID', 'Activity Start Date and Time* (UTC)') \
+            .data.reset_index(drop=True)
+        # The keys are numbered in order of appearance on the input data, as the rows are sorted by them
+        self._gt_collectors, self._collectors = pd.factorize(self._gt_data['GT_Collector'])
+        self._oba_users, self._users = pd.factorize(self._oba_data['User ID'])
+        self._matches_summary = None
+        self._num_unmatched_rows = None
+
+        self.connection = sqlite3.connect(database_path)
+        with stage('load_sql', gt_rows=len(self._gt_data), oba_rows=len(self._oba_data)):
+            self._load_tables()
+
+    def _load_tables(self):
+        orig, valid_orig = to_epoch_ns(self._gt_data['GT_DateTimeOrigUTC'])
+        dest, valid_dest = to_epoch_ns(self._gt_data['GT_DateTimeDestUTC'])
+        # The trips without start or end never match
+        valid_windows = valid_orig & valid_dest
+        start, valid_start = to_epoch_ns(self._oba_data['Activity Start Date and Time* (UTC)'])
+        gt_rows = np.flatnonzero(self._gt_collectors >= 0)
+        oba_rows = np.flatnonzero(self._oba_users >= 0)
+
+        self.connection.executescript(CREATE_TABLES_SQL)
+        self.connection.executemany("INSERT INTO collectors VALUES (?)",
+                                    ((collector,) for collector in range(len(self._collectors))))
+        self.connection.executemany("INSERT INTO oba_users VALUES (?)", ((user,) for user in range(len(self._users))))
+        self.connection.executemany("INSERT INTO gt_trips VALUES (?, ?, ?, ?)",
+                                    zip(gt_rows.tolist(), self._gt_collectors[gt_rows].tolist(),
+                                        to_sql_values(orig[gt_rows], valid_windows[gt_rows]),
+                                        to_sql_values(dest[gt_rows], valid_windows[gt_rows])))
+        self.connection.executemany("INSERT INTO oba_activities VALUES (?, ?, ?)",
+                                    zip(oba_rows.tolist(), self._oba_users[oba_rows].tolist(),
+                                        to_sql_values(start[oba_rows], valid_start[oba_rows])))
+        self.connection.executescript(CREATE_INDEXES_SQL)
+        self.connection.commit()
+
+    def close(self):
+        """ Close the database """
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _summary(self):
+        """
+        :return: tuple with the number of rows of the number of matches, the number of merged rows and the minimum and
+        maximum number of activities matched by a trip of a collector and oba user
+        """
+        if self._matches_summary is None:
+            with stage('sql_num_matches'):
+                self._matches_summary = self.connection.execute(MATCHES_SUMMARY_SQL).fetchone()
+        return self._matches_summary
+
+    @property
+    def num_merged_rows(self):
+        """
+        :return: number of rows of the merged data
+        """
+        return self._summary()[1]
+
+    @property
+    def num_matches_rows(self):
+        """
+        :return: number of rows of the number of matches, one for every trip of a collector and oba user
+        """
+        return self._summary()[0]
+
+    def _merged_dtypes(self):
+        """
+        :return: dict with the dtype of every column of the merged chunks, the dtype of the column on the data merged
+        to many (see ColumnarResultBuilder) so every chunk has the same dtypes
+        """
+        _, _, min_matches, max_matches = self._summary()
+        any_repeated = max_matches > 1 and not self.repeat_gt_rows
+        any_missing = min_matches == 0
+        dtypes = {}
+        for data, masked in ((self._gt_data, any_repeated), (self._oba_data, any_missing)):
+            for col, dtype in data.dtypes.items():
+                if not isinstance(dtype, (np.dtype, pd.DatetimeTZDtype)):
+                    dtypes[col] = np.dtype(object)
+                elif masked and dtype.kind in 'iu' and data is self._oba_data:
+                    dtypes[col] = np.dtype('float64')
+                elif masked and dtype.kind in 'iub' and col not in GT_ALWAYS_REPEATED_COLS:
+                    dtypes[col] = np.dtype(object)
+                else:
+                    dtypes[col] = dtype
+        return dtypes
+
+    def _merged_chunk(self, gt_positions, users, oba_positions, repeated, dtypes):
+        """
+        Build the merged rows of a chunk like merge_user_to_many.
+        :param gt_positions: int64 array with the position of the trip of every row
+        :param users: int64 array with the number of the oba user of every row
+        :param oba_positions: int64 array with the position of the activity of every row, -1 if none
+        :param repeated: boolean array flagging the rows that are not the first row of a bunch of matches
+        :param dtypes: dict returned by _merged_dtypes
+        :return: dataframe with the merged data, with the columns in GT_NEW_COLUMNS_ORDER + OBA_NEW_COLUMNS_ORDER
+        """
+        gt_block = self._gt_data.take(gt_positions).reset_index(drop=True)
+        gt_block = gt_block.astype({col: dtypes[col] for col in gt_block.columns})
+        gt_block['GT_DateTimeOrigUTC_Backup'] = gt_block['GT_DateTimeOrigUTC']
+        # Remove (Fill with NaN) repeated GT rows unless required no to
+        if not self.repeat_gt_rows and repeated.any():
+            for col in gt_block.columns.difference(GT_ALWAYS_REPEATED_COLS):
+                gt_block[col] = gt_block[col].mask(repeated)
+
+        oba_block = self._oba_data.reindex(oba_positions).reset_index(drop=True)
+        oba_block = oba_block.astype({col: dtypes[col] for col in oba_block.columns})
+        merged_df = pd.concat([gt_block, oba_block], axis=1)
+        merged_df['User ID'] = self._users.to_numpy()[users] if len(self._users) else np.empty(0, dtype=object)
+        merged_df = conform_to_schema(merged_df, constants.GT_NEW_COLUMNS_ORDER + constants.OBA_NEW_COLUMNS_ORDER)
+        return prepare_merged_data(add_differences(merged_df))
+
+    def merged_chunks(self, chunk_size=constants.SQL_CHUNK_SIZE):
+        """
+        Read the merged data from the database in chunks.
+        :param chunk_size: maximum number of rows of every chunk
+        :return: iterator of dataframes with the merged data, with the columns in GT_NEW_COLUMNS_ORDER +
+        OBA_NEW_COLUMNS_ORDER, at least one (empty if there is no merged data)
+        """
+        dtypes = self._merged_dtypes()
+        cursor = self.connection.execute(MERGED_ROWS_SQL)
+        # Trip and oba user of the last row of the previous chunk, the bunch of matches can go on in the next chunk
+        previous = (-1, -1)
+        rows = cursor.fetchmany(chunk_size)
+        first_chunk = True
+        while rows or first_chunk:
+            gt_positions, users, oba_positions = (np.array(values, dtype=np.int64) for values in zip(*rows)) \
+                if rows else (np.empty(0, dtype=np.int64),) * 3
+            repeated = np.r_[gt_positions[:1] == previous[0], gt_positions[1:] == gt_positions[:-1]] & \
+                np.r_[users[:1] == previous[1], users[1:] == users[:-1]]
+            if rows:
+                previous = (gt_positions[-1], users[-1])
+            yield self._merged_chunk(gt_positions, users, oba_positions, repeated, dtypes)
+            rows = cursor.fetchmany(chunk_size)
+            first_chunk = False
+
+    def merged_sample(self):
+        """
+        :return: dataframe with the columns and dtypes of the merged chunks and with every value of the preprocessed
+        data, e.g. to find a schema valid for every chunk, or None if there is no merged data
+        """
+        if not len(self._collectors) or not len(self._users):
+            return None
+        num_rows = max(len(self._gt_data), len(self._oba_data))
+        rows = np.arange(num_rows)
+        return self._merged_chunk(rows % len(self._gt_data), np.zeros(num_rows, dtype=np.int64),
+                                  np.where(rows < len(self._oba_data), rows, -1), np.zeros(num_rows, dtype=bool),
+                                  self._merged_dtypes())
+
+    def _num_matches_chunk(self, gt_positions, users, counts):
+        """
+        :param gt_positions: int64 array with the position of the trip of every row
+        :param users: int64 array with the number of the oba user of every row
+        :param counts: int64 array with the number of activities matched on every row
+        :return: dataframe with the number of matches by GT trip and oba_user(phone), like merge_to_many
+        """
+        matches_df = self._gt_data.take(gt_positions).reset_index(drop=True)
+        matches_df['User ID'] = np.array([user[-4:] for user in self._users], dtype=object)[users]
+        matches_df['GT_NumberOfTransitions'] = counts
+        return matches_df
+
+    def num_matches_chunks(self, chunk_size=constants.SQL_CHUNK_SIZE):
+        """
+        Read the number of matches by GT trip and oba_user(phone) from the database in chunks.
+        :param chunk_size: maximum number of rows of every chunk
+        :return: iterator of dataframes with the number of matches, like merge_to_many, at least one
+        """
+        if not len(self._collectors) or not len(self._users):
+            yield pd.DataFrame()
+            return
+        cursor = self.connection.execute(NUM_MATCHES_SQL)
+        rows = cursor.fetchmany(chunk_size)
+        first_chunk = True
+        while rows or first_chunk:
+            gt_positions, users, counts = (np.array(values, dtype=np.int64) for values in zip(*rows)) \
+                if rows else (np.empty(0, dtype=np.int64),) * 3
+            yield self._num_matches_chunk(gt_positions, users, counts)
+            rows = cursor.fetchmany(chunk_size)
+            first_chunk = False
+
+    def num_matches_sample(self):
+        """
+        :return: dataframe with the columns and dtypes of the chunks of the number of matches and with every value of
+        the preprocessed data, see merged_sample, or None if there are no matches
+        """
+        if not len(self._collectors) or not len(self._users):
+            return None
+        rows = np.arange(len(self._gt_data))
+        return self._num_matches_chunk(rows, rows % len(self._users), np.zeros(len(rows), dtype=np.int64))
+
+    @property
+    def num_unmatched_rows(self):
+        """
+        :return: number of oba activities without a match on the GT data of every collector. The activities matched by
+        the trips of every collector are saved to a temporary table, which is used to read the unmatched activities
+        """
+        if self._num_unmatched_rows is None:
+            if not len(self._collectors) or not len(self._users):
+                self._num_unmatched_rows = 0
+            else:
+                with stage('sql_unmatched') as record:
+                    self.connection.executescript(MATCHED_ACTIVITIES_SQL)
+                    self._num_unmatched_rows = record['rows'] = \
+                        self.connection.execute(NUM_UNMATCHED_ROWS_SQL).fetchone()[0]
+        return self._num_unmatched_rows
+
+    def _unmatched_chunk(self, collectors, oba_positions):
+        """
+        :param collectors: int64 array with the number of the collector of every row
+        :param oba_positions: int64 array with the position of the activity of every row
+        :return: dataframe with the oba activities without a match, like merge_to_many
+        """
+        unmatched_trips_df = self._oba_data.take(oba_positions)[constants.OBA_UNMATCHED_NEW_COLUMNS_ORDER] \
+            .reset_index(drop=True)
+        unmatched_trips_df['User ID'] = np.array([user[-4:] for user in self._users],
+                                                 dtype=object)[self._oba_users[oba_positions]]
+        unmatched_trips_df.insert(loc=0, column='GT_Collector', value=self._collectors.to_numpy()[collectors])
+        return unmatched_trips_df
+
+    def unmatched_chunks(self, chunk_size=constants.SQL_CHUNK_SIZE):
+        """
+        Read the oba activities without a match on the GT data of every collector from the database in chunks.
+        :param chunk_size: maximum number of rows of every chunk
+        :return: iterator of dataframes with the unmatched activities, like merge_to_many, at least one
+        """
+        if not len(self._collectors) or not len(self._users):
+            yield pd.DataFrame()
+            return
+        # The rows are counted on the table of matched activities, which is used to read them
+        if not self.num_unmatched_rows:
+            yield self._unmatched_chunk(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+            return
+        cursor = self.connection.execute(UNMATCHED_ROWS_SQL)
+        rows = cursor.fetchmany(chunk_size)
+        while rows:
+            collectors, oba_positions = (np.array(values, dtype=np.int64) for values in zip(*rows))
+            yield self._unmatched_chunk(collectors, oba_positions)
+            rows = cursor.fetchmany(chunk_size)
+
+    def unmatched_sample(self):
+        """
+        :return: dataframe with the columns and dtypes of the chunks of unmatched activities and with every value of the
+        preprocessed data, see merged_sample, or None if there are no unmatched activities
+        """
+        if not len(self._collectors) or not len(self._users):
+            return None
+        rows = np.arange(len(self._oba_data))
+        return self._unmatched_chunk(rows % len(self._collectors), rows)
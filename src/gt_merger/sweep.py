@@ -0,0 +1,255 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import logging
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.instrumentation import stage
+from src.gt_merger.interval_join import to_epoch_ns
+from src.gt_merger.metrics import haversine_distance, to_float_array
+from src.gt_merger.partition import PartitionIndex
+from src.gt_merger.results import conform_to_schema
+from src.gt_merger.schema import same_categories
+
+# Gap assigned to GT trips without a forward candidate
+NO_CANDIDATE_GAP = np.iinfo(np.int64).max
+
+logger = logging.getLogger(__name__)
+
+
+def forward_candidates(window_starts, window_keys, points, point_keys):
+    """
+    Find for every window start the first point with the same key whose value is equal or greater than the window start,
+    like pd.merge_asof(direction="forward") without tolerance.
+    :param window_starts: int64 array with the start of every window
+    :param window_keys: int array with the key of every window, negative keys never match
+    :param points: int64 array sorted in ascending order for every key
+    :param point_keys: int array with the key of every point, negative keys never match
+    :return: tuple with the position of the candidate point of each window (-1 if none) and the gap between the window
+    start and the candidate point (NO_CANDIDATE_GAP if none)
+    """
+    candidates = np.full(len(window_starts), -1, dtype=np.int64)
+    gaps = np.full(len(window_starts), NO_CANDIDATE_GAP, dtype=np.int64)
+    for key in np.unique(window_keys[window_keys >= 0]):
+        window_positions = np.flatnonzero(window_keys == key)
+        point_positions = np.flatnonzero(point_keys == key)
+        found = np.searchsorted(points[point_positions], window_starts[window_positions], side='left')
+        has_candidate = found < len(point_positions)
+        window_positions = window_positions[has_candidate]
+        candidates[window_positions] = point_positions[found[has_candidate]]
+        gaps[window_positions] = points[candidates[window_positions]] - window_starts[window_positions]
+    return candidates, gaps
+
+
+def match_keys(gt_data, oba_data):
+    """
+    :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+    :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+    :return: tuple with the int64 arrays of the GT trip starts, of the GT modes, of the activity starts and of the
+    activity modes. The modes of both frames share their integer codes, and the mode is -1 where the mode or the start
+    is missing, so those rows never match.
+    """
+    # The codes of the categoricals are used if both columns have the same categories
+    if same_categories(gt_data['GT_Mode'], oba_data['Google Activity']):
+        gt_modes = gt_data['GT_Mode'].cat.codes.to_numpy()
+        oba_modes = oba_data['Google Activity'].cat.codes.to_numpy()
+    else:
+        mode_codes, _ = pd.factorize(pd.concat([gt_data['GT_Mode'].astype(object),
+                                                oba_data['Google Activity'].astype(object)], ignore_index=True))
+        gt_modes = mode_codes[:len(gt_data)]
+        oba_modes = mode_codes[len(gt_data):]
+
+    gt_orig, gt_valid = to_epoch_ns(gt_data['GT_DateTimeOrigUTC'])
+    oba_start, oba_valid = to_epoch_ns(oba_data['Activity Start Date and Time* (UTC)'])
+    return gt_orig, np.where(gt_valid, gt_modes, -1), oba_start, np.where(oba_valid, oba_modes, -1)
+
+
+def user_mode_keys(merged_users, merged_modes, user_rows, oba_modes):
+    """
+    :param merged_users: int64 array with the position of the oba user of every merged row
+    :param merged_modes: int array with the mode of the GT trip of every merged row, -1 if it never matches
+    :param user_rows: list with the positions of the activities of every oba user
+    :param oba_modes: int array with the mode of every activity, -1 if it never matches
+    :return: tuple with the int64 arrays of the keys (oba user, mode) of the merged rows and of the activities, the
+    rows and activities that never match have the key -1
+    """
+    num_modes = int(max(merged_modes.max(initial=0), oba_modes.max(initial=0))) + 1
+    oba_users = np.full(len(oba_modes), -1, dtype=np.int64)
+    for position, user in enumerate(user_rows):
+        oba_users[user] = position
+    merged_keys = np.where(merged_modes >= 0, merged_users * num_modes + merged_modes, -1)
+    oba_keys = np.where((oba_modes >= 0) & (oba_users >= 0), oba_users * num_modes + oba_modes, -1)
+    return merged_keys, oba_keys
+
+
+class ToleranceSweep:
+    """
+    Compute once, for every GT trip and oba user, the first activity with the same mode starting at or after the GT trip
+    start and its forward time gap. The one to one merge for any tolerance is then obtained by thresholding the gaps,
+    so iterating over many tolerances costs roughly the same as a single merge.
+    """
+
+    def __init__(self, gt_data, oba_data):
+        """
+        :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+        :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+        """
+        self.list_collectors = gt_data['GT_Collector'].unique()
+        self.list_oba_users = oba_data['User ID'].unique()
+        self._gt_data = gt_data.reset_index(drop=True)
+        self._oba_data = oba_data.reset_index(drop=True)
+
+        # Trips of every collector sorted by 'GT_DateTimeOrigUTC' and activities of every oba user sorted by
+        # 'Activity Start Date and Time* (UTC)'
+        gt_index = PartitionIndex(gt_data, 'GT_Collector', 'GT_DateTimeOrigUTC')
+        oba_index = PartitionIndex(oba_data, 'User ID', 'Activity Start Date and Time* (UTC)')
+
+        # Positions of the activities of every oba user in list_oba_users
+        self._user_rows = [oba_index.rows(oba_user) for oba_user in self.list_oba_users]
+        # List of (collector, number of trips, list of (oba_user, first merged row, last merged row + 1)), and the
+        # positions of the GT trips and of the oba user activities of every collector/oba user pair
+        self._pairs = []
+        pair_rows = []
+        start = 0
+        for collector in self.list_collectors:
+            rows = gt_index.rows(collector)
+            user_ranges = []
+            for oba_user, user in zip(self.list_oba_users, self._user_rows):
+                pair_rows.append((rows, user))
+                user_ranges.append((oba_user, start, start + len(rows)))
+                start += len(rows)
+            self._pairs.append((collector, len(rows), user_ranges))
+
+        self._gt_positions = np.concatenate([rows for rows, _ in pair_rows]) if pair_rows \
+            else np.empty(0, dtype=np.int64)
+        self._gt_block = None
+        self._find_candidates(gt_data, oba_data, pair_rows)
+
+    def _find_candidates(self, gt_data, oba_data, pair_rows):
+        """
+        Find the forward candidate of every merged row, and its time and distance differences.
+        :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+        :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+        :param pair_rows: list with the positions of the GT trips and of the oba user activities of every pair
+        """
+        gt_orig, gt_modes, oba_start, oba_modes = match_keys(gt_data, oba_data)
+        candidates = []
+        gaps = []
+        for rows, user in pair_rows:
+            pair_candidates, pair_gaps = forward_candidates(gt_orig[rows], gt_modes[rows], oba_start[user],
+                                                            oba_modes[user])
+            candidates.append(np.where(pair_candidates >= 0, user[pair_candidates], -1))
+            gaps.append(pair_gaps)
+        self._candidates = np.concatenate(candidates) if candidates else np.empty(0, dtype=np.int64)
+        self._gaps = np.concatenate(gaps) if gaps else np.empty(0, dtype=np.int64)
+
+        # Time and distance differences between GT and OBA starting points of every candidate
+        with stage('metrics', rows=len(self._candidates)):
+            has_candidate = self._candidates >= 0
+            self._time_differences = np.where(has_candidate, self._gaps / 1e9, np.nan)
+            candidate_rows = np.where(has_candidate, self._candidates, 0)
+            oba_lat = to_float_array(oba_data['Origin latitude (*best)'])[candidate_rows]
+            oba_lon = to_float_array(oba_data['Origin longitude (*best)'])[candidate_rows]
+            self._distances = haversine_distance(to_float_array(gt_data['GT_LatOrig'])[self._gt_positions],
+                                                 to_float_array(gt_data['GT_LonOrig'])[self._gt_positions],
+                                                 np.where(has_candidate, oba_lat, np.nan),
+                                                 np.where(has_candidate, oba_lon, np.nan))
+
+    def _merged_users(self):
+        """
+        :return: int64 array with the position on list_oba_users of the oba user of every merged row
+        """
+        users = np.empty(len(self._gt_positions), dtype=np.int64)
+        for _, _, user_ranges in self._pairs:
+            for position, (_, start, end) in enumerate(user_ranges):
+                users[start:end] = position
+        return users
+
+    def _get_gt_block(self):
+        """ GT trips repeated once per oba user, shared by all the tolerances """
+        if self._gt_block is None:
+            self._gt_block = self._gt_data.take(self._gt_positions).reset_index(drop=True)
+            self._gt_block['GT_DateTimeOrigUTC_Backup'] = self._gt_block['GT_DateTimeOrigUTC']
+        return self._gt_block
+
+    def matched(self, tolerance):
+        """
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: boolean array flagging the merged rows with a match within the tolerance
+        """
+        return self._gaps <= int(tolerance) * 1000000
+
+    def select(self, tolerance):
+        """
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: tuple with the boolean array flagging the merged rows with a match within the tolerance, and the
+        position on oba_data, time difference (seconds) and distance (meters) of the candidate of every merged row
+        """
+        return self.matched(tolerance), self._candidates, self._time_differences, self._distances
+
+    def matched_pairs(self, tolerance):
+        """
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: tuple of int64 arrays with the position on gt_data and on oba_data of every merged pair
+        """
+        matched, candidates, _, _ = self.select(tolerance)
+        return self._gt_positions[matched], candidates[matched]
+
+    def merge(self, tolerance):
+        """
+        Merge the data for one tolerance, the result is the same as merging every collector/oba user pair with
+        pd.merge_asof(direction="forward", left_by='GT_Mode', right_by='Google Activity').
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: dataframe with the merged data and a dataframe with summary of matches by collector/oba_user(phone).
+        """
+        matched, candidates, time_differences, distances = self.select(tolerance)
+        oba_positions = np.where(matched, candidates, -1)
+        oba_block = self._oba_data.reindex(oba_positions).reset_index(drop=True)
+        merged_df = pd.concat([self._get_gt_block(), oba_block], axis=1)
+        merged_df['Time_Difference'] = np.where(matched, time_differences, np.nan)
+        merged_df['Distance_Difference'] = np.where(matched, distances, np.nan)
+        merged_df = conform_to_schema(merged_df, constants.GT_NEW_COLUMNS_ORDER + constants.OBA_NEW_COLUMNS_ORDER)
+
+        matches_df = pd.DataFrame(self.list_collectors, columns=['GT_Collector'])
+        list_total_trips = []
+        list_matches = []
+        matches_dict = defaultdict(list)
+        for collector, num_trips, user_ranges in self._pairs:
+            logger.info("Merging data for collector %s", collector)
+            list_total_trips.append(num_trips)
+            list_matches_by_phone = []
+            for oba_user, start, end in user_ranges:
+                num_matches = int(matched[start:end].sum())
+                # Print number of matches
+                logger.debug("\t Oba user %s \tMatches: %s out of %s", oba_user[-4:], num_matches, num_trips)
+                list_matches_by_phone.append(num_matches)
+                matches_dict[oba_user[-4:]].append(num_matches)
+            list_matches.append(list_matches_by_phone)
+        matches_df['total_trips'] = list_total_trips
+        numbers_df = pd.DataFrame.from_dict(matches_dict)
+        matches_df = pd.concat([matches_df, numbers_df], axis=1)
+        logger.debug("matches\n%s", matches_df.head())
+        logger.debug("List of matches %s", list_matches)
+        return merged_df, matches_df
@@ -0,0 +1,173 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import io
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.preprocess import preprocess_gt_data, preprocess_oba_data
+from src.gt_merger.readers import GT_INPUT_COLUMNS, OBA_INPUT_COLUMNS, read_oba_data
+from src.gt_merger.schema import apply_gt_schema
+
+# Modes of the synthetic trips and activities
+MODES = np.array(['WALKING', 'IN_VEHICLE', 'ON_BICYCLE', 'STILL'], dtype=object)
+
+
+def _expand(counts):
+    """ Positions of the groups repeated by counts and the rank of every row within its group """
+    groups = np.repeat(np.arange(len(counts)), counts)
+    ranks = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return groups, ranks
+
+
+def _format_datetimes(epoch_ns):
+    return pd.to_datetime(epoch_ns, utc=True).strftime(constants.OBA_DATETIME_FORMAT)
+
+
+def make_dataset(collectors=3, devices=6, days=3, trips_per_day=8, seed=0, time_zone='America/New_York',
+                 noise=0.3):
+    """
+    Generate synthetic ground truth and OBA data with the same columns as the input data files. Every collector makes
+    trips_per_day consecutive trips every day of the campaign, and every device (assigned to one collector) records
+    one activity per trip, or from zero to three activities with probability noise.
+    :param collectors: number of collectors
+    :param devices: number of devices
+    :param days: length (days) of the data collection campaign
+    :param trips_per_day: number of trips made by every collector every day
+    :param seed: seed of the random number generator, the same parameters and seed generate the same data
+    :param time_zone: time zone of the ground truth trips
+    :param noise: probability of recording a number of activities other than one for a trip
+    :return: tuple with the ground truth dataframe (like the one loaded from the xlsx file) and the OBA dataframe (like
+    the one loaded from the csv file)
+    """
+    rng = np.random.default_rng(seed)
+    collector_names = np.array(['Collector%03d' % c for c in range(collectors)], dtype=object)
+    device_names = np.array(['obaUser_%04d' % d for d in range(devices)], dtype=object)
+
+    # Ground truth trips, consecutive for every collector and day
+    shape = (collectors, days, trips_per_day)
+    durations = rng.integers(180, 1800, size=shape)
+    waits = rng.integers(0, 900, size=shape)
+    first_start = 8 * 3600 + rng.integers(0, 3600, size=shape[:2] + (1,))
+    starts = first_start + np.cumsum(durations + waits, axis=2) - durations - waits
+    trip_days = np.broadcast_to(np.arange(days)[None, :, None], shape).ravel()
+    dates = pd.Timestamp('2021-03-04') + pd.to_timedelta(trip_days, unit='D')
+    local_starts = dates + pd.to_timedelta(starts.ravel(), unit='s')
+    local_ends = local_starts + pd.to_timedelta(durations.ravel(), unit='s')
+    num_trips = len(local_starts)
+    trip_collectors = np.repeat(np.arange(collectors), days * trips_per_day)
+    trip_modes = rng.integers(0, len(MODES), size=num_trips)
+    lat = 27.9 + rng.random(num_trips)
+    lon = -82.5 + rng.random(num_trips)
+
+    gt_data = pd.DataFrame({
+        'GT_Collector': collector_names[trip_collectors],
+        'GT_Date': dates,
+        'GT_TimeOrig': local_starts.time,
+        'GT_TimeOrigMinuteRounded': rng.integers(0, 2, size=num_trips),
+        'GT_TimeZone': time_zone,
+        'GT_LatOrig': lat,
+        'GT_LonOrig': lon,
+        'GT_LocationOrig': 'Origin',
+        'GT_TimeDest': local_ends.time,
+        'GT_TimeDestMinuteRounded': 0,
+        'GT_LatDest': lat + 0.01,
+        'GT_LonDest': lon + 0.01,
+        'GT_LocDest': 'Destination',
+        'GT_Comments': np.nan,
+        'GT_TourID': trip_days + 1,
+        'GT_TripID': np.broadcast_to(np.arange(1, trips_per_day + 1), shape).ravel(),
+        'GT_Mode': MODES[trip_modes],
+    }, columns=GT_INPUT_COLUMNS)
+
+    # Activities recorded by the devices of the collector of every trip
+    utc_starts = local_starts.tz_localize(time_zone, ambiguous=np.zeros(num_trips, dtype=bool),
+                                          nonexistent='shift_forward').asi8
+    device_collectors = np.arange(devices) % max(collectors, 1)
+    pair_trips = []
+    pair_devices = []
+    for collector in range(collectors):
+        collector_trips = np.flatnonzero(trip_collectors == collector)
+        collector_devices = np.flatnonzero(device_collectors == collector)
+        pair_trips.append(np.repeat(collector_trips, len(collector_devices)))
+        pair_devices.append(np.tile(collector_devices, len(collector_trips)))
+    pair_trips = np.concatenate(pair_trips) if pair_trips else np.empty(0, dtype=np.int64)
+    pair_devices = np.concatenate(pair_devices) if pair_devices else np.empty(0, dtype=np.int64)
+    counts = np.where(rng.random(len(pair_trips)) < noise, rng.integers(0, 4, size=len(pair_trips)), 1)
+    pairs, ranks = _expand(counts)
+    trips = pair_trips[pairs]
+    num_activities = len(trips)
+
+    activity_starts = (utc_starts[trips] + (rng.integers(-120, 600, size=num_activities) + ranks * 200) * 10 ** 9)
+    activity_durations = rng.integers(1, 30, size=num_activities).astype(np.float64)
+    activity_ends = activity_starts + (activity_durations * 60 * 10 ** 9).astype(np.int64)
+    other_modes = rng.integers(0, len(MODES), size=num_activities)
+    activity_modes = np.where(rng.random(num_activities) < 0.8, trip_modes[trips], other_modes)
+
+    oba_data = pd.DataFrame(np.nan, index=np.arange(num_activities), columns=OBA_INPUT_COLUMNS)
+    oba_data['User ID'] = device_names[pair_devices[pairs]]
+    oba_data['Trip ID'] = np.arange(num_activities)
+    oba_data['Device Trip ID'] = ranks
+    oba_data['Google Activity'] = MODES[activity_modes]
+    oba_data['Google Activity Confidence'] = rng.random(num_activities)
+    oba_data['Activity Start Date and Time* (UTC)'] = _format_datetimes(activity_starts)
+    oba_data['Origin location Date and Time (*best) (UTC)'] = _format_datetimes(activity_starts + 5 * 10 ** 9)
+    oba_data['Origin latitude (*best)'] = lat[trips] + rng.normal(0, 0.001, size=num_activities)
+    oba_data['Origin longitude (*best)'] = lon[trips] + rng.normal(0, 0.001, size=num_activities)
+    oba_data['Origin Location Provider (*best)'] = 'gps'
+    oba_data['Activity Destination Date and Time* (UTC)'] = _format_datetimes(activity_ends)
+    oba_data['Destination Location Date and Time (*best) (UTC)'] = _format_datetimes(activity_ends + 5 * 10 ** 9)
+    oba_data['Duration* (minutes)'] = activity_durations
+    oba_data['Origin-Destination Bird-Eye Distance* (meters)'] = \
+        rng.integers(0, 3000, size=num_activities).astype(np.float64)
+    oba_data['Power Save Mode Enabled'] = rng.random(num_activities) < 0.5
+    # Firebase exports are not sorted by device or time
+    oba_data = oba_data.take(rng.permutation(num_activities)).reset_index(drop=True)
+
+    return gt_data, oba_data
+
+
+def read_dataset(remove_still_mode=True, **params):
+    """
+    Generate a synthetic campaign and load it like the input data files: the OBA data is written to csv and read back
+    with read_oba_data, and the ground truth data is cast with apply_gt_schema.
+    :param remove_still_mode: boolean value to indicate if records with STILL mode must be removed from the OBA data
+    :param params: parameters of make_dataset
+    :return: tuple with the ground truth dataframe and the OBA dataframe
+    """
+    gt_data, oba_data = make_dataset(**params)
+    csv_buffer = io.StringIO()
+    oba_data.to_csv(csv_buffer, index=False)
+    csv_buffer.seek(0)
+    return apply_gt_schema(gt_data), read_oba_data(csv_buffer, [], remove_still_mode)
+
+
+def preprocessed_dataset(min_activity_duration=5, min_trip_length=50, remove_still_mode=True, **params):
+    """
+    Generate a synthetic campaign, load it like the input data files (see read_dataset) and preprocess it.
+    :param min_activity_duration: numeric value representing minimum valid activity duration in seconds
+    :param min_trip_length: numeric value representing minimum valid trip distance in meters
+    :param remove_still_mode: boolean value to indicate if records with STILL mode must be removed
+    :param params: parameters of make_dataset
+    :return: tuple with the preprocessed ground truth dataframe and the preprocessed OBA dataframe
+    """
+    gt_data, oba_data = read_dataset(remove_still_mode, **params)
+    clean_gt_data, _ = preprocess_gt_data(gt_data, remove_still_mode)
+    clean_oba_data, _ = preprocess_oba_data(oba_data, min_activity_duration, min_trip_length, remove_still_mode)
+    return clean_gt_data, clean_oba_data
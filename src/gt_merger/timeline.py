@@ -0,0 +1,197 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.instrumentation import stage
+from src.gt_merger.interval_join import expand_windows
+from src.gt_merger.metrics import haversine_distance, to_float_array
+from src.gt_merger.partition import PartitionIndex
+from src.gt_merger.results import conform_to_schema
+from src.gt_merger.sweep import match_keys
+
+logger = logging.getLogger(__name__)
+
+
+def timeline_candidates(window_starts, window_keys, points, point_keys, point_groups, window):
+    """
+    Find for every window start and every group of points the first point with the same key whose value is equal or
+    greater than the window start and not greater than the window start plus the window. The points of all the groups
+    are sorted once on a single timeline, so the windows are searched with one searchsorted for all the groups.
+    :param window_starts: int64 array with the start of every window
+    :param window_keys: int array with the key of every window, negative keys never match
+    :param points: int64 array with the value of every point
+    :param point_keys: int array with the key of every point, negative keys never match
+    :param point_groups: int64 array with the group of every point (e.g. its device), negative groups never match
+    :param window: length of the windows, in the units of the points
+    :return: tuple of int64 arrays with the position of the window and the position of the point of every candidate
+    pair, sorted by window and by group
+    """
+    valid_points = np.flatnonzero((point_keys >= 0) & (point_groups >= 0))
+    if not len(valid_points) or not len(window_starts):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # The values are replaced by their rank among the values and the window bounds, so the points are sorted by a single
+    # int64 value (key, rank) with the points of every group interleaved
+    values, ranks = np.unique(np.concatenate([points[valid_points], window_starts, window_starts + window]),
+                              return_inverse=True)
+    num_ranks = len(values)
+    timeline = point_keys[valid_points].astype(np.int64) * num_ranks + ranks[:len(valid_points)]
+    order = np.argsort(timeline, kind='stable')
+    timeline = timeline[order]
+    valid_points = valid_points[order]
+    start_ranks = ranks[len(valid_points):len(valid_points) + len(window_starts)]
+    end_ranks = ranks[len(valid_points) + len(window_starts):]
+
+    window_keys = window_keys.astype(np.int64)
+    lo = np.searchsorted(timeline, window_keys * num_ranks + start_ranks, side='left')
+    hi = np.searchsorted(timeline, window_keys * num_ranks + end_ranks, side='right')
+    hi = np.where(window_keys >= 0, np.maximum(hi, lo), lo)
+    window_positions, timeline_positions, _ = expand_windows(lo, hi)
+    found = timeline_positions >= 0
+    window_positions = window_positions[found]
+    point_positions = valid_points[timeline_positions[found]]
+
+    # The points of a window are sorted by value, so the first pair of every window and group is its candidate
+    pair_keys = window_positions * (int(point_groups.max()) + 1) + point_groups[point_positions]
+    _, first = np.unique(pair_keys, return_index=True)
+    return window_positions[first], point_positions[first]
+
+
+class TimelineSweep:
+    """
+    Match every GT trip with the first activity of the same mode starting within the tolerance after the GT trip start
+    on every oba user (device), like ToleranceSweep, but searching the activities of all the devices at once on a
+    single timeline instead of pairing every collector with every device. Only the matched (GT trip, device, activity)
+    pairs are kept, so the memory used and the merged data grow with the matches instead of the number of GT trips
+    times the number of devices.
+    The merged data is in long format: a row for every matched pair and a row without activity for every GT trip
+    without a match. The number of matches of every collector and device is derived from the pairs, with the same
+    columns as the one returned by ToleranceSweep.
+    The pairs are found once for the largest tolerance, the merge for any lower tolerance only selects the pairs within
+    it.
+    """
+
+    def __init__(self, gt_data, oba_data, max_tolerance):
+        """
+        :param gt_data: dataframe with preprocessed data from ground truth XLSX data file
+        :param oba_data: dataframe with preprocessed data from OBA firebase export CSV data file
+        :param max_tolerance: largest tolerance (milliseconds) to be merged, the pairs are found again if the data is
+        merged with a greater tolerance
+        """
+        self.list_collectors = gt_data['GT_Collector'].unique()
+        self.list_oba_users = oba_data['User ID'].unique()
+        self.max_tolerance = max_tolerance
+        self._gt_data = gt_data.reset_index(drop=True)
+        self._oba_data = oba_data.reset_index(drop=True)
+
+        # Position on list_collectors of the collector of every GT trip and on list_oba_users of the oba user of every
+        # activity, -1 if it is missing
+        self._collectors = pd.Index(self.list_collectors).get_indexer(self._gt_data['GT_Collector'])
+        self._users = pd.Index(self.list_oba_users).get_indexer(self._oba_data['User ID'])
+        # Rank of every GT trip sorted by collector and start time
+        gt_index = PartitionIndex(self._gt_data, 'GT_Collector', 'GT_DateTimeOrigUTC')
+        self._gt_order = np.empty(len(self._gt_data), dtype=np.int64)
+        self._gt_order[gt_index.positions] = np.arange(len(self._gt_data))
+        self._oba_dtypes = self._oba_data.reindex([-1]).dtypes
+        self._find_pairs()
+
+    def _find_pairs(self):
+        """
+        Find every matched pair within the max_tolerance, and its time and distance differences.
+        """
+        gt_orig, gt_modes, oba_start, oba_modes = match_keys(self._gt_data, self._oba_data)
+        gt_modes = np.where(self._collectors >= 0, gt_modes, -1)
+        with stage('timeline_sweep', trips=len(gt_orig), activities=len(oba_start)) as record:
+            self._pair_trips, self._pair_activities = timeline_candidates(
+                gt_orig, gt_modes, oba_start, oba_modes, self._users, int(self.max_tolerance) * 1000000)
+            record['pairs'] = len(self._pair_trips)
+        self._pair_gaps = oba_start[self._pair_activities] - gt_orig[self._pair_trips]
+
+        with stage('metrics', rows=len(self._pair_trips)):
+            self._pair_distances = haversine_distance(
+                to_float_array(self._gt_data['GT_LatOrig'])[self._pair_trips],
+                to_float_array(self._gt_data['GT_LonOrig'])[self._pair_trips],
+                to_float_array(self._oba_data['Origin latitude (*best)'])[self._pair_activities],
+                to_float_array(self._oba_data['Origin longitude (*best)'])[self._pair_activities])
+
+    def select(self, tolerance):
+        """
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: int64 array with the positions of the matched pairs within the tolerance
+        """
+        if tolerance > self.max_tolerance:
+            self.max_tolerance = tolerance
+            self._find_pairs()
+        return np.flatnonzero(self._pair_gaps <= int(tolerance) * 1000000)
+
+    def matched_pairs(self, tolerance):
+        """
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: tuple of int64 arrays with the position on gt_data and on oba_data of every merged pair
+        """
+        pairs = self.select(tolerance)
+        return self._pair_trips[pairs], self._pair_activities[pairs]
+
+    def merge(self, tolerance):
+        """
+        Merge the data for one tolerance in long format.
+        :param tolerance: maximum allowed difference (milliseconds) between 'gt_data.GT_DateTimeOrigUTC' and
+        'oba_data.Activity Start Date and Time* (UTC)'.
+        :return: dataframe with the merged data and a dataframe with summary of matches by collector/oba_user(phone).
+        """
+        pairs = self.select(tolerance)
+        trips = self._pair_trips[pairs]
+        activities = self._pair_activities[pairs]
+
+        # A row for every pair and for every GT trip of a collector without a match, sorted by collector, GT trip start
+        # and oba user, so the matches of a GT trip on every device are together
+        has_collector = self._collectors >= 0
+        unmatched = np.flatnonzero(has_collector & (np.bincount(trips, minlength=len(self._gt_data)) == 0))
+        gt_positions = np.concatenate([trips, unmatched])
+        oba_positions = np.concatenate([activities, np.full(len(unmatched), -1, dtype=np.int64)])
+        users = np.where(oba_positions >= 0, self._users[oba_positions], -1)
+        order = np.lexsort((users, self._gt_order[gt_positions]))
+        gt_positions = gt_positions[order]
+        oba_positions = oba_positions[order]
+        rows = np.concatenate([pairs, np.full(len(unmatched), -1, dtype=np.int64)])[order]
+
+        gt_block = self._gt_data.take(gt_positions).reset_index(drop=True)
+        gt_block['GT_DateTimeOrigUTC_Backup'] = gt_block['GT_DateTimeOrigUTC']
+        # The OBA columns have the types of a block with missing activities, so they are the same for every tolerance
+        oba_block = self._oba_data.reindex(oba_positions).astype(self._oba_dtypes).reset_index(drop=True)
+        merged_df = pd.concat([gt_block, oba_block], axis=1)
+        merged_df['Time_Difference'] = np.where(rows >= 0, self._pair_gaps[rows] / 1e9, np.nan)
+        merged_df['Distance_Difference'] = np.where(rows >= 0, self._pair_distances[rows], np.nan)
+        merged_df = conform_to_schema(merged_df, constants.GT_NEW_COLUMNS_ORDER + constants.OBA_NEW_COLUMNS_ORDER)
+
+        # Number of matches of every collector and oba user, pivoted to a column for every oba user
+        num_collectors = len(self.list_collectors)
+        num_users = len(self.list_oba_users)
+        counts = np.bincount(self._collectors[trips] * num_users + self._users[activities],
+                             minlength=num_collectors * num_users).reshape(num_collectors, num_users)
+        matches_df = pd.DataFrame(self.list_collectors, columns=['GT_Collector'])
+        matches_df['total_trips'] = np.bincount(self._collectors[has_collector], minlength=num_collectors)
+        numbers_df = pd.DataFrame(counts, columns=[str(oba_user)[-4:] for oba_user in self.list_oba_users])
+        matches_df = pd.concat([matches_df, numbers_df], axis=1)
+        logger.debug("matches\n%s", matches_df.head())
+        return merged_df, matches_df
@@ -0,0 +1,334 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import importlib.util
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from src.gt_merger import constants
+
+# Extension of the output files of every format, and of the csv files compressed with every compression
+FORMAT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+CSV_COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'zip': '.zip', 'xz': '.xz', 'zstd': '.zst'}
+
+# Name of the partition column of the datasets with the data of every tolerance
+TOLERANCE_PARTITION_COL = 'tolerance'
+
+
+def is_output_format_available(output_format):
+    """
+    :param output_format: 'csv', 'parquet' or 'feather'
+    :return: True if the libraries required to write the format are installed (pyarrow for parquet and feather)
+    """
+    return output_format == 'csv' or importlib.util.find_spec('pyarrow') is not None
+
+
+def to_arrow_table(data):
+    """
+    Convert a dataframe to an arrow table keeping the datetime (and timezone) types. Object columns with values of
+    mixed types (e.g. numbers and text in a comments column) can not be converted, so they are saved as text.
+    :param data: dataframe
+    :return: pyarrow Table without the index of the dataframe
+    """
+    import pyarrow as pa
+    try:
+        return pa.Table.from_pandas(data, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        data = data.copy()
+        for col in data.columns[(data.dtypes == object).to_numpy()]:
+            try:
+                pa.array(data[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                data[col] = data[col].map(str).where(data[col].notna())
+        return pa.Table.from_pandas(data, preserve_index=False)
+
+
+class OutputWriter:
+    """
+    Write the output dataframes (merged data, number of matches, unmatched activities and dropped rows) as csv, parquet
+    or feather files. Parquet and feather files are smaller and faster to write and read than csv files, and they keep
+    the types of the columns, e.g. the datetimes with their timezone.
+    """
+
+    def __init__(self, output_format=constants.OUTPUT_FORMAT, compression=None):
+        """
+        :param output_format: 'csv', 'parquet' or 'feather'
+        :param compression: compression codec, e.g. 'gzip' for csv, 'snappy' or 'zstd' for parquet and 'lz4' or 'zstd'
+        for feather, None to use the default of the format (no compression for csv, snappy for parquet and lz4 for
+        feather)
+        """
+        if output_format not in FORMAT_EXTENSIONS:
+            raise ValueError("Unknown output format: " + str(output_format))
+        self.output_format = output_format
+        self.compression = compression
+
+    @property
+    def extension(self):
+        """
+        :return: extension of the output files, e.g. '.csv.gz' for csv files compressed with gzip
+        """
+        extension = FORMAT_EXTENSIONS[self.output_format]
+        if self.output_format == 'csv' and self.compression:
+            extension += CSV_COMPRESSION_EXTENSIONS.get(self.compression, '')
+        return extension
+
+    def path(self, folder, name):
+        """
+        :param folder: path to the output folder
+        :param name: name of the output file without extension
+        :return: path to the output file
+        """
+        return os.path.join(folder, name + self.extension)
+
+    def write(self, data, folder, name, on_written=None):
+        """
+        Save a dataframe to an output file.
+        :param data: dataframe to be saved
+        :param folder: path to the output folder
+        :param name: name of the output file without extension
+        :param on_written: function called with the path to the output file once it is written, e.g. to record its size
+        :return: path to the output file
+        """
+        file_path = self.path(folder, name)
+        if self.output_format == 'csv':
+            data.to_csv(path_or_buf=file_path, index=False, compression=self.compression)
+        elif self.output_format == 'parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(to_arrow_table(data), file_path, compression=self.compression or 'snappy')
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(to_arrow_table(data), file_path, compression=self.compression)
+        if on_written is not None:
+            on_written(file_path)
+        return file_path
+
+    def write_chunks(self, chunks, folder, name, sample=None, on_written=None):
+        """
+        Save the dataframes of an iterable to an output file one after the other, so only one of them is in memory.
+        :param chunks: iterable of dataframes with the same columns and dtypes, at least one
+        :param folder: path to the output folder
+        :param name: name of the output file without extension
+        :param sample: dataframe with the columns and dtypes of the chunks and with values of every type found in them,
+        the types of the columns of parquet and feather files are taken from it (from the first chunk if it is None)
+        :param on_written: function called with the path to the output file once it is written
+        :return: path to the output file
+        """
+        file_path = self.path(folder, name)
+        chunks = iter(chunks)
+        if self.output_format == 'csv':
+            from pandas.io.common import get_handle
+            with get_handle(file_path, 'w', compression=self.compression) as handles:
+                for i, chunk in enumerate(chunks):
+                    chunk.to_csv(path_or_buf=handles.handle, index=False, header=i == 0)
+        else:
+            self._write_table_chunks(chunks, file_path, sample)
+        if on_written is not None:
+            on_written(file_path)
+        return file_path
+
+    def _write_table_chunks(self, chunks, file_path, sample):
+        """
+        Save the dataframes of an iterator to a parquet or feather file, see write_chunks.
+        """
+        import pyarrow as pa
+        first_chunk = next(chunks)
+        schema = to_arrow_table(first_chunk if sample is None else sample).schema
+        if self.output_format == 'parquet':
+            import pyarrow.parquet as pq
+            file_writer = pq.ParquetWriter(file_path, schema, compression=self.compression or 'snappy')
+        else:
+            compression = 'lz4' if self.compression is None else self.compression
+            file_writer = pa.ipc.new_file(file_path, schema, options=pa.ipc.IpcWriteOptions(
+                compression=None if compression == 'uncompressed' else compression))
+        with file_writer:
+            for chunk in itertools.chain([first_chunk], chunks):
+                file_writer.write_table(to_arrow_table(chunk).cast(schema))
+
+    def tolerance_location(self, folder, name, tolerance, partitioned=False):
+        """
+        :param folder: path to the output folder
+        :param name: name of the dataset
+        :param tolerance: tolerance of the data
+        :param partitioned: True to save the data as a partition of a dataset
+        :return: tuple with the folder (created if it is a partition) and the name of the output file of the data of one
+        tolerance, see write_tolerance
+        """
+        if not partitioned or self.output_format == 'csv':
+            return folder, name + "_" + str(tolerance)
+        partition_folder = os.path.join(folder, name, TOLERANCE_PARTITION_COL + '=' + str(tolerance))
+        os.makedirs(partition_folder, exist_ok=True)
+        return partition_folder, 'part-0'
+
+    def write_tolerance(self, data, folder, name, tolerance, partitioned=False, on_written=None):
+        """
+        Save the dataframe of one tolerance. Parquet and feather data can be saved as a partition of a dataset with the
+        data of every tolerance, <folder>/<name>/tolerance=<tolerance>/part-0.<format>, which can be loaded at once
+        (e.g. with pd.read_parquet(<folder>/<name>)) with the tolerance as a column. Otherwise, or with the csv format,
+        the data is saved to <folder>/<name>_<tolerance>.<format>.
+        :param data: dataframe to be saved
+        :param folder: path to the output folder
+        :param name: name of the dataset
+        :param tolerance: tolerance of the data
+        :param partitioned: True to save the data as a partition of a dataset
+        :param on_written: function called with the path to the output file once it is written
+        :return: path to the output file
+        """
+        return self.write(data, *self.tolerance_location(folder, name, tolerance, partitioned), on_written=on_written)
+
+    def flush(self):
+        """
+        Wait for the pending writes, a no-op as the files are written at once (see AsyncOutputWriter).
+        """
+
+
+class AsyncOutputWriter:
+    """
+    Write-behind OutputWriter: the dataframes are written by a pool of threads while the caller goes on with the next
+    merge, so the disk I/O overlaps with the computation. The writer takes ownership of the dataframes, they must not be
+    modified once they are given to write or write_tolerance. At most max_pending files are queued or being written,
+    further writes wait for one of them to finish, which bounds the memory held by the dataframes waiting to be written.
+    An error of a write is raised by the next write or by flush, and closing the writer flushes the pending writes, or
+    cancels them if the writer is closed by an error (see __exit__).
+    """
+
+    def __init__(self, writer, threads=constants.WRITER_THREADS, max_pending=constants.MAX_PENDING_WRITES):
+        """
+        :param writer: OutputWriter writing the files
+        :param threads: number of threads writing the files
+        :param max_pending: maximum number of files queued or being written, at least the number of threads
+        """
+        if threads < 1:
+            raise ValueError("The number of writer threads must be at least 1.")
+        self.writer = writer
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='output-writer')
+        self._slots = threading.BoundedSemaphore(max(max_pending, threads))
+        self._futures = []
+
+    def __getattr__(self, name):
+        # The format, the extension and the paths of the files are the ones of the wrapped OutputWriter
+        if name == 'writer':
+            raise AttributeError(name)
+        return getattr(self.writer, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Flush the pending writes, or if the context is left by an error, cancel the queued writes and wait for the ones
+        being written so no file is left half written, without hiding the error.
+        """
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, function, *args, on_written=None):
+        """
+        Run function(*args) on a writer thread, waiting for a free slot if max_pending files are pending.
+        :return: Future with the path to the output file
+        """
+        self._raise_error()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._run, function, args, on_written)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._futures.append(future)
+        return future
+
+    def _run(self, function, args, on_written):
+        try:
+            file_path = function(*args)
+            if on_written is not None:
+                on_written(file_path)
+            return file_path
+        finally:
+            self._slots.release()
+
+    def _raise_error(self):
+        """
+        Forget the finished writes, raising the error of the first one that failed.
+        """
+        failed = [future for future in self._futures
+                  if future.done() and not future.cancelled() and future.exception() is not None]
+        self._futures = [future for future in self._futures if not future.done()]
+        if failed:
+            raise failed[0].exception()
+
+    def write(self, data, folder, name, on_written=None):
+        """
+        Queue a dataframe to be saved to an output file, see OutputWriter.write.
+        :return: Future with the path to the output file
+        """
+        return self._submit(self.writer.write, data, folder, name, on_written=on_written)
+
+    def write_tolerance(self, data, folder, name, tolerance, partitioned=False, on_written=None):
+        """
+        Queue the dataframe of one tolerance to be saved, see OutputWriter.write_tolerance.
+        :return: Future with the path to the output file
+        """
+        location = self.writer.tolerance_location(folder, name, tolerance, partitioned)
+        return self._submit(self.writer.write, data, *location, on_written=on_written)
+
+    def write_chunks(self, chunks, folder, name, sample=None, on_written=None):
+        """
+        Save the dataframes of an iterable to an output file, see OutputWriter.write_chunks. The chunks are usually
+        produced lazily by objects bound to the calling thread (e.g. a database cursor), so they are written by the
+        calling thread while the queued writes go on.
+        :return: path to the output file
+        """
+        self._raise_error()
+        return self.writer.write_chunks(chunks, folder, name, sample, on_written)
+
+    def flush(self):
+        """
+        Wait for the pending writes, raising the error of the first one that failed.
+        """
+        wait(self._futures)
+        self._raise_error()
+
+    def close(self):
+        """
+        Flush the pending writes and stop the writer threads.
+        """
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def read_output(path):
+    """
+    Load an output file or a dataset with the data of every tolerance saved by OutputWriter.
+    :param path: path to the output file, or to the folder of the dataset
+    :return: dataframe, with a 'tolerance' column if a dataset was loaded
+    """
+    import pandas as pd
+    if os.path.isdir(path):
+        import pyarrow.dataset as ds
+        file_format = 'feather' if any(file_name.endswith('.feather') for _, _, file_names in os.walk(path)
+                                       for file_name in file_names) else 'parquet'
+        return ds.dataset(path, format=file_format, partitioning='hive').to_table().to_pandas()
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.feather'):
+        return pd.read_feather(path)
+    return pd.read_csv(path)
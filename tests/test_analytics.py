@@ -0,0 +1,86 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger.analytics import ToleranceAnalytics, tolerance_statistics
+from src.gt_merger.merging import merge_to_many
+from src.gt_merger.synthetic import preprocessed_dataset
+
+
+class ToleranceAnalyticsTest(unittest.TestCase):
+    """
+    Tolerance analytics test class.
+    """
+
+    def setUp(self):
+        """ Build merged data with three GT trips, one of them matched with two activities without repeating it. """
+        gt_start = pd.Timestamp('2021-03-04 13:00', tz='UTC')
+        self.merged_df = pd.DataFrame({
+            'GT_Collector': ['C1', np.nan, 'C1', 'C2'],
+            'GT_TourID': [1, 1, 1, 1],
+            'GT_TripID': [1, 1, 2, 1],
+            'GT_Mode': ['WALKING', np.nan, 'IN_VEHICLE', 'ON_BICYCLE'],
+            'GT_DateTimeOrigUTC': [gt_start, gt_start, gt_start, gt_start],
+            'Google Activity': ['WALKING', 'IN_VEHICLE', np.nan, 'ON_BICYCLE'],
+            'Activity Start Date and Time* (UTC)': [gt_start + pd.Timedelta(seconds=seconds) if seconds else pd.NaT
+                                                    for seconds in [10, 30, None, 20]],
+            'User ID': ['u1', 'u1', np.nan, 'u2'],
+            'Trip ID': [10, 11, np.nan, 10],
+            'Time_Difference': [10.0, np.nan, np.nan, 20.0],
+            'Distance_Difference': [100.0, np.nan, np.nan, 300.0]})
+
+        self.clean_gt_df, self.clean_oba_df = preprocessed_dataset(collectors=3, devices=6, days=3, trips_per_day=10,
+                                                                   seed=2)
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_tolerance_statistics(self):
+        """ Test the summary and the mode confusion of the merged data """
+        summary, confusion = tolerance_statistics(self.merged_df, 60000)
+        self.assertEqual({'tolerance': 60000, 'merged_rows': 4, 'matched_rows': 3, 'gt_trips': 3, 'matched_trips': 2,
+                          'trip_match_rate': 2 / 3, 'matched_activities': 3, 'median_time_difference': 20.0,
+                          'median_distance_difference': 200.0, 'mode_accuracy': 2 / 3}, summary)
+        self.assertEqual([1, 1, 1], confusion['count'].tolist())
+        self.assertEqual(['ON_BICYCLE', 'IN_VEHICLE', 'WALKING'], confusion['Google Activity'].tolist())
+
+    def test_merged_to_many_with_and_without_repeated_rows(self):
+        """ Test that the statistics of the data merged to many do not depend on repeating the GT rows """
+        summaries = [tolerance_statistics(merge_to_many(self.clean_gt_df, self.clean_oba_df, 60000,
+                                                        repeat_gt_rows=repeat_gt_rows)[0], 60000)
+                     for repeat_gt_rows in [False, True]]
+        self.assertEqual(summaries[1][0], summaries[0][0])
+        pd.testing.assert_frame_equal(summaries[1][1], summaries[0][1])
+        self.assertEqual(len(self.clean_gt_df), summaries[0][0]['gt_trips'])
+
+    def test_summary_sorted_by_tolerance(self):
+        """ Test that the statistics added in any order are sorted by tolerance """
+        analytics = ToleranceAnalytics()
+        for tolerance in [90000, 30000]:
+            analytics.add(tolerance_statistics(self.merged_df.head(tolerance // 30000), tolerance))
+        self.assertEqual([30000, 90000], analytics.summary()['tolerance'].tolist())
+        self.assertEqual([1, 3], analytics.summary()['merged_rows'].tolist())
+        self.assertEqual([30000, 90000, 90000], analytics.confusion()['tolerance'].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import unittest
+
+import numpy as np
+
+from src.gt_merger.assignment import AssignmentSweep, assign_windows
+from src.gt_merger.sweep import ToleranceSweep
+from src.gt_merger.synthetic import preprocessed_dataset
+
+
+class AssignmentSweepTest(unittest.TestCase):
+    """
+    Optimal one to one assignment test class.
+    """
+
+    def setUp(self):
+        """ Preprocess a synthetic campaign. """
+        self.clean_gt_df, self.clean_oba_df = preprocessed_dataset(collectors=3, devices=6, days=3, trips_per_day=10,
+                                                                   seed=2)
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_assign_windows(self):
+        """ Test that the latest windows and the earliest points are matched """
+        # The first point is only in the first window and the second point in both, but the first window is left
+        # unmatched for a lower total gap
+        self.assertEqual([-1, 0], assign_windows(np.array([0, 5]), np.array([10]), 10).tolist())
+        self.assertEqual([0, 1], assign_windows(np.array([0, 5]), np.array([6, 10]), 10).tolist())
+        self.assertEqual([1, 0, -1], assign_windows(np.array([5, 0, 30]), np.array([3, 7, 8]), 10).tolist())
+
+    def test_activities_assigned_once(self):
+        """ Test that every activity is merged once at most, and with more trips than the activities claimed """
+        sweep = AssignmentSweep(self.clean_gt_df, self.clean_oba_df)
+        forward_sweep = ToleranceSweep(self.clean_gt_df, self.clean_oba_df)
+        for tolerance in [300000, 3600000]:
+            merged_df, matches_df = sweep.merge(tolerance)
+            matched = merged_df.dropna(subset=['Trip ID'])
+            self.assertFalse(matched.duplicated(['User ID', 'Trip ID']).any())
+            self.assertTrue(matched['Time_Difference'].between(0, tolerance / 1000).all())
+            self.assertTrue((matched['GT_Mode'].astype(object) == matched['Google Activity'].astype(object)).all())
+            self.assertEqual(len(matched), matches_df.drop(columns=['GT_Collector', 'total_trips']).to_numpy().sum())
+
+            forward_merged_df, _ = forward_sweep.merge(tolerance)
+            forward_matched = forward_merged_df.dropna(subset=['Trip ID'])
+            self.assertGreater(len(forward_matched), len(matched))
+            self.assertGreaterEqual(len(matched), len(forward_matched.drop_duplicates(['User ID', 'Trip ID'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from src.gt_merger import constants
+from src.gt_merger.batch import STATUS_FAILED, STATUS_FINISHED, STATUS_SKIPPED, job_arguments, run_batch
+from src.gt_merger.synthetic import make_dataset
+
+
+class BatchTest(unittest.TestCase):
+    """
+    Batch runner test class.
+    """
+
+    def setUp(self):
+        """ Create a temporary folder with a manifest of jobs merging the test data. """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        gt_data, oba_data = make_dataset(collectors=2, devices=3, days=2, trips_per_day=6, seed=4)
+        gt_data.to_csv(os.path.join(self.temp_dir.name, 'gt.csv'), index=False)
+        oba_data.to_csv(os.path.join(self.temp_dir.name, 'oba.csv'), index=False)
+        # The paths of the input files are relative to the folder of the manifest
+        self.manifest_path = os.path.join(self.temp_dir.name, 'manifest.json')
+        with open(self.manifest_path, 'w') as f:
+            json.dump({'defaults': {'gtFile': 'gt.csv', 'noCache': True},
+                       'jobs': [{'name': 'to_many', 'obaFile': 'oba.csv'},
+                                {'name': 'one_to_one', 'obaFile': 'oba.csv', 'mergeOneToOne': True,
+                                 'tolerance': 600000},
+                                {'name': 'missing_file', 'obaFile': 'missing.csv'}]}, f)
+        self.output_dir = os.path.join(self.temp_dir.name, 'output')
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        """ Remove the temporary folder. """
+        logging.disable(logging.NOTSET)
+        self.temp_dir.cleanup()
+
+    def test_job_arguments(self):
+        """ Test that the options of a job are converted to command line arguments """
+        self.assertEqual(['--tolerance', '60000', '--mergeOneToOne', '--no-removeStillMode'],
+                         job_arguments({'tolerance': 60000, 'mergeOneToOne': True, 'removeStillMode': False,
+                                        'repeatGtRows': False, 'maxOriginDistance': None}))
+        with self.assertRaises(ValueError):
+            job_arguments({'tolerence': 60000})
+
+    def test_resume_finished_jobs(self):
+        """ Test that the jobs are run and summarized, and that the finished jobs are skipped by the next run """
+        summary = run_batch(self.manifest_path, self.output_dir)
+        self.assertEqual([STATUS_FINISHED, STATUS_FINISHED, STATUS_FAILED], [row['status'] for row in summary])
+        self.assertTrue(os.path.isdir(os.path.join(self.output_dir, 'to_many', constants.FOLDER_MERGED_DATA)))
+        self.assertTrue(os.path.isfile(os.path.join(self.output_dir, constants.FOLDER_LOGS, 'missing_file.log')))
+        self.assertTrue(os.path.isfile(os.path.join(self.output_dir, constants.BATCH_SUMMARY_FILE_NAME)))
+        for row in summary[:2]:
+            self.assertGreater(row['matched_trips'], 0)
+            self.assertLessEqual(row['trip_match_rate'], 1)
+
+        summary = run_batch(self.manifest_path, self.output_dir)
+        self.assertEqual([STATUS_SKIPPED, STATUS_SKIPPED, STATUS_FAILED], [row['status'] for row in summary])
+        summary = run_batch(self.manifest_path, self.output_dir, resume=False)
+        self.assertEqual([STATUS_FINISHED, STATUS_FINISHED, STATUS_FAILED], [row['status'] for row in summary])
+
+
+if __name__ == '__main__':
+    unittest.main()
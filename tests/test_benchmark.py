@@ -0,0 +1,72 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import subprocess
+import sys
+import unittest
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.benchmark import ROOT_DIR, run_benchmark
+from src.gt_merger.readers import OBA_INPUT_COLUMNS
+from src.gt_merger.synthetic import make_dataset, GT_INPUT_COLUMNS
+
+
+class BenchmarkTest(unittest.TestCase):
+    """
+    Synthetic data generator and benchmark test class.
+    """
+
+    def setUp(self):
+        """ Generate the synthetic data used to perform tests. """
+        self.gt_df, self.oba_df = make_dataset(collectors=2, devices=4, days=2, trips_per_day=5, seed=1)
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_schema(self):
+        """ Test that the synthetic data has the columns of the input data files """
+        self.assertEqual(GT_INPUT_COLUMNS, self.gt_df.columns.tolist())
+        self.assertEqual(OBA_INPUT_COLUMNS, self.oba_df.columns.tolist())
+        self.assertEqual(2 * 2 * 5, len(self.gt_df))
+        self.assertTrue(set(constants.OBA_RELEVANT_COLS_LIST).issubset(self.oba_df.columns))
+
+    def test_same_seed_same_data(self):
+        """ Test that the synthetic data generated with the same seed is the same """
+        gt_df, oba_df = make_dataset(collectors=2, devices=4, days=2, trips_per_day=5, seed=1)
+        pd.testing.assert_frame_equal(self.gt_df, gt_df)
+        pd.testing.assert_frame_equal(self.oba_df, oba_df)
+
+    def test_run_benchmark(self):
+        """ Test that every stage of a quick benchmark is timed """
+        results = run_benchmark(collectors=2, devices=4, days=2, trips_per_day=5, seed=1, trace_memory=False,
+                                quick=True)
+        self.assertEqual(['generate', 'read_gt_csv', 'read_gt_parquet', 'read_oba_csv', 'preprocess_gt',
+                          'preprocess_oba', 'merge'], list(results['stages']))
+        self.assertTrue(all(stage['seconds'] >= 0 for stage in results['stages'].values()))
+        self.assertEqual(len(self.oba_df), results['rows']['oba'] + (self.oba_df['Google Activity'] == 'STILL').sum())
+
+    def test_startup_does_not_import_pandas(self):
+        """ Test that the command line checks its arguments before importing the data libraries """
+        command = "import sys; from src.gt_merger import matchAndMerge; print('pandas' in sys.modules)"
+        output = subprocess.run([sys.executable, '-c', command], cwd=ROOT_DIR, capture_output=True, text=True)
+        self.assertEqual('False', output.stdout.strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import tempfile
+import unittest
+import pandas as pd
+
+from src.gt_merger import preprocess
+from src.gt_merger.cache import PreprocessCache, is_cache_available
+from src.gt_merger.readers import read_oba_data
+
+
+@unittest.skipUnless(is_cache_available(), "pyarrow is not installed")
+class PreprocessCacheTest(unittest.TestCase):
+    """
+    Cache of preprocessed data test class.
+    """
+
+    def setUp(self):
+        """ Create an empty cache and preprocess the data used to perform tests. """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = PreprocessCache(self.temp_dir.name)
+        self.oba_file_path = os.path.join(os.path.dirname(__file__), 'data_test/travel-behavior-test.csv')
+        oba_df = read_oba_data(self.oba_file_path, [], True)
+        self.clean_oba_df, self.oba_dropped_df = preprocess.preprocess_oba_data(oba_df, 5, 50, True)
+        self.key = self.cache.get_key(self.oba_file_path, minActivityDuration=5, minTripLength=50)
+
+    def tearDown(self):
+        """ Remove the cache folder. """
+        self.temp_dir.cleanup()
+
+    def test_load_stored_data(self):
+        """ Test that the cached data is equal to the preprocessed data """
+        self.assertIsNone(self.cache.load(self.key))
+        self.assertTrue(self.cache.store(self.key, self.clean_oba_df, self.oba_dropped_df))
+        clean_oba_df, oba_dropped_df = self.cache.load(self.key)
+        pd.testing.assert_frame_equal(self.clean_oba_df, clean_oba_df)
+        pd.testing.assert_frame_equal(self.oba_dropped_df, oba_dropped_df)
+
+    def test_load_categorical_dtypes(self):
+        """ Test that the categorical columns without values or with numeric categories keep their dtypes """
+        clean_oba_df = self.clean_oba_df.assign(**{'Destination Location Provider (*best)': pd.Categorical(
+            [None] * len(self.clean_oba_df), categories=[])})
+        self.assertTrue(self.cache.store(self.key, clean_oba_df, self.oba_dropped_df))
+        loaded_df, _ = self.cache.load(self.key)
+        for col in ['Region ID', 'Vehicle type', 'Destination Location Provider (*best)']:
+            self.assertEqual(clean_oba_df[col].dtype, loaded_df[col].dtype)
+
+    def test_key_depends_on_parameters(self):
+        """ Test that changing a preprocess parameter changes the key """
+        self.assertEqual(self.key, self.cache.get_key(self.oba_file_path, minTripLength=50, minActivityDuration=5))
+        self.assertNotEqual(self.key, self.cache.get_key(self.oba_file_path, minActivityDuration=5, minTripLength=60))
+
+    def test_evict_least_recently_used(self):
+        """ Test that the oldest entries are removed when the cache is full """
+        self.cache.store('old', self.clean_oba_df, self.oba_dropped_df)
+        os.utime(os.path.join(self.temp_dir.name, 'old'), (0, 0))
+        self.cache.store('new', self.clean_oba_df, self.oba_dropped_df)
+        entry_size = sum(os.path.getsize(os.path.join(self.temp_dir.name, 'new', f))
+                         for f in os.listdir(os.path.join(self.temp_dir.name, 'new')))
+        self.cache.max_size = entry_size
+        self.cache.evict()
+        self.assertIsNone(self.cache.load('old'))
+        self.assertIsNotNone(self.cache.load('new'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from src.gt_merger import constants
+from src.gt_merger.incremental import IncrementalState
+from src.gt_merger.merging import merge_to_many, prepare_merged_data
+from src.gt_merger.preprocess import preprocess_gt_data, preprocess_oba_data
+from src.gt_merger.synthetic import read_dataset
+
+
+def preprocess_gt(data):
+    return preprocess_gt_data(data, True)
+
+
+def preprocess_oba(data):
+    return preprocess_oba_data(data, constants.MIN_ACTIVITY_DURATION, constants.MIN_TRIP_LENGTH, True)
+
+
+class IncrementalStateTest(unittest.TestCase):
+    """
+    Incremental merge test class.
+    """
+
+    def setUp(self):
+        """ Create a synthetic campaign of four days and a folder for the state. """
+        self.gt_data, self.oba_data = read_dataset(collectors=2, devices=4, days=4, trips_per_day=5, seed=3)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.state_dir = os.path.join(self.temp_dir.name, constants.FOLDER_STATE)
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        self.temp_dir.cleanup()
+
+    def run_incremental(self, gt_data, oba_data):
+        state = IncrementalState(self.state_dir, repeatGtRows=False)
+        state.load()
+        state.update_gt(gt_data.copy(), preprocess_gt)
+        state.update_oba(oba_data.copy(), preprocess_oba)
+        results = state.merge_to_many(False)
+        state.save()
+        return state, results
+
+    def assert_same_results(self, results):
+        gt_data, _ = preprocess_gt(self.gt_data.copy())
+        oba_data, _ = preprocess_oba(self.oba_data.copy())
+        merged_data, num_matches, unmatched = merge_to_many(gt_data, oba_data, constants.TOLERANCE)
+        self.assertEqual(prepare_merged_data(merged_data).to_csv(index=False),
+                         prepare_merged_data(results[0]).to_csv(index=False))
+        self.assertEqual(num_matches.to_csv(index=False), results[1].to_csv(index=False))
+        self.assertEqual(unmatched.to_csv(index=False), results[2].to_csv(index=False))
+
+    def test_new_days_are_merged(self):
+        """ Test that merging the first days and then the whole campaign is the same as merging the whole campaign """
+        first_days = self.gt_data['GT_Date'] < '2021-03-06'
+        first_activities = self.oba_data['Activity Start Date and Time* (UTC)'] < '2021-03-06'
+        self.run_incremental(self.gt_data[first_days], self.oba_data[first_activities])
+
+        state, results = self.run_incremental(self.gt_data, self.oba_data)
+        self.assert_same_results(results)
+        self.assertEqual(len(self.gt_data), len(state.gt.rows))
+
+    def test_changed_rows_are_merged(self):
+        """ Test that changed activities replace the saved ones """
+        self.run_incremental(self.gt_data, self.oba_data)
+
+        self.oba_data.loc[self.oba_data.index[:10], 'Activity Start Date and Time* (UTC)'] += pd.Timedelta('20min')
+        _, results = self.run_incremental(self.gt_data, self.oba_data)
+        self.assert_same_results(results)
+
+    def test_damaged_state_is_merged_again(self):
+        """ Test that a state that can not be read is discarded and all the data is merged again """
+        self.run_incremental(self.gt_data, self.oba_data)
+        with open(os.path.join(self.state_dir, 'merged.parquet'), 'w') as f:
+            f.write('damaged')
+        self.assertFalse(IncrementalState(self.state_dir, repeatGtRows=False).load())
+        state, results = self.run_incremental(self.gt_data, self.oba_data)
+        self.assert_same_results(results)
+        self.assertEqual(len(self.gt_data), len(state.gt.rows))
+
+    def test_parameters_change_discards_state(self):
+        self.run_incremental(self.gt_data, self.oba_data)
+        self.assertTrue(IncrementalState(self.state_dir, repeatGtRows=False).load())
+        self.assertFalse(IncrementalState(self.state_dir, repeatGtRows=True).load())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import json
+import os
+import tempfile
+import unittest
+
+from src.gt_merger import instrumentation
+from src.gt_merger.instrumentation import RunReport, stage
+
+
+class InstrumentationTest(unittest.TestCase):
+    """
+    Run report instrumentation test class.
+    """
+
+    def setUp(self):
+        """ Create the report used to perform tests. """
+        self.report = RunReport()
+        instrumentation.set_active_report(self.report)
+
+    def tearDown(self):
+        """ Stop recording stages. """
+        instrumentation.set_active_report(None)
+
+    def test_stage_records(self):
+        """ Test that stages are recorded with their values in the order they finish """
+        with stage('outer', tolerance=30000) as record:
+            with stage('inner'):
+                pass
+            record['rows'] = 10
+        self.assertEqual(['inner', 'outer'], [record['name'] for record in self.report.stages])
+        outer = self.report.stages[1]
+        self.assertEqual(10, outer['rows'])
+        self.assertEqual(30000, outer['tolerance'])
+        self.assertGreaterEqual(outer['wall_seconds'], self.report.stages[0]['wall_seconds'])
+
+    def test_no_active_report(self):
+        instrumentation.set_active_report(None)
+        with stage('ignored'):
+            pass
+        self.assertEqual([], self.report.stages)
+
+    def test_write(self):
+        """ Test that the report is saved as JSON with the stages added from other reports """
+        task_report = RunReport()
+        with task_report.stage('save_merged'):
+            pass
+        instrumentation.add_stages(task_report.stages)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            report_path = os.path.join(temp_dir, 'run_report.json')
+            self.report.write(report_path, arguments={'workers': 1})
+            with open(report_path) as f:
+                report = json.load(f)
+        self.assertEqual({'workers': 1}, report['arguments'])
+        self.assertEqual(['save_merged'], [record['name'] for record in report['stages']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import unittest
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import preprocess
+from src.gt_merger.interval_join import window_bounds, expand_windows, matched_bitmap, merge_user_to_many
+
+
+class IntervalJoinTest(unittest.TestCase):
+    """
+    Sorted-array interval join test class.
+    """
+
+    def setUp(self):
+        """ Load dataframes used to perform tests. """
+        oba_file_path = os.path.join(os.path.dirname(__file__), 'data_test/travel-behavior-test.csv')
+        oba_df = pd.read_csv(oba_file_path)
+        oba_df['Device Trip ID'] = oba_df['Trip ID']
+        self.clean_oba_df, _ = preprocess.preprocess_oba_data(oba_df, 5, 50, True)
+        gt_file_path = os.path.join(os.path.dirname(__file__), 'data_test/GT_test.xlsx')
+        gt_df = pd.read_excel(gt_file_path, engine='openpyxl')
+        self.clean_gt_df, _ = preprocess.preprocess_gt_data(gt_df, True)
+        self.points = np.array([10, 20, 20, 30, 50], dtype=np.int64)
+        self.lo, self.hi = window_bounds(self.points, np.array([0, 20, 40, 60, 35]), np.array([5, 30, 50, 70, 30]))
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_window_bounds_are_closed(self):
+        """ Test that both ends of a window are included and inverted windows are empty """
+        self.assertEqual([0, 1, 4, 5, 4], self.lo.tolist())
+        self.assertEqual([0, 4, 5, 5, 4], self.hi.tolist())
+
+    def test_expand_windows(self):
+        """ Test that empty windows produce one row with point position -1 """
+        window_positions, point_positions, offsets = expand_windows(self.lo, self.hi)
+        self.assertEqual([0, 1, 1, 1, 2, 3, 4], window_positions.tolist())
+        self.assertEqual([-1, 1, 2, 3, 4, -1, -1], point_positions.tolist())
+        self.assertEqual([0, 0, 1, 2, 0, 0, 0], offsets.tolist())
+
+    def test_matched_bitmap(self):
+        """ Test that only points inside a window are flagged as matched """
+        self.assertEqual([False, True, True, True, True], matched_bitmap(self.lo, self.hi, len(self.points)).tolist())
+
+    def test_merge_user_to_many(self):
+        """ Test that every activity of the user is either matched or reported as unmatched """
+        gt_data_collector = self.clean_gt_df[self.clean_gt_df['GT_Collector'] == 'Stark'].sort_values(
+            'GT_DateTimeOrigUTC')
+        oba_data_user = self.clean_oba_df[self.clean_oba_df['User ID'] == 'obaUser_006'].sort_values(
+            'Activity Start Date and Time* (UTC)')
+        merged_df, matches_df, unmatched_df = merge_user_to_many(gt_data_collector, oba_data_user, 'Stark',
+                                                                 'obaUser_006', False)
+        self.assertEqual(len(gt_data_collector), len(matches_df))
+        self.assertEqual(matches_df['GT_NumberOfTransitions'].clip(lower=1).sum(), len(merged_df))
+        matched_trips = merged_df['Trip ID'].dropna().unique()
+        self.assertEqual(len(oba_data_user), len(matched_trips) + len(unmatched_df))
+        self.assertTrue((unmatched_df['GT_Collector'] == 'Stark').all())
+
+
+if __name__ == '__main__':
+    unittest.main()
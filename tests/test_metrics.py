@@ -0,0 +1,54 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import unittest
+import numpy as np
+import pandas as pd
+
+from src.gt_merger.metrics import haversine_distance, time_difference
+
+
+class MetricsTest(unittest.TestCase):
+    """
+    Vectorized time and distance differences test class.
+    """
+
+    def setUp(self):
+        """ Create the arrays used to perform tests. """
+        self.start = pd.Series(pd.to_datetime(['2021-03-04 15:28:15', '2021-03-04 15:41:51', None]).tz_localize(
+            'America/Chicago'))
+        self.end = pd.Series(pd.to_datetime(['2021-03-04 21:30:15', None, '2021-03-04 21:30:15'], utc=True))
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_haversine_distance(self):
+        """ Test the distance between Lyon and Paris and NaN handling """
+        distances = haversine_distance([45.7597, np.nan], [4.8422, 4.8422], [48.8567, 48.8567], [2.3508, 2.3508])
+        self.assertAlmostEqual(392217.2595594006, distances[0], places=3)
+        self.assertTrue(np.isnan(distances[1]))
+
+    def test_time_difference(self):
+        """ Test the difference in seconds across time zones and NaT handling """
+        differences = time_difference(self.end, self.start)
+        self.assertEqual(120.0, differences[0])
+        self.assertTrue(np.isnan(differences[1:]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
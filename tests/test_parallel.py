@@ -0,0 +1,57 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import unittest
+
+from src.gt_merger.parallel import get_shared_data, map_in_pool
+
+
+def scale_task(task):
+    """ Task used to perform tests, it returns the id of the process running it """
+    return task * get_shared_data()['factor'], os.getpid()
+
+
+class ParallelTest(unittest.TestCase):
+    """
+    Process pool with shared data test class.
+    """
+
+    def setUp(self):
+        """ Create the tasks used to perform tests. """
+        self.tasks = list(range(20))
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_serial(self):
+        """ Test that a single worker runs the tasks in this process """
+        results = list(map_in_pool(scale_task, self.tasks, 1, {'factor': 3}))
+        self.assertEqual([task * 3 for task in self.tasks], [value for value, _ in results])
+        self.assertEqual({os.getpid()}, {pid for _, pid in results})
+        self.assertEqual({}, get_shared_data())
+
+    def test_pool_keeps_task_order(self):
+        """ Test that the results of a pool are in the order of the tasks """
+        results = list(map_in_pool(scale_task, self.tasks, 2, {'factor': 3}))
+        self.assertEqual([task * 3 for task in self.tasks], [value for value, _ in results])
+        self.assertNotIn(os.getpid(), {pid for _, pid in results})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import unittest
+import numpy as np
+import pandas as pd
+
+from src.gt_merger.partition import PartitionIndex
+
+
+class PartitionIndexTest(unittest.TestCase):
+    """
+    Partition index by key and time test class.
+    """
+
+    def setUp(self):
+        """ Create the dataframe used to perform tests. """
+        self.data = pd.DataFrame({'User ID': ['b', 'a', 'b', np.nan, 'a', 'b'],
+                                  'Start': pd.to_datetime(['2021-03-04 10:00', '2021-03-04 09:00', None,
+                                                           '2021-03-04 08:00', '2021-03-04 08:30',
+                                                           '2021-03-04 09:00'], utc=True)})
+        self.index = PartitionIndex(self.data, 'User ID', 'Start')
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_keys_in_order_of_appearance(self):
+        self.assertEqual(['b', 'a'], self.index.keys[:2].tolist())
+        self.assertTrue(pd.isna(self.index.keys[2]))
+
+    def test_rows_sorted_by_time(self):
+        """ Test that the rows of each key are sorted by time with NaT last """
+        self.assertEqual([5, 0, 2], self.index.rows('b').tolist())
+        self.assertEqual([4, 1], self.index.rows('a').tolist())
+        pd.testing.assert_frame_equal(self.data.loc[[5, 0, 2]], self.index.get('b'))
+
+    def test_missing_keys_are_empty(self):
+        self.assertEqual(0, len(self.index.get(np.nan)))
+        self.assertEqual(0, len(self.index.get('c')))
+
+
+if __name__ == '__main__':
+    unittest.main()
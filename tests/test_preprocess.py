@@ -15,6 +15,7 @@
  * limitations under the License.
  */
  """
+import datetime
 import os
 import unittest
 import pandas as pd
@@ -58,6 +59,19 @@ class PreprocessTest(unittest.TestCase):
         self.assertEqual(0, (self.clean_oba_df['Origin-Destination Bird-Eye Distance* (meters)'] <
                          constants.MIN_TRIP_LENGTH).sum())
 
+    def test_oba_dropped_reasons(self):
+        """ Test that every row is either kept or dropped with the first rule that dropped it"""
+        clean_oba_df, dropped_oba_df = preprocess.preprocess_oba_data(self.oba_df, 5, 50, True)
+        self.assertEqual(len(self.oba_df), len(clean_oba_df) + len(dropped_oba_df))
+        reasons = dropped_oba_df[constants.DROP_REASON_COL]
+        self.assertTrue((dropped_oba_df.loc[reasons == constants.DROP_REASON_STILL, 'Google Activity'] == 'STILL')
+                        .all())
+        self.assertTrue((dropped_oba_df.loc[reasons == constants.DROP_REASON_TOO_SHORT, 'Duration* (minutes)'] < 5)
+                        .all())
+        too_near = dropped_oba_df[reasons == constants.DROP_REASON_TOO_NEAR]
+        self.assertTrue((too_near['Duration* (minutes)'] >= 5).all())
+        self.assertTrue((too_near['Origin-Destination Bird-Eye Distance* (meters)'] < 50).all())
+
     def test_gt_no_unnamed_cols(self):
         """ Test that unnamed columns were removed"""
         unnamed_cols = [col for col in self.clean_gt_df.columns if 'Unnamed' in col]
@@ -67,6 +81,35 @@ class PreprocessTest(unittest.TestCase):
         """ Test that 'GT_DateTimeDestUTC' was converted to datetime, this column is used for asoft merging"""
         self.assertTrue(pd.api.types.is_datetime64_any_dtype(self.clean_gt_df['GT_DateTimeDestUTC']))
 
+    def test_gt_time_of_day_formats(self):
+        """ Test that times of the day are parsed from time objects and strings"""
+        offsets = preprocess.parse_time_of_day(pd.Series([datetime.time(15, 28, 15), '15:28:15', '3:28:15 PM',
+                                                          '15:28', None, 'not a time']))
+        expected = [pd.Timedelta('15:28:15')] * 3 + [pd.Timedelta('15:28:00')]
+        self.assertEqual(expected, offsets[:4].tolist())
+        self.assertTrue(offsets[4:].isna().all())
+
+    def test_gt_several_time_zones(self):
+        """ Test that trips recorded in several time zones are converted to UTC"""
+        gt_df = self.gt_df.head(2).copy()
+        gt_df['GT_TimeZone'] = ['America/Chicago', 'America/New_York']
+        clean_gt_df, _ = preprocess.preprocess_gt_data(gt_df, True)
+        self.assertEqual(pd.Timestamp('2021-03-04 21:28:15', tz='UTC'), clean_gt_df['GT_DateTimeOrigUTC'].iloc[0])
+        self.assertEqual(pd.Timestamp('2021-03-04 20:41:51', tz='UTC'), clean_gt_df['GT_DateTimeOrigUTC'].iloc[1])
+
+    def test_gt_duplicate_index(self):
+        """ Test that the rows of a GT frame with duplicate index labels are preprocessed by position"""
+        first_gt_df = self.gt_df.copy()
+        first_gt_df.loc[0, 'GT_TimeOrig'] = None
+        clean_first_gt_df, dropped_first_gt_df = preprocess.preprocess_gt_data(first_gt_df, True)
+        clean_gt_df, dropped_gt_df = preprocess.preprocess_gt_data(pd.concat([first_gt_df, self.gt_df]), True)
+        self.assertEqual(len(clean_first_gt_df) + len(self.clean_gt_df), len(clean_gt_df))
+        self.assertEqual(len(self.gt_df) * 2 - len(clean_gt_df), len(dropped_gt_df))
+        self.assertEqual(len(dropped_first_gt_df), len(self.gt_df) - len(self.clean_gt_df) + 1)
+        for col in ['GT_DateTimeOrigUTC', 'GT_DateTimeDestUTC']:
+            self.assertEqual(clean_first_gt_df[col].tolist() + self.clean_gt_df[col].tolist(),
+                             clean_gt_df[col].tolist())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,116 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import tempfile
+import unittest
+import pandas as pd
+
+from src.gt_merger import constants, preprocess, readers, schema
+
+
+class ReadersTest(unittest.TestCase):
+    """
+    Chunked OBA data reader and GT data reader test class.
+    """
+
+    def setUp(self):
+        """ Load dataframes used to perform tests. """
+        self.oba_file_path = os.path.join(os.path.dirname(__file__), 'data_test/travel-behavior-test.csv')
+        self.oba_df = pd.read_csv(self.oba_file_path)
+        self.gt_file_path = os.path.join(os.path.dirname(__file__), 'data_test/GT_test.xlsx')
+        self.gt_df = pd.read_excel(self.gt_file_path)
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """ Remove the folder of the exported files. """
+        self.temp_dir.cleanup()
+
+    def test_valid_oba_file(self):
+        self.assertTrue(readers.is_valid_oba_file(self.oba_file_path))
+
+    def test_read_in_chunks(self):
+        """ Test that reading in chunks with filters gives the same preprocessed data as reading the whole file """
+        devices = ['obaUser_000', 'obaUser_006']
+        oba_data = readers.read_oba_data(self.oba_file_path, devices, True, chunk_size=10)
+        expected = self.oba_df[self.oba_df['User ID'].isin(devices) & (self.oba_df['Google Activity'] != 'STILL')]
+        self.assertEqual(len(expected), len(oba_data))
+        self.assertTrue(set(oba_data['User ID']).issubset(devices))
+        self.assertTrue(pd.api.types.is_datetime64tz_dtype(oba_data['Activity Start Date and Time* (UTC)']))
+
+        clean_chunked, _ = preprocess.preprocess_oba_data(oba_data, 5, 50, True)
+        clean_expected, _ = preprocess.preprocess_oba_data(schema.apply_oba_schema(expected), 5, 50, True)
+        pd.testing.assert_frame_equal(clean_expected.reset_index(drop=True), clean_chunked.reset_index(drop=True))
+
+    def test_parse_oba_datetime(self):
+        """ Test the explicit format and the fallback for other formats """
+        date_times = readers.parse_oba_datetime(pd.Series(['2019-06-16T00:49:52Z', '2019-06-16 00:49:52.5', None,
+                                                           'not a date']))
+        self.assertEqual(pd.Timestamp('2019-06-16 00:49:52', tz='UTC'), date_times[0])
+        self.assertEqual(pd.Timestamp('2019-06-16 00:49:52.5', tz='UTC'), date_times[1])
+        self.assertTrue(date_times[2:].isna().all())
+
+    def test_compact_types(self):
+        """ Test that the repeated strings are categoricals and that both frames share the mode categories """
+        oba_data = readers.read_oba_data(self.oba_file_path, [], False)
+        gt_data = readers.read_gt_data(self.gt_file_path)
+        self.assertIsInstance(oba_data['User ID'].dtype, pd.CategoricalDtype)
+        self.assertEqual('float32', oba_data['Duration* (minutes)'].dtype)
+        self.assertEqual('boolean', oba_data['Talk Back Enabled'].dtype)
+        self.assertEqual(self.oba_df['Google Activity'].tolist(), oba_data['Google Activity'].astype(object).tolist())
+        self.assertTrue(schema.same_categories(gt_data['GT_Mode'], oba_data['Google Activity']))
+        self.assertEqual(object, schema.with_numpy_dtypes(oba_data)['User ID'].dtype)
+
+    def test_read_gt_xlsx(self):
+        """ Test that the GT reader loads the same data as pd.read_excel, without the columns not used """
+        gt_data = readers.read_gt_data(self.gt_file_path)
+        self.assertTrue(set(gt_data.columns).issubset(readers.GT_INPUT_COLUMNS))
+        pd.testing.assert_frame_equal(schema.apply_gt_schema(self.gt_df[gt_data.columns]), gt_data)
+
+    def test_read_gt_exports(self):
+        """ Test that csv and parquet exports of the GT sheet give the same preprocessed data as the xlsx file """
+        gt_data = readers.read_gt_data(self.gt_file_path)
+        csv_path = os.path.join(self.temp_dir.name, 'gt.csv')
+        gt_data.to_csv(csv_path, index=False)
+        parquet_path = os.path.join(self.temp_dir.name, 'gt.parquet')
+        gt_data.astype({'GT_TimeOrig': str, 'GT_TimeDest': str}).to_parquet(parquet_path, index=False)
+        clean_expected, _ = preprocess.preprocess_gt_data(gt_data, True)
+        for gt_path in [csv_path, parquet_path]:
+            clean_gt_data, _ = preprocess.preprocess_gt_data(readers.read_gt_data(gt_path), True)
+            # GT_Date is loaded as text from csv files, the dates and times are parsed by the preprocess
+            pd.testing.assert_frame_equal(clean_expected.drop(columns='GT_Date'), clean_gt_data.drop(columns='GT_Date'),
+                                          check_dtype=False)
+
+    def test_read_gt_sheets(self):
+        """ Test reading a workbook with a sheet for every collector """
+        xlsx_path = os.path.join(self.temp_dir.name, 'gt.xlsx')
+        with pd.ExcelWriter(xlsx_path) as writer:
+            for collector, collector_df in self.gt_df.groupby('GT_Collector', sort=False):
+                collector_df.drop(columns='GT_Collector').to_excel(writer, sheet_name=collector, index=False)
+        gt_data = readers.read_gt_data(xlsx_path, constants.GT_ALL_SHEETS)
+        self.assertEqual(self.gt_df['GT_Collector'].tolist(), gt_data['GT_Collector'].tolist())
+        first_collector = self.gt_df['GT_Collector'].iloc[0]
+        first_sheet_data = readers.read_gt_data(xlsx_path, [first_collector])
+        self.assertEqual(len(self.gt_df[self.gt_df['GT_Collector'] == first_collector]), len(first_sheet_data))
+        self.assertEqual([first_collector] * len(first_sheet_data), first_sheet_data['GT_Collector'].tolist())
+        self.assertNotIn('GT_Collector', readers.read_gt_data(xlsx_path).columns)
+        with self.assertRaises(ValueError):
+            readers.read_gt_data(xlsx_path, ['missing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
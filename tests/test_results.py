@@ -0,0 +1,67 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import unittest
+import numpy as np
+import pandas as pd
+
+from src.gt_merger.results import ResultBuilder, ColumnarResultBuilder
+
+
+class ResultBuilderTest(unittest.TestCase):
+    """
+    Result builders test class.
+    """
+
+    def setUp(self):
+        """ Create the chunks used to perform tests. """
+        self.chunks = [pd.DataFrame({'A': [1, 2], 'B': pd.to_datetime(['2021-03-04 10:00', None], utc=True)}),
+                       pd.DataFrame({'A': [3.5], 'C': ['x']}),
+                       pd.DataFrame({'B': pd.to_datetime(['2021-03-05 10:00'], utc=True), 'C': ['y']})]
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_columnar_builder_equals_concat(self):
+        """ Test that the columnar builder returns the same data as a single concat """
+        builder = ColumnarResultBuilder(['C', 'A', 'B'], capacity=1)
+        for chunk in self.chunks:
+            builder.append(chunk)
+        expected = pd.concat(self.chunks, ignore_index=True)[['C', 'A', 'B']]
+        pd.testing.assert_frame_equal(expected, builder.build())
+
+    def test_columnar_builder_schema(self):
+        """ Test that missing schema columns are NaN and extra columns are appended """
+        builder = ColumnarResultBuilder(['D', 'A'])
+        builder.append(self.chunks[0])
+        result = builder.build()
+        self.assertEqual(['D', 'A', 'B'], list(result.columns))
+        self.assertTrue(result['D'].isna().all())
+        self.assertTrue(np.issubdtype(result['A'].dtype, np.integer))
+
+    def test_result_builder(self):
+        """ Test that the chunk collector returns all the rows with a new index """
+        builder = ResultBuilder()
+        for chunk in self.chunks:
+            builder.append(chunk)
+        self.assertEqual(4, len(builder))
+        self.assertEqual(list(range(4)), builder.build().index.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import tempfile
+import unittest
+
+from src.gt_merger.args import get_parser
+from src.gt_merger.merging import merge, merge_to_many, prepare_merged_data
+from src.gt_merger.readers import read_oba_data
+from src.gt_merger.session import MergeConfig, MergeSession
+from src.gt_merger.synthetic import make_dataset
+
+
+class MergeSessionTest(unittest.TestCase):
+    """
+    Merge session test class.
+    """
+
+    def setUp(self):
+        """ Load a synthetic campaign to a session. """
+        self.gt_data, oba_data = make_dataset(collectors=2, devices=3, days=2, trips_per_day=6, seed=5)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.oba_file_path = os.path.join(self.temp_dir.name, 'oba.csv')
+        oba_data.to_csv(self.oba_file_path, index=False)
+        self.config = MergeConfig(min_activity_duration=5, min_trip_length=50)
+        self.session = MergeSession(self.config).load(self.gt_data, self.oba_file_path)
+
+    def tearDown(self):
+        """ Remove the folder of the OBA data file. """
+        self.temp_dir.cleanup()
+
+    def test_merges_with_several_tolerances(self):
+        """ Test that the merges of a session are the same as merging the preprocessed data every time """
+        clean_gt_df = self.session.gt_data.copy()
+        clean_oba_df = self.session.oba_data.copy()
+        for tolerance in [300000, 900000, 60000]:
+            merged_data_frame, num_matches_df, unmatched_df = self.session.merge(tolerance, merge_one_to_one=True)
+            expected_merged, expected_num_matches = merge(clean_gt_df, clean_oba_df, tolerance)
+            self.assertTrue(prepare_merged_data(expected_merged).equals(merged_data_frame))
+            self.assertTrue(expected_num_matches.equals(num_matches_df))
+            self.assertIsNone(unmatched_df)
+
+        merged_data_frame, _, unmatched_df = self.session.merge(repeat_gt_rows=True)
+        expected_merged, _, expected_unmatched = merge_to_many(clean_gt_df, clean_oba_df, self.config.tolerance,
+                                                               repeat_gt_rows=True)
+        self.assertTrue(prepare_merged_data(expected_merged).equals(merged_data_frame))
+        self.assertTrue(expected_unmatched.equals(unmatched_df))
+        # Merging to many is done only once
+        self.assertIs(merged_data_frame, self.session.merge(60000, repeat_gt_rows=True)[0])
+
+    def test_load_dataframes(self):
+        """ Test that the OBA data can be loaded from a dataframe instead of a file """
+        oba_df = read_oba_data(self.oba_file_path, [], True)
+        session = MergeSession(self.config).load(self.gt_data, oba_df)
+        self.assertTrue(self.session.oba_data.equals(session.oba_data))
+        self.assertTrue(self.session.gt_data.equals(session.gt_data))
+
+    def test_merge_before_load(self):
+        with self.assertRaises(ValueError):
+            MergeSession().merge()
+
+    def test_config_replace(self):
+        config = self.config.replace(tolerance=60000)
+        self.assertEqual(60000, config.tolerance)
+        self.assertEqual(5, config.min_activity_duration)
+        with self.assertRaises(TypeError):
+            self.config.replace(tolerence=60000)
+
+    def test_config_cache_in_output_dir(self):
+        """ Test that the cache is saved in the output folder unless another folder is given """
+        files = ['--obaFile', 'oba.csv', '--gtFile', 'gt.xlsx']
+        config = MergeConfig.from_args(get_parser(files + ['--outputDir', 'output']))
+        self.assertEqual(os.path.join('output', 'cache'), config.cache_dir)
+        config = MergeConfig.from_args(get_parser(files + ['--outputDir', 'output', '--cacheDir', 'cache']))
+        self.assertEqual('cache', config.cache_dir)
+        self.assertIsNone(MergeConfig.from_args(get_parser(files + ['--noCache'])).cache_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger.spatial import OriginGrid, SpatialSweep, spatial_candidates
+from src.gt_merger.synthetic import preprocessed_dataset
+
+
+class SpatialSweepTest(unittest.TestCase):
+    """
+    Spatio-temporal matching test class.
+    """
+
+    def setUp(self):
+        """ Preprocess a synthetic campaign. """
+        self.clean_gt_df, self.clean_oba_df = preprocessed_dataset(collectors=3, devices=6, days=3, trips_per_day=8,
+                                                                   seed=1)
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_spatial_candidates(self):
+        """ Test that the candidates have the same mode, a neighbouring cell and a value within the window """
+        grid = OriginGrid(np.array([27.9, 27.9, 27.9009, 27.95]), np.array([-82.5, -82.5005, -82.5, -82.5]), 200)
+        cells = [grid.cells(np.array([27.9]), np.array([-82.5]), (row, col)) for row in (-1, 0, 1)
+                 for col in (-1, 0, 1)]
+        point_cells = grid.cells(np.array([27.9, 27.9009, 27.95, 27.9, 27.9]),
+                                 np.array([-82.5005, -82.5, -82.5, -82.5, -82.5]))
+        windows, points = spatial_candidates(np.array([100]), np.array([0]), cells,
+                                             np.array([150, 120, 110, 90, 130]), np.array([0, 0, 0, 0, 1]),
+                                             point_cells, 50)
+        self.assertEqual([0, 0], windows.tolist())
+        self.assertEqual([0, 1], sorted(points.tolist()))
+
+    def test_matches_within_distance_and_tolerance(self):
+        """ Test that every merged activity has the same mode and is within the tolerance and the distance """
+        sweep = SpatialSweep(self.clean_gt_df, self.clean_oba_df, 300, 600000)
+        merged_df, matches_df = sweep.merge(600000)
+        matched = merged_df.dropna(subset=['Trip ID'])
+        self.assertGreater(len(matched), 0)
+        time_difference = matched['Activity Start Date and Time* (UTC)'] - matched['GT_DateTimeOrigUTC']
+        self.assertTrue((time_difference >= pd.Timedelta(0)).all())
+        self.assertTrue((time_difference <= pd.Timedelta('600000ms')).all())
+        self.assertTrue((matched['Distance_Difference'] <= 300).all())
+        self.assertTrue((matched['GT_Mode'].astype(object) == matched['Google Activity'].astype(object)).all())
+        self.assertEqual(len(matched), matches_df.drop(columns=['GT_Collector', 'total_trips']).to_numpy().sum())
+
+    def test_lower_tolerances_reuse_candidates(self):
+        """ Test that merging with a lower tolerance than the one of the candidates gives the same matches """
+        sweep = SpatialSweep(self.clean_gt_df, self.clean_oba_df, 500, 900000)
+        for tolerance in [120000, 300000, 1200000]:
+            merged_df, _ = sweep.merge(tolerance)
+            expected_df, _ = SpatialSweep(self.clean_gt_df, self.clean_oba_df, 500, tolerance).merge(tolerance)
+            pd.testing.assert_frame_equal(expected_df, merged_df)
+        with self.assertRaises(ValueError):
+            SpatialSweep(self.clean_gt_df, self.clean_oba_df, 0, 900000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from src.gt_merger.merging import merge_to_many, prepare_merged_data
+from src.gt_merger.session import MergeConfig, MergeSession
+from src.gt_merger.sql_backend import SqlMergeBackend
+from src.gt_merger.synthetic import preprocessed_dataset
+
+
+class SqlMergeBackendTest(unittest.TestCase):
+    """
+    SQLite merge backend test class.
+    """
+
+    def setUp(self):
+        """ Preprocess a synthetic campaign and create a temporary folder for the databases. """
+        self.clean_gt_df, self.clean_oba_df = preprocessed_dataset(collectors=3, devices=6, days=3, trips_per_day=10,
+                                                                   seed=3)
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """ Remove the temporary folder. """
+        self.temp_dir.cleanup()
+
+    def test_same_results_as_merge_to_many(self):
+        """ Test that the chunks of merged data, the number of matches and the unmatched activities are the same """
+        for repeat_gt_rows in [False, True]:
+            merged_df, num_matches_df, unmatched_df = merge_to_many(self.clean_gt_df, self.clean_oba_df, 0,
+                                                                    repeat_gt_rows=repeat_gt_rows)
+            database_path = os.path.join(self.temp_dir.name, 'merge_' + str(repeat_gt_rows) + '.sqlite')
+            with SqlMergeBackend(self.clean_gt_df, self.clean_oba_df, database_path, repeat_gt_rows) as backend:
+                # The chunks split some bunches of matches
+                chunks = list(backend.merged_chunks(chunk_size=37))
+                self.assertGreater(len(chunks), 1)
+                self.assertEqual(len(merged_df), backend.num_merged_rows)
+                pd.testing.assert_frame_equal(prepare_merged_data(merged_df), pd.concat(chunks, ignore_index=True))
+                self.assertEqual(len(num_matches_df), backend.num_matches_rows)
+                pd.testing.assert_frame_equal(num_matches_df,
+                                              pd.concat(backend.num_matches_chunks(chunk_size=37), ignore_index=True))
+                self.assertEqual(len(unmatched_df), backend.num_unmatched_rows)
+                pd.testing.assert_frame_equal(unmatched_df,
+                                              pd.concat(backend.unmatched_chunks(chunk_size=7), ignore_index=True))
+
+    def test_saved_results(self):
+        """ Test that the files saved with the sqlite backend are the same as the ones saved with pandas """
+        for backend in ['pandas', 'sqlite']:
+            output_path = os.path.join(self.temp_dir.name, backend)
+            os.mkdir(output_path)
+            session = MergeSession(MergeConfig(backend=backend)).load(self.clean_gt_df, self.clean_oba_df)
+            session.save_results(output_path, tolerances=[30000, 60000])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.temp_dir.name, 'pandas'))),
+                         sorted(os.listdir(os.path.join(self.temp_dir.name, 'sqlite'))))
+        for file_name in os.listdir(os.path.join(self.temp_dir.name, 'pandas')):
+            with open(os.path.join(self.temp_dir.name, 'pandas', file_name)) as expected, \
+                    open(os.path.join(self.temp_dir.name, 'sqlite', file_name)) as data:
+                self.assertEqual(expected.read(), data.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
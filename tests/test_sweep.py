@@ -0,0 +1,70 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import unittest
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import preprocess
+from src.gt_merger.sweep import ToleranceSweep, forward_candidates, NO_CANDIDATE_GAP
+
+
+class ToleranceSweepTest(unittest.TestCase):
+    """
+    Single-pass multi-tolerance sweep test class.
+    """
+
+    def setUp(self):
+        """ Load dataframes used to perform tests. """
+        oba_file_path = os.path.join(os.path.dirname(__file__), 'data_test/travel-behavior-test.csv')
+        oba_df = pd.read_csv(oba_file_path)
+        self.clean_oba_df, _ = preprocess.preprocess_oba_data(oba_df, 5, 50, True)
+        gt_file_path = os.path.join(os.path.dirname(__file__), 'data_test/GT_test.xlsx')
+        gt_df = pd.read_excel(gt_file_path, engine='openpyxl')
+        self.clean_gt_df, _ = preprocess.preprocess_gt_data(gt_df, True)
+        self.sweep = ToleranceSweep(self.clean_gt_df, self.clean_oba_df)
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_forward_candidates(self):
+        """ Test that the candidate is the first point with the same key at or after the window start """
+        candidates, gaps = forward_candidates(np.array([10, 10, 35, 5]), np.array([0, 1, 0, -1]),
+                                              np.array([10, 20, 30]), np.array([1, 0, 0]))
+        self.assertEqual([1, 0, -1, -1], candidates.tolist())
+        self.assertEqual([10, 0, NO_CANDIDATE_GAP, NO_CANDIDATE_GAP], gaps.tolist())
+
+    def test_matches_grow_with_tolerance(self):
+        """ Test that the number of matches never decreases when the tolerance grows """
+        num_matches = [self.sweep.matched(tol).sum() for tol in range(0, 3600001, 300000)]
+        self.assertEqual(sorted(num_matches), num_matches)
+
+    def test_merge_within_tolerance(self):
+        """ Test that every merged activity starts no later than the tolerance after the GT trip """
+        merged_df, matches_df = self.sweep.merge(300000)
+        matched = merged_df.dropna(subset=['Trip ID'])
+        time_difference = matched['Activity Start Date and Time* (UTC)'] - matched['GT_DateTimeOrigUTC']
+        self.assertTrue((time_difference >= pd.Timedelta(0)).all())
+        self.assertTrue((time_difference <= pd.Timedelta('300000ms')).all())
+        self.assertTrue((matched['GT_Mode'] == matched['Google Activity']).all())
+        self.assertEqual(len(matched), matches_df.drop(columns=['GT_Collector', 'total_trips']).to_numpy().sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
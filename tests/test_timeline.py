@@ -0,0 +1,68 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.gt_merger.sweep import ToleranceSweep
+from src.gt_merger.synthetic import preprocessed_dataset
+from src.gt_merger.timeline import TimelineSweep, timeline_candidates
+
+
+class TimelineSweepTest(unittest.TestCase):
+    """
+    Global timeline one to one merge test class.
+    """
+
+    def setUp(self):
+        """ Preprocess a synthetic campaign. """
+        self.clean_gt_df, self.clean_oba_df = preprocessed_dataset(collectors=3, devices=6, days=3, trips_per_day=10,
+                                                                   seed=2)
+
+    def tearDown(self):
+        """ Clean up test suite - no-op. """
+        pass
+
+    def test_timeline_candidates(self):
+        """ Test that the first point of every group within the window is found, only for the same key """
+        windows, points = timeline_candidates(np.array([0, 10]), np.array([0, 1]), np.array([5, 3, 12, 4, 30]),
+                                              np.array([0, 0, 1, 0, 1]), np.array([0, 0, 0, 1, 1]), 10)
+        self.assertEqual([0, 0, 1], windows.tolist())
+        self.assertEqual([1, 3, 2], points.tolist())
+
+    def test_same_matches_as_tolerance_sweep(self):
+        """ Test that the merged pairs and the number of matches are the ones of ToleranceSweep, in long format """
+        sweep = TimelineSweep(self.clean_gt_df, self.clean_oba_df, 300000)
+        tolerance_sweep = ToleranceSweep(self.clean_gt_df, self.clean_oba_df)
+        key_cols = ['GT_Collector', 'GT_TourID', 'GT_TripID', 'User ID']
+        for tolerance in [60000, 300000, 3600000]:
+            merged_df, matches_df = sweep.merge(tolerance)
+            expected_df, expected_matches_df = tolerance_sweep.merge(tolerance)
+            pd.testing.assert_frame_equal(expected_matches_df, matches_df)
+            matched = merged_df[merged_df['Time_Difference'].notna()].sort_values(key_cols, ignore_index=True)
+            expected = expected_df[expected_df['Time_Difference'].notna()].sort_values(key_cols, ignore_index=True)
+            pd.testing.assert_frame_equal(expected, matched)
+            # Every GT trip is in the long format data, once if it has no match
+            self.assertEqual(len(self.clean_gt_df), len(merged_df.drop_duplicates(key_cols[:3])))
+            self.assertEqual(len(matched) + len(self.clean_gt_df) - matched[key_cols[:3]].drop_duplicates().shape[0],
+                             len(merged_df))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+/*
+ * Copyright (C) 2019-2021 University of South Florida
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+ """
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from src.gt_merger import preprocess
+from src.gt_merger.writers import AsyncOutputWriter, OutputWriter, is_output_format_available, read_output
+
+
+@unittest.skipUnless(is_output_format_available('parquet'), "pyarrow is not installed")
+class OutputWriterTest(unittest.TestCase):
+    """
+    Output writers test class.
+    """
+
+    def setUp(self):
+        """ Create an output folder and preprocess the data used to perform tests. """
+        self.temp_dir = tempfile.TemporaryDirectory()
+        oba_df = pd.read_csv(os.path.join(os.path.dirname(__file__), 'data_test/travel-behavior-test.csv'))
+        self.clean_oba_df, _ = preprocess.preprocess_oba_data(oba_df, 5, 50, True)
+        self.clean_oba_df = self.clean_oba_df.reset_index(drop=True)
+
+    def tearDown(self):
+        """ Remove the output folder. """
+        self.temp_dir.cleanup()
+
+    def test_columnar_formats_keep_types(self):
+        """ Test that parquet and feather files keep the datetimes with their timezone """
+        for output_format in ['parquet', 'feather']:
+            file_path = OutputWriter(output_format).write(self.clean_oba_df, self.temp_dir.name, 'data')
+            self.assertTrue(file_path.endswith('.' + output_format))
+            data = read_output(file_path)
+            pd.testing.assert_frame_equal(self.clean_oba_df, data, check_dtype=False)
+            self.assertEqual(self.clean_oba_df['Activity Start Date and Time* (UTC)'].dtype,
+                             data['Activity Start Date and Time* (UTC)'].dtype)
+
+    def test_csv_compression(self):
+        file_path = OutputWriter('csv', 'gzip').write(self.clean_oba_df, self.temp_dir.name, 'data')
+        self.assertTrue(file_path.endswith('data.csv.gz'))
+        self.assertEqual(len(self.clean_oba_df), len(pd.read_csv(file_path)))
+
+    def test_mixed_types_are_saved_as_text(self):
+        data = pd.DataFrame({'GT_Comments': ['note', 3, np.nan], 'GT_TripID': [1, 2, 3]})
+        file_path = OutputWriter('parquet').write(data, self.temp_dir.name, 'data')
+        self.assertEqual(['note', '3', None], read_output(file_path)['GT_Comments'].tolist())
+
+    def test_write_chunks(self):
+        """ Test that the data saved in chunks is the same as the data saved at once """
+        chunks = [self.clean_oba_df.iloc[start:start + 7] for start in range(0, len(self.clean_oba_df), 7)]
+        for output_format in ['csv', 'parquet', 'feather']:
+            writer = OutputWriter(output_format)
+            expected = read_output(writer.write(self.clean_oba_df, self.temp_dir.name, 'data'))
+            data = read_output(writer.write_chunks(chunks, self.temp_dir.name, 'chunks'))
+            pd.testing.assert_frame_equal(expected, data)
+        # The values of every chunk are cast to the types of the sample
+        data = pd.DataFrame({'GT_Comments': [np.nan, 'note', 3], 'GT_TripID': [1, 2, 3]})
+        file_path = OutputWriter('parquet').write_chunks([data.iloc[:1], data.iloc[1:]], self.temp_dir.name, 'data',
+                                                         sample=data)
+        self.assertEqual([None, 'note', '3'], read_output(file_path)['GT_Comments'].tolist())
+
+    def test_dataset_partitioned_by_tolerance(self):
+        """ Test that the data of every tolerance is loaded at once with the tolerance as a column """
+        writer = OutputWriter('parquet')
+        for tolerance in [30000, 60000]:
+            writer.write_tolerance(self.clean_oba_df, self.temp_dir.name, 'mergedData', tolerance, partitioned=True)
+        dataset = read_output(os.path.join(self.temp_dir.name, 'mergedData'))
+        self.assertEqual(2 * len(self.clean_oba_df), len(dataset))
+        self.assertEqual([30000, 60000], sorted(dataset['tolerance'].astype(int).unique()))
+        # The csv format does not support datasets, a file is saved for every tolerance
+        file_path = OutputWriter('csv').write_tolerance(self.clean_oba_df, self.temp_dir.name, 'mergedData', 30000,
+                                                        partitioned=True)
+        self.assertEqual(os.path.join(self.temp_dir.name, 'mergedData_30000.csv'), file_path)
+
+    def test_async_writer(self):
+        """ Test that the queued files are written once the writer is flushed, and that a failed write is raised """
+        written = {}
+        with AsyncOutputWriter(OutputWriter('parquet'), threads=2, max_pending=2) as writer:
+            futures = [writer.write_tolerance(self.clean_oba_df, self.temp_dir.name, 'data', tol, True,
+                                              on_written=lambda path, tol=tol: written.update({tol: path}))
+                       for tol in [30000, 60000, 90000]]
+            writer.flush()
+            self.assertTrue(all(future.done() for future in futures))
+            self.assertEqual(3, len(written))
+            self.assertEqual(3 * len(self.clean_oba_df), len(read_output(os.path.join(self.temp_dir.name, 'data'))))
+
+            writer.write(self.clean_oba_df, os.path.join(self.temp_dir.name, 'missing', 'folder'), 'data')
+            with self.assertRaises(OSError):
+                writer.flush()
+
+
+if __name__ == '__main__':
+    unittest.main()